@@ -15,53 +15,102 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import asyncio
-import concurrent.futures
 import os
+import signal
 import sys
 from datetime import date, datetime, timedelta, timezone
+from typing import Callable, List, Optional, Tuple
 
 import discord
 import holidays
-from discord.ext import commands, tasks
+from discord.ext import commands
 from sentry_sdk import capture_exception
 
-from bot.core import evict_media, send_bird
-from bot.data import GenericError, database, logger
-from bot.data_functions import channel_setup, user_setup
+from bot.backup import backup
+from bot.cache import save_caches
+from bot.core import LEAN_SEND, evict_media, forget_uploads, send_bird
+from bot.data import GenericError, database, logger, pin_data, watch_data
+from bot.data_functions import channel_setup, mark_dirty, user_setup
 from bot.filters import Filter, MediaType
 from bot.functions import (
-    backup_all,
     drone_attack,
     get_all_users,
     handle_error,
     prune_user_cache,
+    restore_caches,
 )
+from bot.races import load_races
+from bot.scheduler import run_blocking, scheduler
+from bot.sharding import PROCESS_SCOPE, report_guilds, shard_options
 
 # The channel id that the backups send to
 BACKUPS_CHANNEL = os.getenv("SCIOLY_ID_BOT_BACKUPS_CHANNEL", "")
 
 
-class CustomBot(commands.Bot):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.on_message_handler = []
+class CustomBot(commands.AutoShardedBot):
+    """Bot that responds to mentions and `prefixes`, and runs message handlers.
+
+    Runs the shards set in bot.sharding, or a single shard.
+
+    `prefixes` (tuple) - command prefixes besides mentions
+    """
+
+    def __init__(self, *args, prefixes: Tuple[str, ...] = (), **kwargs):
+        super().__init__(
+            *args, command_prefix=commands.when_mentioned_or(*prefixes), **kwargs
+        )
+        self.prefixes = tuple(prefixes)
+        self.command_prefixes: Optional[Tuple[str, ...]] = None
+        self.on_message_handler: List[
+            Tuple[Callable, Optional[Callable[[discord.Message], bool]]]
+        ] = []
+        self.data_watcher = None
+
+    def compile_prefixes(self):
+        """Builds the prefixes to match once the bot's user id is known."""
+        # same prefixes as when_mentioned_or, without building a list per message
+        self.command_prefixes = (
+            f"<@{self.user.id}> ",
+            f"<@!{self.user.id}> ",
+        ) + self.prefixes
 
     async def on_message(self, message: discord.Message):
-        prefixes = await self.get_prefix(message)
-        if isinstance(prefixes, str):
-            command = message.content.startswith(prefixes)
-        else:
-            command = message.content.startswith(tuple(prefixes))
-
-        if not message.author.bot and not command:
-            for handler in self.on_message_handler:
+        if message.author.bot:
+            return
+        if self.command_prefixes is None:
+            self.compile_prefixes()
+        if message.content.startswith(self.command_prefixes):
+            await super().on_message(message)
+            return
+
+        for handler, predicate in self.on_message_handler:
+            if predicate is None or predicate(message):
                 await handler(message)
-        await super().on_message(message)
 
-    def add_message_handler(self, handler):
-        self.on_message_handler.append(handler)
+    def add_message_handler(
+        self,
+        handler,
+        predicate: Optional[Callable[[discord.Message], bool]] = None,
+    ):
+        """Runs `handler` on messages that aren't commands.
+
+        `handler` (coroutine function) - called with the message\n
+        `predicate` (function) - checks the message before `handler` runs,
+            should be fast and not use the network or database
+        """
+        self.on_message_handler.append((handler, predicate))
 
     async def setup_hook(self):
+        self.compile_prefixes()
+        restore_caches(self)
+        # before messages arrive, since the race autocheck only looks in memory
+        load_races()
+        if sys.platform != "win32":
+            # deploys stop the bot with SIGTERM, close cleanly so caches are saved
+            self.loop.add_signal_handler(
+                signal.SIGTERM, lambda: asyncio.ensure_future(self.close())
+            )
+
         # Here we load our extensions(cogs) that are located in the cogs directory, each cog is a collection of commands
         core_extensions = [
             "bot.cogs.get_birds",
@@ -95,6 +144,15 @@ class CustomBot(commands.Bot):
                     raise e
                 logger.error(f"Failed to load extension {extension}.", e)
 
+    async def close(self):
+        if not self.is_closed():
+            try:
+                save_caches()
+            except OSError as e:
+                logger.info(f"failed to save caches: {e}")
+            await scheduler.stop()
+        await super().close()
+
 
 if __name__ == "__main__":
     # Initialize bot
@@ -109,14 +167,13 @@ if __name__ == "__main__":
     cache_flags.voice = True
 
     bot = CustomBot(
-        command_prefix=commands.when_mentioned_or(
-            "b!", "b.", "b#", "B!", "B.", "B#", "o>", "O>"
-        ),
+        prefixes=("b!", "b.", "b#", "B!", "B.", "B#", "o>", "O>"),
         case_insensitive=True,
         description="BirdID - Your Very Own Ornithologist",
         help_command=commands.DefaultHelpCommand(verify_checks=False),
         intents=intent,
         member_cache_flags=cache_flags,
+        **shard_options(),
     )
 
     @bot.event
@@ -125,13 +182,13 @@ if __name__ == "__main__":
         logger.info("Logged in as:")
         logger.info(bot.user.name)
         logger.info(bot.user.id)
+        logger.info(f"shards: {list(bot.shards)} of {bot.shard_count}")
+        report_guilds(bot)
         # Change discord activity
         await bot.change_presence(activity=discord.Activity(type=3, name="birds"))
-        refresh_cache.start()
-        refresh_user_cache.start()
-        evict_user_cache.start()
-        if os.getenv("SCIOLY_ID_BOT_ENABLE_BACKUPS") != "false":
-            refresh_backup.start()
+        scheduler.start()
+        if os.getenv("SCIOLY_ID_BOT_WATCH_DATA") == "true" and not bot.data_watcher:
+            bot.data_watcher = asyncio.create_task(watch_data())
 
     if sys.platform == "win32":
         asyncio.set_event_loop(asyncio.ProactorEventLoop())
@@ -142,7 +199,10 @@ if __name__ == "__main__":
 
     @bot.check
     async def prechecks(ctx: commands.Context):
-        if ctx.interaction is None:
+        # keep the same bird lists for the whole command, even if they're reloaded
+        pin_data()
+
+        if ctx.interaction is None and not LEAN_SEND:
             await ctx.typing()
 
         logger.info("global check: checking permissions")
@@ -164,7 +224,10 @@ if __name__ == "__main__":
             raise GenericError(code=842)
 
         logger.info("global check: logging command frequency")
-        database.zincrby("frequency.command:global", 1, str(ctx.command))
+        pipe = database.pipeline(transaction=False)
+        pipe.zincrby("frequency.command:global", 1, str(ctx.command))
+        mark_dirty("frequency.command:global", pipe=pipe)
+        pipe.execute()
 
         logger.info("global check: database setup")
         await channel_setup(ctx)
@@ -208,6 +271,24 @@ if __name__ == "__main__":
             return await drone_attack(ctx)
         return True
 
+    @bot.event
+    async def on_guild_join(guild: discord.Guild):
+        report_guilds(bot)
+
+    @bot.event
+    async def on_guild_remove(guild: discord.Guild):
+        report_guilds(bot)
+
+    @bot.event
+    async def on_raw_message_delete(payload: discord.RawMessageDeleteEvent):
+        forget_uploads((payload.message_id,))
+
+    @bot.event
+    async def on_raw_bulk_message_delete(
+        payload: discord.RawBulkMessageDeleteEvent,
+    ):
+        forget_uploads(payload.message_ids)
+
     ######
     # GLOBAL ERROR CHECKING
     ######
@@ -222,54 +303,43 @@ if __name__ == "__main__":
 
         await handle_error(ctx, error)
 
-    @tasks.loop(minutes=10.0)
+    # the media cache and backups are shared by all processes, so they're
+    # cluster jobs that only run in one
+    @scheduler.job(minutes=10.0, cluster=True)
     async def refresh_cache():
         """Task to delete a random selection of cached birds to ensure freshness."""
         logger.info("TASK: Refreshing some cache items")
-        event_loop = asyncio.get_event_loop()
-        with concurrent.futures.ThreadPoolExecutor(1) as executor:
-            await event_loop.run_in_executor(executor, evict_media)
+        await run_blocking(evict_media)
 
-    @tasks.loop(hours=3.0)
+    @scheduler.job(hours=3.0)
     async def refresh_user_cache():
         """Task to update User cache to increase performance of commands."""
         logger.info("TASK: Updating User cache")
-        await get_all_users(bot)
+        await get_all_users(bot, scope=PROCESS_SCOPE)
 
-    @tasks.loop(minutes=8.0)
+    @scheduler.job(minutes=8.0)
     async def evict_user_cache():
         """Task to remove keys from the User cache to ensure freshness."""
         logger.info("TASK: Removing user keys")
         prune_user_cache(10)
 
-    @tasks.loop(hours=1.0)
     async def refresh_backup():
         """Sends a copy of the database to a discord channel (BACKUPS_CHANNEL)."""
         logger.info("TASK: Refreshing backup")
-        try:
-            os.remove("bot_files/backups/dump.dump")
-            logger.info("Cleared backup dump")
-        except FileNotFoundError:
-            logger.info("Already cleared backup dump")
-        try:
-            os.remove("bot_files/backups/keys.txt")
-            logger.info("Cleared backup keys")
-        except FileNotFoundError:
-            logger.info("Already cleared backup keys")
-
-        event_loop = asyncio.get_event_loop()
-        with concurrent.futures.ThreadPoolExecutor(1) as executor:
-            await event_loop.run_in_executor(executor, backup_all)
+
+        paths = await run_blocking(backup)
 
         if BACKUPS_CHANNEL.isdecimal():
             logger.info("Sending backup files")
-            channel = bot.get_channel(int(BACKUPS_CHANNEL))
-            with open("bot_files/backups/dump.dump", "rb") as f:
-                await channel.send(file=discord.File(f, filename="dump"))
-            with open("bot_files/backups/keys.txt", "r") as f:
-                await channel.send(file=discord.File(f, filename="keys.txt"))
+            # the channel may be in a guild of another process
+            channel = bot.get_partial_messageable(int(BACKUPS_CHANNEL))
+            for path in paths:
+                await channel.send(file=discord.File(path))
             logger.info("Backup Files Sent!")
 
+    if os.getenv("SCIOLY_ID_BOT_ENABLE_BACKUPS") != "false":
+        scheduler.job(hours=1.0, cluster=True)(refresh_backup)
+
     # Actually run the bot
     token = os.getenv("SCIOLY_ID_BOT_TOKEN")
     bot.run(token)
@@ -0,0 +1,442 @@
+# backup.py | database backup and restore
+# Copyright (C) 2019-2021  EraserBird, person_v1.32, hmmm
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Usage:
+#   python3 -m bot.backup dump [directory]
+#   python3 -m bot.backup delta [directory]
+#   python3 -m bot.backup restore [--replace] part [part ...]
+#   python3 -m bot.backup replay directory
+#   python3 -m bot.backup restore-legacy [--replace] directory
+#   python3 -m bot.backup bench [directory]
+
+# Backup format:
+# Backups are split into parts named full-YYYYMMDDHHMMSS-NNNN.gz for
+# full snapshots and delta-YYYYMMDDHHMMSS-NNNN.gz for incremental ones.
+# Each part is a standalone gzip file containing MAGIC followed by records of
+#   [key length (u32)][value length (u32)][pttl in ms (i64)][key][value]
+# where value is the output of Redis DUMP and pttl is -1 for no expiry.
+# Deleted keys in deltas have an empty value and a pttl of -2.
+
+# Incremental backups dump the keys in backup.dirty:{backup}, which the
+# recording functions add to with bot.data_functions.mark_dirty. Keys
+# that are not marked (channel, session, race, and web session state)
+# are only saved in full snapshots. Replaying the latest full snapshot
+# and the deltas after it in order restores the database.
+
+import datetime
+import glob
+import gzip
+import os
+import pickle
+import struct
+import sys
+import tempfile
+import time
+import zlib
+from typing import Iterable, Iterator, List, Tuple
+
+import redis
+
+from bot.data import database, logger
+
+MAGIC = b"BIRDBAK1"
+RECORD = struct.Struct(">IIq")
+
+BACKUP_DIR = "bot_files/backups"
+# Discord's attachment limit for bots is 10 MiB, leave some room
+PART_SIZE = int(os.getenv("SCIOLY_ID_BOT_BACKUP_PART_SIZE", str(8 * 1024 * 1024)))
+BATCH_SIZE = 1000
+# hours between full snapshots, incremental backups are taken in between
+FULL_BACKUP_HOURS = float(os.getenv("SCIOLY_ID_BOT_FULL_BACKUP_HOURS", "24"))
+
+# hash tagged so they share a cluster slot
+DIRTY_KEY = "backup.dirty:{backup}"
+SWAP_KEY = "backup.dirty.swap:{backup}"
+PROCESSING_KEY = "backup.dirty.processing:{backup}"
+META_KEY = "backup.meta:{backup}"
+TOMBSTONE = -2
+
+
+def _compress_bound(size: int) -> int:
+    """Upper bound on the deflate output for `size` bytes of input."""
+    return size + (size >> 12) + (size >> 14) + (size >> 25) + 64
+
+
+def _scan_batches(batch_size: int) -> Iterator[List[bytes]]:
+    # scan_iter walks every node when connected to a cluster
+    batch = []
+    for key in database.scan_iter(count=batch_size):
+        batch.append(key)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _sscan_batches(name: str, batch_size: int) -> Iterator[List[bytes]]:
+    cursor = 0
+    while True:
+        cursor, keys = database.sscan(name, cursor, count=batch_size)
+        if keys:
+            yield keys
+        if cursor == 0:
+            break
+
+
+def _dump_batches(
+    batches: Iterable[List[bytes]], tombstones: bool = False
+) -> Iterator[List[Tuple[bytes, bytes, int]]]:
+    """Yields lists of (key, DUMP value, pttl), one pipeline per batch.
+
+    `batches` - lists of keys to dump\n
+    `tombstones` (bool) - yield a tombstone for missing keys instead of skipping
+    """
+    for keys in batches:
+        keys = [key for key in keys if not key.startswith(b"backup.")]
+        with database.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.dump(key)
+                pipe.pttl(key)
+            results = pipe.execute()
+        batch = []
+        for key, value, ttl in zip(keys, results[::2], results[1::2]):
+            if value is not None:
+                batch.append((key, value, ttl))
+            elif tombstones:
+                batch.append((key, b"", TOMBSTONE))
+        yield batch
+
+
+class _PartWriter:
+    """Writes framed records into size-limited gzip parts."""
+
+    def __init__(self, directory: str, prefix: str, part_size: int):
+        self.directory = directory
+        self.prefix = prefix
+        self.part_size = part_size
+        self.paths: List[str] = []
+        self.raw_bytes = 0
+        self._file = None
+        self._compressor = None
+
+    def _open(self):
+        path = os.path.join(self.directory, f"{self.prefix}-{len(self.paths):04d}.gz")
+        self.paths.append(path)
+        self._file = open(path, "wb")
+        # wbits=31 writes a gzip header and trailer
+        self._compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        self._file.write(self._compressor.compress(MAGIC))
+
+    def close(self):
+        if self._file is not None:
+            self._file.write(self._compressor.flush(zlib.Z_FINISH))
+            self._file.close()
+            self._file = None
+
+    def write(self, chunk: bytes):
+        """Writes `chunk` without letting the current part exceed part_size.
+
+        A single chunk larger than part_size gets a part of its own.
+        """
+        if self._file is None:
+            self._open()
+        elif self._file.tell() + _compress_bound(len(chunk)) > self.part_size:
+            self.close()
+            self._open()
+        self._file.write(self._compressor.compress(chunk))
+        # sync flush so tell() is exact for the next size check
+        self._file.write(self._compressor.flush(zlib.Z_SYNC_FLUSH))
+        self.raw_bytes += len(chunk)
+
+
+def _write_backup(
+    directory: str,
+    kind: str,
+    batches: Iterable[List[Tuple[bytes, bytes, int]]],
+    part_size: int,
+) -> List[str]:
+    stamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%d%H%M%S")
+    writer = _PartWriter(directory, f"{kind}-{stamp}", part_size)
+    start = time.perf_counter()
+    count = 0
+    try:
+        for batch in batches:
+            chunk = b"".join(
+                RECORD.pack(len(key), len(value), ttl) + key + value
+                for key, value, ttl in batch
+            )
+            writer.write(chunk)
+            count += len(batch)
+        if not writer.paths:
+            writer.write(b"")  # nothing to back up, still write a part
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - start
+    size = sum(os.path.getsize(path) for path in writer.paths)
+    logger.info(
+        f"Backup Finished ({kind}): {count} keys, {writer.raw_bytes} bytes -> "
+        + f"{size} bytes in {len(writer.paths)} parts, {elapsed:.2f}s"
+    )
+    return writer.paths
+
+
+def backup_all(
+    directory: str = BACKUP_DIR,
+    part_size: int = PART_SIZE,
+    batch_size: int = BATCH_SIZE,
+) -> List[str]:
+    """Backs up the whole database into compressed parts in `directory`.
+
+    Keys are walked with SCAN and dumped with one pipeline per batch,
+    so Redis is never blocked and memory use stays bounded. This is
+    blocking and should be run in an executor.
+
+    This starts a new backup chain, so the parts of older backups
+    in `directory` are removed.
+
+    `directory` (str) - directory to write to\n
+    `part_size` (int) - max size of each part in bytes\n
+    `batch_size` (int) - number of keys to dump per pipeline
+    """
+    logger.info("Starting Backup")
+    os.makedirs(directory, exist_ok=True)
+    for pattern in ("full-*.gz", "delta-*.gz", "dump-*.gz"):
+        for path in glob.glob(os.path.join(directory, pattern)):
+            os.remove(path)
+
+    # changes from now on are picked up by the next delta
+    database.delete(DIRTY_KEY, SWAP_KEY, PROCESSING_KEY)
+    paths = _write_backup(
+        directory,
+        "full",
+        _dump_batches(_scan_batches(batch_size)),
+        part_size,
+    )
+    database.hset(META_KEY, "full", time.time())
+    return paths
+
+
+def backup_incremental(
+    directory: str = BACKUP_DIR,
+    part_size: int = PART_SIZE,
+    batch_size: int = BATCH_SIZE,
+) -> List[str]:
+    """Backs up the keys changed since the last backup into `directory`.
+
+    The dirty key set is moved aside before dumping, so changes made
+    while the backup runs are saved in the next one. If a previous
+    incremental backup failed, its keys are included in this one.
+
+    `directory` (str) - directory to write to\n
+    `part_size` (int) - max size of each part in bytes\n
+    `batch_size` (int) - number of keys to dump per pipeline
+    """
+    logger.info("Starting Incremental Backup")
+    os.makedirs(directory, exist_ok=True)
+    # RENAME is atomic, so no marks are lost between the copy and delete
+    try:
+        database.rename(DIRTY_KEY, SWAP_KEY)
+        database.sunionstore(PROCESSING_KEY, [PROCESSING_KEY, SWAP_KEY])
+        database.delete(SWAP_KEY)
+    except redis.exceptions.ResponseError:
+        logger.info("no keys changed")
+
+    paths = _write_backup(
+        directory,
+        "delta",
+        _dump_batches(_sscan_batches(PROCESSING_KEY, batch_size), tombstones=True),
+        part_size,
+    )
+    database.delete(PROCESSING_KEY)
+    database.hset(META_KEY, "delta", time.time())
+    return paths
+
+
+def backup(
+    directory: str = BACKUP_DIR,
+    full_hours: float = FULL_BACKUP_HOURS,
+) -> List[str]:
+    """Takes a full backup if the last one is older than `full_hours`,
+    otherwise an incremental one. Returns the paths of the new parts.
+
+    `directory` (str) - directory to write to\n
+    `full_hours` (float) - hours between full backups
+    """
+    last_full = database.hget(META_KEY, "full")
+    if last_full is None or time.time() - float(last_full) > full_hours * 3600:
+        return backup_all(directory)
+    if not glob.glob(os.path.join(directory, "full-*.gz")):
+        # the base snapshot is gone, so deltas couldn't be replayed
+        return backup_all(directory)
+    return backup_incremental(directory)
+
+
+def read_backup(paths: Iterable[str]) -> Iterator[Tuple[bytes, bytes, int]]:
+    """Yields (key, DUMP value, pttl) records from backup parts."""
+    for path in paths:
+        with gzip.open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a backup part")
+            while header := f.read(RECORD.size):
+                key_len, value_len, ttl = RECORD.unpack(header)
+                yield f.read(key_len), f.read(value_len), ttl
+
+
+def read_legacy_backup(directory: str) -> Iterator[Tuple[bytes, bytes, int]]:
+    """Yields records from an old `dump` and `keys.txt` backup.
+
+    These are the files in archive/*/Database. The dump file is a
+    series of pickles, so only load backups from a trusted source.
+    """
+    dump_path = os.path.join(directory, "dump")
+    if not os.path.exists(dump_path):
+        dump_path = os.path.join(directory, "dump.dump")
+    with open(dump_path, "rb") as f, open(
+        os.path.join(directory, "keys.txt"), "r"
+    ) as k:
+        for key in k:
+            yield key.rstrip("\n").encode("utf-8"), pickle.load(f), -1
+
+
+def restore(
+    records: Iterable[Tuple[bytes, bytes, int]],
+    replace: bool = False,
+    batch_size: int = BATCH_SIZE,
+) -> int:
+    """Loads backup records into the database, one pipeline per batch.
+
+    Tombstone records delete their key. Returns the number of keys restored.
+
+    `records` - records from read_backup or read_legacy_backup\n
+    `replace` (bool) - overwrite existing keys instead of skipping them\n
+    `batch_size` (int) - number of keys to restore per pipeline
+    """
+    count = skipped = deleted = 0
+    pipe = database.pipeline(transaction=False)
+    tombstones = []
+
+    def flush():
+        nonlocal count, skipped, deleted
+        for result, tombstone in zip(pipe.execute(raise_on_error=False), tombstones):
+            if isinstance(result, Exception):
+                if "BUSYKEY" not in str(result):
+                    raise result
+                skipped += 1
+            elif tombstone:
+                deleted += result
+            else:
+                count += 1
+        tombstones.clear()
+
+    for i, (key, value, ttl) in enumerate(records, 1):
+        tombstones.append(ttl == TOMBSTONE)
+        if ttl == TOMBSTONE:
+            pipe.delete(key)
+        else:
+            pipe.restore(key, max(ttl, 0), value, replace=replace)
+        if i % batch_size == 0:
+            flush()
+    flush()
+    pipe.reset()
+    logger.info(
+        f"Restore Finished: {count} keys restored, {skipped} existing skipped, "
+        + f"{deleted} deleted"
+    )
+    return count
+
+
+def backup_chain(directory: str) -> List[str]:
+    """Returns the parts of the latest full backup in `directory`
+    followed by the parts of the deltas taken after it, in replay order.
+
+    `directory` (str) - directory with backup parts
+    """
+    fulls = sorted(glob.glob(os.path.join(directory, "full-*.gz")))
+    if not fulls:
+        raise ValueError(f"no full backup in {directory}")
+    # names are full-STAMP-NNNN.gz
+    stamp = os.path.basename(fulls[-1]).split("-")[1]
+    base = [path for path in fulls if os.path.basename(path).split("-")[1] == stamp]
+    deltas = sorted(
+        path
+        for path in glob.glob(os.path.join(directory, "delta-*.gz"))
+        if os.path.basename(path).split("-")[1] >= stamp
+    )
+    return base + deltas
+
+
+def replay(directory: str) -> int:
+    """Restores the latest full backup in `directory` and replays its deltas.
+
+    `directory` (str) - directory with backup parts
+    """
+    return restore(read_backup(backup_chain(directory)), replace=True)
+
+
+def bench(directory: str = None):
+    """Measures backup and read throughput on the current database."""
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = directory or tmp
+        start = time.perf_counter()
+        # not backup_all, which would reset the incremental backup state
+        paths = _write_backup(
+            directory, "full", _dump_batches(_scan_batches(BATCH_SIZE)), PART_SIZE
+        )
+        dumped = time.perf_counter() - start
+
+        start = time.perf_counter()
+        count = raw = 0
+        for key, value, _ in read_backup(paths):
+            count += 1
+            raw += len(key) + len(value)
+        read = time.perf_counter() - start
+
+        size = sum(os.path.getsize(path) for path in paths)
+        mb = raw / 1024 / 1024
+        print(f"keys: {count}, raw: {mb:.2f} MiB, compressed: {size/1024/1024:.2f} MiB")
+        print(
+            f"backup: {dumped:.2f}s, {count/dumped:,.0f} keys/s, {mb/dumped:.2f} MiB/s"
+        )
+        print(f"read: {read:.2f}s, {count/read:,.0f} keys/s, {mb/read:.2f} MiB/s")
+
+
+def main(args):
+    replace = "--replace" in args
+    args = [arg for arg in args if arg != "--replace"]
+    if args and args[0] == "dump":
+        backup_all(*args[1:2])
+    elif args and args[0] == "delta":
+        backup_incremental(*args[1:2])
+    elif len(args) == 2 and args[0] == "replay":
+        replay(args[1])
+    elif len(args) > 1 and args[0] == "restore":
+        restore(read_backup(sorted(args[1:])), replace)
+    elif len(args) == 2 and args[0] == "restore-legacy":
+        restore(read_legacy_backup(args[1]), replace)
+    elif args and args[0] == "bench":
+        bench(*args[1:2])
+    else:
+        print(
+            "Usage: python3 -m bot.backup {dump,delta,restore,replay,restore-legacy,bench} ..."
+        )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
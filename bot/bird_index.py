@@ -0,0 +1,194 @@
+# bird_index.py | precomputed bird list lookups
+# Copyright (C) 2019-2021  EraserBird, person_v1.32, hmmm
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import functools
+import itertools
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from bot.cache import Cache
+from bot.data import current_data, database, logger, register_derived
+from bot.filters import MediaType
+
+
+class BirdIndex:
+    """Bitset index of the state, taxon, and national bird lists.
+
+    Every bird is given a bit, and each list is stored as an int with
+    the bits of its birds set, so combining lists is a single AND/OR.
+    Results are memoized as tuples ready for `random.choice`.
+
+    `states_` (dict) - state lists, like bot.data.states\n
+    `taxons_` (dict) - taxon lists, like bot.data.taxons\n
+    `bird_list` (list) - national image list\n
+    `song_birds` (list) - national song list
+    """
+
+    def __init__(
+        self,
+        states_: Dict[str, Dict[str, List[str]]],
+        taxons_: Dict[str, List[str]],
+        bird_list: List[str],
+        song_birds: List[str],
+    ):
+        self.names: Tuple[str, ...] = tuple(
+            dict.fromkeys(
+                itertools.chain(
+                    bird_list,
+                    song_birds,
+                    *(state["birdList"] for state in states_.values()),
+                    *(state["songBirds"] for state in states_.values()),
+                    *taxons_.values(),
+                )
+            )
+        )
+        self.bits: Dict[str, int] = {name: 1 << i for i, name in enumerate(self.names)}
+        self.defaults = {
+            MediaType.IMAGE: tuple(bird_list),
+            MediaType.SONG: tuple(song_birds),
+        }
+        self.default_masks = {
+            MediaType.IMAGE: self.mask(bird_list),
+            MediaType.SONG: self.mask(song_birds),
+        }
+        self.state_masks = {
+            (state, media_type): self.mask(states_[state][list_name])
+            for state in states_
+            for media_type, list_name in (
+                (MediaType.IMAGE, "birdList"),
+                (MediaType.SONG, "songBirds"),
+            )
+        }
+        self.taxon_masks = {taxon: self.mask(birds) for taxon, birds in taxons_.items()}
+
+        # role alias -> states with that alias, in `states` order
+        self.state_order = {state: i for i, state in enumerate(states_)}
+        aliases: Dict[str, List[str]] = {}
+        for state, data in states_.items():
+            for alias in data["aliases"]:
+                aliases.setdefault(alias, []).append(state)
+        self.aliases: Dict[str, Tuple[str, ...]] = {
+            alias: tuple(found) for alias, found in aliases.items()
+        }
+        # per instance, so old indexes can be freed after a reload
+        self._lookup = functools.lru_cache(maxsize=1024)(self._lookup_uncached)
+        logger.info(f"bird index built: {len(self.names)} birds")
+
+    def mask(self, birds: Iterable[str]) -> int:
+        """Returns the bitset of `birds`, ignoring birds not in the index."""
+        result = 0
+        for bird in birds:
+            result |= self.bits.get(bird, 0)
+        return result
+
+    def birds(self, mask: int) -> Tuple[str, ...]:
+        """Returns the birds in a bitset."""
+        names = []
+        while mask:
+            low = mask & -mask
+            names.append(self.names[low.bit_length() - 1])
+            mask ^= low
+        return tuple(names)
+
+    def states_for_roles(self, role_names: Iterable[str]) -> List[str]:
+        """Returns the states matching a user's lowercase role names."""
+        found = set()
+        for role in role_names:
+            found.update(self.aliases.get(role, ()))
+        return sorted(found, key=self.state_order.__getitem__)
+
+    def lookup(
+        self,
+        state_roles: Tuple[str, ...] = (),
+        taxon: Tuple[str, ...] = (),
+        media_type: MediaType = MediaType.IMAGE,
+        custom: Optional[Tuple[int, Tuple[str, ...]]] = None,
+    ) -> Tuple[str, ...]:
+        """Returns the birds for a combination of states and taxons.
+
+        `state_roles` (tuple) - states to include\n
+        `taxon` (tuple) - taxons to include\n
+        `media_type` (MediaType) - images or songs\n
+        `custom` (tuple) - bitset and unindexed birds of a custom list
+        """
+        if not taxon and not state_roles:
+            return self.defaults[media_type]
+        return self._lookup(
+            frozenset(state_roles), frozenset(taxon), media_type, custom
+        )
+
+    def _lookup_uncached(
+        self, state_roles, taxon, media_type, custom
+    ) -> Tuple[str, ...]:
+        custom_mask, custom_extra = custom or (0, ())
+        if state_roles:
+            pool = custom_mask
+            for state in state_roles:
+                pool |= self.state_masks[(state, media_type)]
+        else:
+            pool = self.default_masks[media_type]
+        if taxon:
+            in_taxon = 0
+            for item in taxon:
+                in_taxon |= self.taxon_masks.get(item, 0)
+            return self.birds(pool & in_taxon)
+        # custom birds that aren't in any list can't be in a taxon
+        return self.birds(pool) + custom_extra
+
+
+register_derived(
+    "bird_index",
+    lambda data: BirdIndex(
+        data["states"], data["taxons"], data["birdList"], data["songBirds"]
+    ),
+)
+
+
+def current_index() -> BirdIndex:
+    """Returns the index of the bird data used by the current command."""
+    return current_data()["bird_index"]
+
+
+# custom list bitsets by user id, checked against custom.version:{user_id}
+# and the index they were built with
+_custom_lists = Cache("custom_list", maxsize=2048, ttl=60 * 10)
+
+
+def custom_list(user_id) -> Optional[Tuple[int, Tuple[str, ...]]]:
+    """Returns the bitset and unindexed birds of a user's confirmed custom list.
+
+    The result is cached until `custom.version:{user_id}` changes,
+    so most lookups only read the version.
+
+    `user_id` - user id of the custom list
+    """
+    bird_index = current_index()
+    version = (database.get(f"custom.version:{{{user_id}}}"), bird_index)
+    cached = _custom_lists.get(user_id)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    pipe = database.pipeline(transaction=False)
+    pipe.exists(f"custom.confirm:{{{user_id}}}")
+    pipe.smembers(f"custom.list:{{{user_id}}}")
+    unconfirmed, birds = pipe.execute()
+    result = None
+    if birds and not unconfirmed:
+        birds = sorted(bird.decode("utf-8") for bird in birds)
+        result = (
+            bird_index.mask(birds),
+            tuple(bird for bird in birds if bird not in bird_index.bits),
+        )
+    _custom_lists.set(user_id, (version, result))
+    return result
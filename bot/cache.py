@@ -0,0 +1,410 @@
+# cache.py | two tier cache decorator for coroutines
+# Copyright (C) 2019-2021  EraserBird, person_v1.32, hmmm
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import collections
+import contextvars
+import functools
+import hashlib
+import marshal
+import os
+import pickle
+import time
+import zlib
+from typing import Callable, Dict, Iterable, List, Optional
+
+import redis
+
+from bot.data import database, logger
+from bot.sharding import process_path
+
+# default expiration of Redis (L2) entries, 90 days
+L2_TTL = 60 * 60 * 24 * 90
+
+# where in-memory caches are saved on shutdown
+SNAPSHOT_PATH = process_path(
+    os.getenv("SCIOLY_ID_BOT_CACHE_SNAPSHOT", "bot_files/cache.snapshot")
+)
+# snapshots older than this are ignored on startup, 1 hour
+SNAPSHOT_MAX_AGE = 60 * 60
+
+# all caches by namespace, for stats
+CACHES: Dict[str, "Cache"] = {}
+
+# keys being computed by the current task, so a cached function
+# calling itself with the same key doesn't wait on itself
+_computing: contextvars.ContextVar[frozenset] = contextvars.ContextVar(
+    "computing", default=frozenset()
+)
+
+
+def dumps(value) -> bytes:
+    """Serializes a cached value.
+
+    Values made of builtin types (str, int, tuple, dict, etc.) are
+    stored with marshal, which is smaller and faster than pickle.
+    Anything else falls back to pickle. The first byte says which.
+    """
+    try:
+        return b"m" + marshal.dumps(value, 4)
+    except ValueError:
+        return b"p" + pickle.dumps(value, protocol=4)
+
+
+def loads(data: bytes):
+    """Deserializes a value from `dumps`.
+
+    Entries written before the format change are bare pickles.
+    """
+    if data[:1] == b"m":
+        return marshal.loads(data[1:])
+    if data[:1] == b"p":
+        return pickle.loads(data[1:])
+    return pickle.loads(data)
+
+
+class Cache:
+    """A bounded LRU cache with expiration, optionally backed by Redis.
+
+    `namespace` (str) - name of the cache, used in Redis keys and stats\n
+    `maxsize` (int) - max number of items kept in memory\n
+    `ttl` (float) - seconds items stay in memory, None to never expire\n
+    `l2` (bool) - whether to also store items in Redis\n
+    `l2_ttl` (int) - seconds items stay in Redis
+
+    `persist` (bool) - whether to save items in memory across restarts
+
+    `encode` (function) - converts values to builtin types for saving
+
+    `decode` (function) - converts saved values back
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        maxsize: int = 1024,
+        ttl: Optional[float] = None,
+        l2: bool = False,
+        l2_ttl: int = L2_TTL,
+        persist: bool = False,
+        encode: Optional[Callable] = None,
+        decode: Optional[Callable] = None,
+    ):
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.l2 = l2
+        self.l2_ttl = l2_ttl
+        self.persist = persist
+        self.encode = encode
+        self.decode = decode
+        self._items: collections.OrderedDict = collections.OrderedDict()
+        self.inflight: Dict[object, asyncio.Future] = {}
+        self.hits = self.l2_hits = self.misses = self.shared = self.evictions = 0
+
+    def _l2_key(self, key) -> str:
+        # same hash as the old cache decorator, so its entries are still used
+        if isinstance(key, (str, int)):
+            return hashlib.sha1(str(key).encode()).hexdigest()
+        # marshal includes types, so ("1",) and (1,) are different keys
+        return hashlib.sha1(marshal.dumps(key, 4)).hexdigest()
+
+    def get(self, key, default=None):
+        """Returns a cached item, checking memory then Redis."""
+        item = self._items.get(key)
+        if item is not None:
+            expires, value = item
+            if expires is None or expires > time.monotonic():
+                self._items.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._items[key]
+        if self.l2:
+            try:
+                data = database.get(f"cache.{self.namespace}:{self._l2_key(key)}")
+            except redis.exceptions.RedisError as e:
+                logger.info(f"cache {self.namespace}: l2 get failed: {e}")
+                data = None
+            if data is not None:
+                value = loads(data)
+                self._store_l1(key, value)
+                self.l2_hits += 1
+                return value
+        self.misses += 1
+        return default
+
+    def _store_l1(self, key, value):
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        self._items[key] = (expires, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+            self.evictions += 1
+
+    def set(self, key, value):
+        """Stores an item in memory, and in Redis if enabled."""
+        self._store_l1(key, value)
+        if not self.l2:
+            return
+        l2_key = self._l2_key(key)
+        pipe = database.pipeline(transaction=False)
+        pipe.set(f"cache.{self.namespace}:{l2_key}", dumps(value), ex=self.l2_ttl)
+        pipe.zadd(f"cache.index:{self.namespace}", {l2_key: time.time() + self.l2_ttl})
+        try:
+            pipe.execute()
+        except redis.exceptions.RedisError as e:
+            logger.info(f"cache {self.namespace}: l2 set failed: {e}")
+
+    def evict(self, count: int = 1):
+        """Evicts the `count` least recently used items from memory."""
+        for _ in range(min(count, len(self._items))):
+            self._items.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        """Removes all items from memory."""
+        self._items.clear()
+
+    def export(self) -> List[tuple]:
+        """Returns the unexpired items in memory for saving.
+
+        Items are (key, expiration, value) tuples from least to most
+        recently used, with the expiration as a unix timestamp.
+        """
+        now, wall = time.monotonic(), time.time()
+        items = []
+        for key, (expires, value) in self._items.items():
+            if expires is not None:
+                if expires <= now:
+                    continue
+                expires = wall + (expires - now)
+            if self.encode:
+                value = self.encode(value)
+            items.append((key, expires, value))
+        return items
+
+    def restore(self, items: Iterable[tuple]) -> int:
+        """Loads items from `export`, skipping expired ones.
+
+        Items already in memory are kept. Returns the number restored.
+        """
+        now, wall = time.monotonic(), time.time()
+        restored = 0
+        for key, expires, value in items:
+            if key in self._items:
+                continue
+            if expires is not None:
+                if expires <= wall:
+                    continue
+                expires = now + (expires - wall)
+            if self.decode:
+                value = self.decode(value)
+            self._items[key] = (expires, value)
+            self._items.move_to_end(key, last=False)
+            restored += 1
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+        return restored
+
+    def l2_size(self) -> int:
+        """Returns the number of unexpired items in Redis."""
+        if not self.l2:
+            return 0
+        # remove expired keys from the index before counting
+        pipe = database.pipeline(transaction=False)
+        pipe.zremrangebyscore(f"cache.index:{self.namespace}", "-inf", time.time())
+        pipe.zcard(f"cache.index:{self.namespace}")
+        return pipe.execute()[1]
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "l2_hits": self.l2_hits,
+            "misses": self.misses,
+            "shared": self.shared,
+            "evictions": self.evictions,
+            "size": len(self._items),
+            "maxsize": self.maxsize,
+        }
+
+    def __len__(self):
+        return len(self._items)
+
+
+def cache_stats() -> Dict[str, dict]:
+    """Returns the stats of every cache by namespace."""
+    return {name: c.stats() for name, c in CACHES.items()}
+
+
+def save_caches(path: str = SNAPSHOT_PATH) -> int:
+    """Saves the items in memory of persistent caches to a file.
+
+    Caches whose items can't be serialized with marshal are skipped.
+    Returns the number of items saved.
+
+    `path` (str) - file to save to
+    """
+    start = time.perf_counter()
+    snapshot = {}
+    for name, store in CACHES.items():
+        if not store.persist:
+            continue
+        items = store.export()
+        try:
+            marshal.dumps(items, 4)
+        except ValueError:
+            logger.info(f"cache {name}: items can't be saved, skipping")
+            continue
+        snapshot[name] = items
+    data = zlib.compress(marshal.dumps((time.time(), snapshot), 4))
+    # write to a temporary file first so a crash doesn't leave half a file
+    temp = f"{path}.tmp"
+    with open(temp, "wb") as f:
+        f.write(data)
+    os.replace(temp, path)
+    count = sum(len(items) for items in snapshot.values())
+    logger.info(
+        f"saved {count} cache items in {(time.perf_counter() - start) * 1000:.1f} ms"
+    )
+    return count
+
+
+def load_caches(path: str = SNAPSHOT_PATH, max_age: float = SNAPSHOT_MAX_AGE) -> int:
+    """Restores persistent caches saved with `save_caches`.
+
+    The file is ignored if it's missing, unreadable, or older than
+    `max_age`, since the items may be too out of date.
+    Returns the number of items restored.
+
+    `path` (str) - file to load from
+
+    `max_age` (float) - max seconds since the file was saved
+    """
+    start = time.perf_counter()
+    try:
+        with open(path, "rb") as f:
+            saved, snapshot = marshal.loads(zlib.decompress(f.read()))
+    except FileNotFoundError:
+        return 0
+    except (OSError, ValueError, EOFError, TypeError, zlib.error) as e:
+        logger.info(f"cache snapshot unreadable: {e}")
+        return 0
+    if time.time() - saved > max_age:
+        logger.info("cache snapshot too old, skipping")
+        return 0
+    count = 0
+    for name, items in snapshot.items():
+        store = CACHES.get(name)
+        if store is None or not store.persist:
+            continue
+        try:
+            restored = store.restore(items)
+        except Exception as e:  # pylint: disable=broad-except
+            logger.info(f"cache {name}: restore failed: {e}")
+            continue
+        logger.info(f"cache {name}: restored {restored} items")
+        count += restored
+    logger.info(
+        f"restored {count} cache items in {(time.perf_counter() - start) * 1000:.1f} ms"
+    )
+    return count
+
+
+def cache(
+    pre: Callable = None,
+    local: bool = True,
+    key: Callable = None,
+    maxsize: int = 1024,
+    ttl: Optional[float] = None,
+    persist: bool = False,
+):
+    """Caches the results of a coroutine function.
+
+    Results are kept in a bounded in-memory LRU cache (L1). If `local`
+    is False, they are also stored in Redis (L2) for 90 days, so they
+    survive restarts. Concurrent calls with the same key while the
+    result is being computed share one call. Exceptions are not cached.
+
+    The cache key is made from all the arguments by default. If `pre`
+    is provided, the key is the first positional argument transformed
+    by `pre`. If `key` is provided, it is called with the arguments and
+    returns the key. Keys must be hashable, and in non-local mode made
+    of builtin types (str, int, tuple, etc.).
+
+    If multiple functions with the same name are used, colisions
+    will occur.
+
+    `pre` (function) - transforms the first argument into the key\n
+    `local` (bool) - whether to only cache in memory\n
+    `key` (function) - builds the key from the arguments\n
+    `maxsize` (int) - max number of items kept in memory\n
+    `ttl` (float) - seconds items stay in memory, None to never expire
+
+    `persist` (bool) - whether to save items in memory across restarts
+    """
+
+    def wrapper(func):
+        store = Cache(
+            func.__name__, maxsize=maxsize, ttl=ttl, l2=not local, persist=persist
+        )
+        CACHES[func.__name__] = store
+        sentinel = object()
+
+        def _make_key(args, kwds):
+            if key:
+                return key(*args, **kwds)
+            if pre:
+                return pre(args[0])
+            if kwds:
+                return (args, tuple(sorted(kwds.items())))
+            return args[0] if len(args) == 1 else args
+
+        async def _compute(cache_key, args, kwds):
+            _computing.set(_computing.get() | {(store.namespace, cache_key)})
+            result = await func(*args, **kwds)
+            store.set(cache_key, result)
+            return result
+
+        @functools.wraps(func)
+        async def wrapped(*args, **kwds):
+            cache_key = _make_key(args, kwds)
+            if (store.namespace, cache_key) in _computing.get():
+                # recursive call while computing this key, like a retry
+                return await func(*args, **kwds)
+            task = store.inflight.get(cache_key)
+            if task is not None:
+                store.shared += 1
+                return await asyncio.shield(task)
+            result = store.get(cache_key, sentinel)
+            if result is not sentinel:
+                return result
+            task = asyncio.ensure_future(_compute(cache_key, args, kwds))
+            store.inflight[cache_key] = task
+            task.add_done_callback(lambda _: store.inflight.pop(cache_key, None))
+            return await asyncio.shield(task)
+
+        def cache_info():
+            """Report cache statistics"""
+            return functools._CacheInfo(
+                store.hits + store.l2_hits, store.misses, store.maxsize, len(store)
+            )
+
+        wrapped.cache_info = cache_info
+        wrapped.cache = store
+        wrapped.evict = store.evict
+        return wrapped
+
+    return wrapper
@@ -35,14 +35,15 @@ from bot.data import (
     screech_owls,
 )
 from bot.data_functions import (
-    bird_setup,
     incorrect_increment,
+    mark_dirty,
     score_increment,
     session_increment,
     streak_increment,
 )
-from bot.filters import Filter
 from bot.functions import CustomCooldown
+from bot.outbox import Outbox
+from bot.races import get_race, race_channels
 
 # achievement values
 achievement = [1, 10, 25, 50, 100, 150, 200, 250, 400, 420, 500, 650, 666, 690, 1000]
@@ -62,7 +63,20 @@ class Check(commands.Cog):
     async def check(self, ctx: commands.Context, *, arg: str):
         logger.info("command: check")
 
-        currentBird = database.hget(f"channel:{ctx.channel.id}", "bird").decode("utf-8")
+        race = get_race(ctx.channel.id)
+        if race is not None:
+            # answers to a race are checked one at a time
+            await race.run(self._check, ctx, arg)
+        else:
+            await self._check(ctx, arg)
+
+    async def _check(self, ctx: commands.Context, arg: str):
+        race = get_race(ctx.channel.id)
+        race_in_session = race is not None
+
+        currentBird = database.hget(f"channel:{{{ctx.channel.id}}}", "bird").decode(
+            "utf-8"
+        )
         if currentBird == "":  # no bird
             await ctx.send("You must ask for a bird first!")
             return
@@ -74,17 +88,14 @@ class Check(commands.Cog):
         logger.info("currentBird: " + currentBird)
         logger.info("arg: " + arg)
 
-        bird_setup(ctx, currentBird)
-
         accepted_answers = [currentBird, sciBird]
         if currentBird == "screech owl":
             accepted_answers += screech_owls
             accepted_answers += sci_screech_owls
 
-        race_in_session = bool(database.exists(f"race.data:{ctx.channel.id}"))
         if race_in_session:
             logger.info("race in session")
-            if database.hget(f"race.data:{ctx.channel.id}", "strict"):
+            if race.strict:
                 logger.info("strict spelling")
                 correct = arg in accepted_answers
             else:
@@ -93,12 +104,12 @@ class Check(commands.Cog):
                     arg, accepted_answers, birdListMaster + sciListMaster
                 )
 
-            if not correct and database.hget(f"race.data:{ctx.channel.id}", "alpha"):
+            if not correct and race.alpha:
                 logger.info("checking alpha codes")
                 correct = arg.upper() == alpha_code
         else:
             logger.info("no race")
-            if database.hget(f"session.data:{ctx.author.id}", "strict"):
+            if database.hget(f"session.data:{{{ctx.author.id}}}", "strict"):
                 logger.info("strict spelling")
                 correct = arg in accepted_answers
             else:
@@ -113,63 +124,51 @@ class Check(commands.Cog):
         if correct:
             logger.info("correct")
 
-            database.hset(f"channel:{ctx.channel.id}", "bird", "")
-            database.hset(f"channel:{ctx.channel.id}", "answered", "1")
+            database.hset(f"channel:{{{ctx.channel.id}}}", "bird", "")
+            database.hset(f"channel:{{{ctx.channel.id}}}", "answered", "1")
 
             session_increment(ctx, "correct", 1)
             streak_increment(ctx, 1)
-            database.zincrby(
-                f"correct.user:{ctx.author.id}", 1, string.capwords(str(currentBird))
+            pipe = database.pipeline(transaction=False)
+            pipe.zincrby(
+                f"correct.user:{{{ctx.author.id}}}",
+                1,
+                string.capwords(str(currentBird)),
             )
+            mark_dirty(f"correct.user:{{{ctx.author.id}}}", pipe=pipe)
+            pipe.execute()
 
-            if (
-                race_in_session
-                and Filter.from_int(
-                    int(database.hget(f"race.data:{ctx.channel.id}", "filter"))
-                ).vc
-            ):
+            if race_in_session and race.filters.vc:
                 await voice_functions.stop(ctx, silent=True)
 
-            await ctx.send(
+            outbox = Outbox(ctx)
+            outbox.add(
                 f"Correct! Good job! The bird was **{currentBird}**."
                 if not race_in_session
                 else f"**{ctx.author.mention}**, you are correct! The bird was **{currentBird}**."
             )
-            url = format_wiki_url(ctx, currentBird)
-            await ctx.send(url)
+            outbox.add(format_wiki_url(ctx, currentBird))
             score_increment(ctx, 1)
             if int(database.zscore("users:global", str(ctx.author.id))) in achievement:
                 number = str(int(database.zscore("users:global", str(ctx.author.id))))
-                await ctx.send(f"Wow! You have answered {number} birds correctly!")
+                outbox.add(f"Wow! You have answered {number} birds correctly!")
                 filename = f"bot/media/achievements/{number}.PNG"
                 with open(filename, "rb") as img:
-                    await ctx.send(file=discord.File(img, filename="award.png"))
+                    outbox.add_file(discord.File(img, filename="award.png"))
+                    await outbox.flush()
+            else:
+                await outbox.flush()
 
             if race_in_session:
-                media = database.hget(f"race.data:{ctx.channel.id}", "media").decode(
-                    "utf-8"
-                )
-
-                limit = int(database.hget(f"race.data:{ctx.channel.id}", "limit"))
-                first = database.zrevrange(f"race.scores:{ctx.channel.id}", 0, 0, True)[
-                    0
-                ]
-                if int(first[1]) >= limit:
+                first = race.leaderboard(1)[0]
+                if first[1] >= race.limit:
                     logger.info("race ending")
-                    race = self.bot.get_cog("Race")
-                    await race.stop_race_(ctx)
+                    await self.bot.get_cog("Race").stop_race_(ctx)
                 else:
-                    logger.info(f"auto sending next bird {media}")
-                    filter_int, taxon, state = database.hmget(
-                        f"race.data:{ctx.channel.id}", ["filter", "taxon", "state"]
-                    )
+                    logger.info(f"auto sending next bird {race.media}")
                     birds = self.bot.get_cog("Birds")
                     await birds.send_bird_(
-                        ctx,
-                        media,
-                        Filter.from_int(int(filter_int)),
-                        taxon.decode("utf-8"),
-                        state.decode("utf-8"),
+                        ctx, race.media, race.filters, race.taxon, race.state
                     )
 
         else:
@@ -182,19 +181,21 @@ class Check(commands.Cog):
             if race_in_session:
                 await ctx.send("Sorry, that wasn't the right answer.")
             else:
-                database.hset(f"channel:{ctx.channel.id}", "bird", "")
-                database.hset(f"channel:{ctx.channel.id}", "answered", "1")
-                await ctx.send("Sorry, the bird was actually **" + currentBird + "**.")
-                url = format_wiki_url(ctx, currentBird)
-                await ctx.send(url)
+                database.hset(f"channel:{{{ctx.channel.id}}}", "bird", "")
+                database.hset(f"channel:{{{ctx.channel.id}}}", "answered", "1")
+                outbox = Outbox(ctx)
+                outbox.add("Sorry, the bird was actually **" + currentBird + "**.")
+                outbox.add(format_wiki_url(ctx, currentBird))
+                await outbox.flush()
 
     async def race_autocheck(self, message: discord.Message):
-        if not database.exists(f"race.data:{message.channel.id}"):
+        race = get_race(message.channel.id)
+        if race is None:
             return
         if (
             len(message.content.strip()) == 4
             and message.content.strip().upper() in alpha_codes.values()
-            and database.hget(f"race.data:{message.channel.id}", "alpha")
+            and race.alpha
         ) or len(
             get_close_matches(
                 string.capwords(message.content.strip().replace("-", " ")),
@@ -213,5 +214,8 @@ class Check(commands.Cog):
 
 async def setup(bot):
     cog = Check(bot)
-    bot.add_message_handler(cog.race_autocheck)
+    # only channels with a race need to be checked
+    bot.add_message_handler(
+        cog.race_autocheck, lambda message: message.channel.id in race_channels()
+    )
     await bot.add_cog(cog)
@@ -17,11 +17,13 @@
 import difflib
 
 import discord
-import requests
 from discord.ext import commands
 
 from bot.data import logger
 from bot.functions import CustomCooldown
+from bot.lazy import lazy_import
+
+requests = lazy_import("requests")
 
 
 class COVID(commands.Cog):
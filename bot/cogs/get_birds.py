@@ -22,11 +22,13 @@ from discord import app_commands
 from discord.ext import commands
 
 import bot.voice as voice_functions
-from bot.core import send_bird
+from bot.core import LEAN_SEND, send_bird
 from bot.data import GenericError, database, goatsuckers, logger, states, taxons
-from bot.data_functions import bird_setup, session_increment
+from bot.data_functions import mark_dirty, session_increment
 from bot.filters import Filter, MediaType, arg_autocomplete
 from bot.functions import CustomCooldown, build_id_list, check_state_role
+from bot.lookahead import RACE_LOOKAHEAD, race_lookahead
+from bot.races import get_race
 
 BASE_MESSAGE = (
     "*Here you go!* \n**Use `b!{new_cmd}` again to get a new {media} of the same bird, "
@@ -58,28 +60,13 @@ class Birds(commands.Cog):
         self.bot = bot
 
     async def _send_next_race_media(self, ctx):
-        if database.exists(f"race.data:{ctx.channel.id}"):
-            if Filter.from_int(
-                int(database.hget(f"race.data:{ctx.channel.id}", "filter"))
-            ).vc:
+        race = get_race(ctx.channel.id)
+        if race is not None:
+            if race.filters.vc:
                 await voice_functions.stop(ctx, silent=True)
 
-            media = database.hget(f"race.data:{ctx.channel.id}", "media").decode(
-                "utf-8"
-            )
-
-            logger.info(f"auto sending next bird {media}")
-            filter_int, taxon, state = database.hmget(
-                f"race.data:{ctx.channel.id}", ["filter", "taxon", "state"]
-            )
-
-            await self.send_bird_(
-                ctx,
-                media,
-                Filter.from_int(int(filter_int)),
-                taxon.decode("utf-8"),
-                state.decode("utf-8"),
-            )
+            logger.info(f"auto sending next bird {race.media}")
+            await self.send_bird_(ctx, race.media, race.filters, race.taxon, race.state)
 
     def error_handle(
         self,
@@ -97,8 +84,8 @@ class Birds(commands.Cog):
             nonlocal retries
 
             # skip current bird
-            database.hset(f"channel:{ctx.channel.id}", "bird", "")
-            database.hset(f"channel:{ctx.channel.id}", "answered", "1")
+            database.hset(f"channel:{{{ctx.channel.id}}}", "bird", "")
+            database.hset(f"channel:{{{ctx.channel.id}}}", "answered", "1")
 
             if retries >= 2:  # only retry twice
                 await ctx.send("**Too many retries.**\n*Please try again.*")
@@ -123,16 +110,18 @@ class Birds(commands.Cog):
             # pylint: disable=unused-argument
 
             # skip current bird
-            database.hset(f"channel:{ctx.channel.id}", "bird", "")
-            database.hset(f"channel:{ctx.channel.id}", "answered", "1")
+            database.hset(f"channel:{{{ctx.channel.id}}}", "bird", "")
+            database.hset(f"channel:{{{ctx.channel.id}}}", "answered", "1")
             await ctx.send("*Please try again.*")
 
         return inner
 
     @staticmethod
-    def increment_bird_frequency(ctx, bird):
-        bird_setup(ctx, bird)
-        database.zincrby("frequency.bird:global", 1, string.capwords(bird))
+    def increment_bird_frequency(bird):
+        pipe = database.pipeline(transaction=False)
+        pipe.zincrby("frequency.bird:global", 1, string.capwords(bird))
+        mark_dirty("frequency.bird:global", pipe=pipe)
+        pipe.execute()
 
     async def send_bird_(
         self,
@@ -156,7 +145,7 @@ class Birds(commands.Cog):
             raise GenericError("Invalid media type", code=990)
 
         if media_type is MediaType.SONG and filters.vc:
-            current_voice = database.get(f"voice.server:{ctx.guild.id}")
+            current_voice = database.get(f"voice.server:{{{ctx.guild.id}}}")
             if current_voice is not None and current_voice.decode("utf-8") != str(
                 ctx.channel.id
             ):
@@ -176,13 +165,13 @@ class Birds(commands.Cog):
 
         logger.info(
             "bird: "
-            + database.hget(f"channel:{ctx.channel.id}", "bird").decode("utf-8")
+            + database.hget(f"channel:{{{ctx.channel.id}}}", "bird").decode("utf-8")
         )
 
-        currently_in_race = bool(database.exists(f"race.data:{ctx.channel.id}"))
+        currently_in_race = get_race(ctx.channel.id) is not None
         new_user = database.zscore("users:global", str(ctx.author.id)) < 10
 
-        answered = int(database.hget(f"channel:{ctx.channel.id}", "answered"))
+        answered = int(database.hget(f"channel:{{{ctx.channel.id}}}", "answered"))
         logger.info(f"answered: {answered}")
         # check to see if previous bird was answered
         if answered:  # if yes, give a new bird
@@ -190,20 +179,21 @@ class Birds(commands.Cog):
 
             logger.info(f"filters: {filters}; taxon: {taxon}; roles: {roles}")
 
+            header = None
             if not currently_in_race and retries == 0:
-                await ctx.send(
+                header = (
                     "**Recognized arguments:** "
                     + f"*Active Filters*: `{'`, `'.join(filters.display())}`, "
                     + f"*Taxons*: `{'None' if taxon_str == '' else taxon_str}`, "
                     + f"*Detected State*: `{'None' if role_str == '' else role_str}`"
                 )
+                if not LEAN_SEND:
+                    await ctx.send(header)
+                    header = None
 
             find_custom_role = {i if i.startswith("CUSTOM:") else "" for i in roles}
             find_custom_role.discard("")
-            if (
-                database.exists(f"race.data:{ctx.channel.id}")
-                and len(find_custom_role) == 1
-            ):
+            if currently_in_race and len(find_custom_role) == 1:
                 custom_role = find_custom_role.pop()
                 roles.remove(custom_role)
                 roles.append("CUSTOM")
@@ -234,16 +224,22 @@ class Birds(commands.Cog):
                 )
                 return
 
-            currentBird = random.choice(birds)
-            self.increment_bird_frequency(ctx, currentBird)
-
-            prevB = database.hget(f"channel:{ctx.channel.id}", "prevB").decode("utf-8")
-            while currentBird == prevB and len(birds) > 1:
+            prevB = database.hget(f"channel:{{{ctx.channel.id}}}", "prevB").decode(
+                "utf-8"
+            )
+            if currently_in_race and RACE_LOOKAHEAD:
+                # the next birds were picked and downloaded during the last round
+                lookahead = race_lookahead(ctx.channel.id, media_type, filters)
+                currentBird = await lookahead.next(birds, prevB)
+            else:
                 currentBird = random.choice(birds)
-            database.hset(f"channel:{ctx.channel.id}", "prevB", str(currentBird))
-            database.hset(f"channel:{ctx.channel.id}", "bird", str(currentBird))
+                while currentBird == prevB and len(birds) > 1:
+                    currentBird = random.choice(birds)
+            self.increment_bird_frequency(currentBird)
+            database.hset(f"channel:{{{ctx.channel.id}}}", "prevB", str(currentBird))
+            database.hset(f"channel:{{{ctx.channel.id}}}", "bird", str(currentBird))
             logger.info("currentBird: " + str(currentBird))
-            database.hset(f"channel:{ctx.channel.id}", "answered", "0")
+            database.hset(f"channel:{{{ctx.channel.id}}}", "answered", "0")
             await send_bird(
                 ctx,
                 currentBird,
@@ -255,12 +251,16 @@ class Birds(commands.Cog):
                 message=(SONG_MESSAGE if media_type is MediaType.SONG else BIRD_MESSAGE)
                 if not currently_in_race and new_user
                 else "*Here you go!*",
+                header=header,
             )
         else:  # if no, give the same bird
-            await ctx.send(f"**Active Filters**: `{'`, `'.join(filters.display())}`")
+            header = f"**Active Filters**: `{'`, `'.join(filters.display())}`"
+            if not LEAN_SEND:
+                await ctx.send(header)
+                header = None
             await send_bird(
                 ctx,
-                database.hget(f"channel:{ctx.channel.id}", "bird").decode("utf-8"),
+                database.hget(f"channel:{{{ctx.channel.id}}}", "bird").decode("utf-8"),
                 media_type,
                 filters,
                 on_error=self.error_handle(
@@ -269,6 +269,7 @@ class Birds(commands.Cog):
                 message=(SONG_MESSAGE if media_type is MediaType.SONG else BIRD_MESSAGE)
                 if not currently_in_race and new_user
                 else "*Here you go!*",
+                header=header,
             )
 
     @staticmethod
@@ -278,7 +279,8 @@ class Birds(commands.Cog):
         args = args_str.split(" ")
         logger.info(f"args: {args}")
 
-        if not database.exists(f"race.data:{ctx.channel.id}"):
+        race = get_race(ctx.channel.id)
+        if race is None:
             roles = check_state_role(ctx)
 
             taxon_args = set(taxons.keys()).intersection({arg.lower() for arg in args})
@@ -293,12 +295,12 @@ class Birds(commands.Cog):
             else:
                 state = ""
 
-            if database.exists(f"session.data:{ctx.author.id}"):
+            if database.exists(f"session.data:{{{ctx.author.id}}}"):
                 logger.info("session parameters")
 
                 if taxon_args:
                     current_taxons = set(
-                        database.hget(f"session.data:{ctx.author.id}", "taxon")
+                        database.hget(f"session.data:{{{ctx.author.id}}}", "taxon")
                         .decode("utf-8")
                         .split(" ")
                     )
@@ -310,11 +312,11 @@ class Birds(commands.Cog):
                     taxon = " ".join(taxon_args).strip()
                 else:
                     taxon = database.hget(
-                        f"session.data:{ctx.author.id}", "taxon"
+                        f"session.data:{{{ctx.author.id}}}", "taxon"
                     ).decode("utf-8")
 
                 roles = (
-                    database.hget(f"session.data:{ctx.author.id}", "state")
+                    database.hget(f"session.data:{{{ctx.author.id}}}", "state")
                     .decode("utf-8")
                     .split(" ")
                 )
@@ -325,7 +327,7 @@ class Birds(commands.Cog):
                     roles = check_state_role(ctx)
 
                 session_filter = int(
-                    database.hget(f"session.data:{ctx.author.id}", "filter")
+                    database.hget(f"session.data:{{{ctx.author.id}}}", "filter")
                 )
                 filters = Filter.parse(args_str, defaults=False)
                 if filters.vc:
@@ -357,12 +359,12 @@ class Birds(commands.Cog):
                 state = " ".join(roles).strip()
 
             if "CUSTOM" in state.upper().split(" "):
-                if not database.exists(f"custom.list:{ctx.author.id}"):
+                if not database.exists(f"custom.list:{{{ctx.author.id}}}"):
                     await ctx.send("**You don't have a custom list set!**")
                     state_list = state.split(" ")
                     state_list.remove("CUSTOM")
                     state = " ".join(state_list)
-                elif database.exists(f"custom.confirm:{ctx.author.id}"):
+                elif database.exists(f"custom.confirm:{{{ctx.author.id}}}"):
                     await ctx.send(
                         "**Please verify or confirm your custom list before using!**"
                     )
@@ -373,7 +375,7 @@ class Birds(commands.Cog):
         else:
             logger.info("race parameters")
 
-            race_filter = int(database.hget(f"race.data:{ctx.channel.id}", "filter"))
+            race_filter = race.filter_int
             filters = Filter.parse(args_str, defaults=False)
             if filters.vc:
                 filters.vc = False
@@ -388,12 +390,8 @@ class Birds(commands.Cog):
                 filters ^= Filter()  # clear defaults
             filters ^= race_filter
 
-            taxon = database.hget(f"race.data:{ctx.channel.id}", "taxon").decode(
-                "utf-8"
-            )
-            state = database.hget(f"race.data:{ctx.channel.id}", "state").decode(
-                "utf-8"
-            )
+            taxon = race.taxon
+            state = race.state
 
         logger.info(f"args: filters: {filters}; taxon: {taxon}; state: {state}")
 
@@ -418,10 +416,9 @@ class Birds(commands.Cog):
 
         filters, taxon, state = await self.parse(ctx, args_str)
         media = "images"
-        if database.exists(f"race.data:{ctx.channel.id}"):
-            media = database.hget(f"race.data:{ctx.channel.id}", "media").decode(
-                "utf-8"
-            )
+        race = get_race(ctx.channel.id)
+        if race is not None:
+            media = race.media
         await self.send_bird_(ctx, media, filters, taxon, state)
 
     # picks a random bird call to send
@@ -441,10 +438,9 @@ class Birds(commands.Cog):
 
         filters, taxon, state = await self.parse(ctx, args_str)
         media = "songs"
-        if database.exists(f"race.data:{ctx.channel.id}"):
-            media = database.hget(f"race.data:{ctx.channel.id}", "media").decode(
-                "utf-8"
-            )
+        race = get_race(ctx.channel.id)
+        if race is not None:
+            media = race.media
         await self.send_bird_(ctx, media, filters, taxon, state)
 
     # goatsucker command - no args
@@ -454,20 +450,20 @@ class Birds(commands.Cog):
     async def goatsucker(self, ctx: commands.Context):
         logger.info("command: goatsucker")
 
-        if database.exists(f"race.data:{ctx.channel.id}"):
+        if get_race(ctx.channel.id) is not None:
             await ctx.send("This command is disabled during races.")
             return
 
-        answered = int(database.hget(f"channel:{ctx.channel.id}", "answered"))
+        answered = int(database.hget(f"channel:{{{ctx.channel.id}}}", "answered"))
         # check to see if previous bird was answered
         if answered:  # if yes, give a new bird
             session_increment(ctx, "total", 1)
 
-            database.hset(f"channel:{ctx.channel.id}", "answered", "0")
+            database.hset(f"channel:{{{ctx.channel.id}}}", "answered", "0")
             currentBird = random.choice(goatsuckers)
-            self.increment_bird_frequency(ctx, currentBird)
+            self.increment_bird_frequency(currentBird)
 
-            database.hset(f"channel:{ctx.channel.id}", "bird", str(currentBird))
+            database.hset(f"channel:{{{ctx.channel.id}}}", "bird", str(currentBird))
             logger.info("currentBird: " + str(currentBird))
             await send_bird(
                 ctx,
@@ -480,7 +476,7 @@ class Birds(commands.Cog):
         else:  # if no, give the same bird
             await send_bird(
                 ctx,
-                database.hget(f"channel:{ctx.channel.id}", "bird").decode("utf-8"),
+                database.hget(f"channel:{{{ctx.channel.id}}}", "bird").decode("utf-8"),
                 MediaType.IMAGE,
                 Filter(),
                 on_error=self.error_skip(ctx),
@@ -30,7 +30,9 @@ class Hint(commands.Cog):
     async def hint(self, ctx: commands.Context):
         logger.info("command: hint")
 
-        currentBird = database.hget(f"channel:{ctx.channel.id}", "bird").decode("utf-8")
+        currentBird = database.hget(f"channel:{{{ctx.channel.id}}}", "bird").decode(
+            "utf-8"
+        )
         if currentBird != "":  # check if there is bird
             await ctx.send(f"The first letter is {currentBird[0]}")
         else:
@@ -21,8 +21,10 @@ from discord import app_commands
 from discord.ext import commands
 from discord.utils import escape_markdown as esc
 
-from bot.data import database, logger
+from bot.data import database, logger, reload_data
+from bot.data_functions import mark_dirty
 from bot.functions import CustomCooldown, send_leaderboard
+from bot.sharding import guild_count
 
 
 class Meta(commands.Cog):
@@ -64,7 +66,7 @@ class Meta(commands.Cog):
         )
         embed.add_field(
             name="Stats",
-            value=f"This bot is in {len(self.bot.guilds)} servers. "
+            value=f"This bot is in {guild_count(self.bot)} servers. "
             + f"The WebSocket latency is {round((self.bot.latency*1000))} ms.",
             inline=False,
         )
@@ -126,12 +128,18 @@ class Meta(commands.Cog):
                     added.append(
                         f"`#{esc(channel.name)}` (`{esc(channel.category.name) if channel.category else 'No Category'}`)\n"
                     )
-                    database.zadd("ignore:global", {str(channel.id): ctx.guild.id})
+                    pipe = database.pipeline(transaction=False)
+                    pipe.zadd("ignore:global", {str(channel.id): ctx.guild.id})
+                    mark_dirty("ignore:global", pipe=pipe)
+                    pipe.execute()
                 else:
                     removed.append(
                         f"`#{esc(channel.name)}` (`{esc(channel.category.name) if channel.category else 'No Category'}`)\n"
                     )
-                    database.zrem("ignore:global", str(channel.id))
+                    pipe = database.pipeline(transaction=False)
+                    pipe.zrem("ignore:global", str(channel.id))
+                    mark_dirty("ignore:global", pipe=pipe)
+                    pipe.execute()
         else:
             await ctx.send("**No valid channels were passed.**")
 
@@ -172,10 +180,16 @@ class Meta(commands.Cog):
 
         if not database.sismember("noholiday:global", str(ctx.guild.id)):
             await ctx.send("**Holidays are now disabled in this server.**")
-            database.sadd("noholiday:global", str(ctx.guild.id))
+            pipe = database.pipeline(transaction=False)
+            pipe.sadd("noholiday:global", str(ctx.guild.id))
+            mark_dirty("noholiday:global", pipe=pipe)
+            pipe.execute()
         else:
             await ctx.send("**Holidays are now enabled in this server.**")
-            database.srem("noholiday:global", str(ctx.guild.id))
+            pipe = database.pipeline(transaction=False)
+            pipe.srem("noholiday:global", str(ctx.guild.id))
+            mark_dirty("noholiday:global", pipe=pipe)
+            pipe.execute()
 
     # leave command - removes itself from guild
     @commands.hybrid_command(
@@ -192,21 +206,21 @@ class Meta(commands.Cog):
     ):
         logger.info("command: leave")
 
-        if database.exists(f"leave:{ctx.guild.id}"):
+        if database.exists(f"leave:{{{ctx.guild.id}}}"):
             logger.info("confirming")
             if confirm:
                 logger.info(f"confirmed. Leaving {ctx.guild}")
-                database.delete(f"leave:{ctx.guild.id}")
+                database.delete(f"leave:{{{ctx.guild.id}}}")
                 await ctx.send("**Ok, bye!**")
                 await ctx.guild.leave()
                 return
             logger.info("confirm failed. leave canceled")
-            database.delete(f"leave:{ctx.guild.id}")
+            database.delete(f"leave:{{{ctx.guild.id}}}")
             await ctx.send("**Leave canceled.**")
             return
 
         logger.info("not confirmed")
-        database.set(f"leave:{ctx.guild.id}", 0, ex=60)
+        database.set(f"leave:{{{ctx.guild.id}}}", 0, ex=60)
         await ctx.send(
             "**Are you sure you want to remove me from the guild?**\n"
             + "Use `b!leave yes` to confirm, `b!leave no` to cancel. "
@@ -228,7 +242,10 @@ class Meta(commands.Cog):
             await ctx.send("Invalid User!")
             return
         logger.info(f"user-id: {user.id}")
-        database.zadd("banned:global", {str(user.id): 0})
+        pipe = database.pipeline(transaction=False)
+        pipe.zadd("banned:global", {str(user.id): 0})
+        mark_dirty("banned:global", pipe=pipe)
+        pipe.execute()
         await ctx.send(f"Ok, {esc(user.name)} cannot use the bot anymore!")
 
     # unban command - prevents certain users from using the bot
@@ -246,7 +263,10 @@ class Meta(commands.Cog):
             await ctx.send("Invalid User!")
             return
         logger.info(f"user-id: {user.id}")
-        database.zrem("banned:global", str(user.id))
+        pipe = database.pipeline(transaction=False)
+        pipe.zrem("banned:global", str(user.id))
+        mark_dirty("banned:global", pipe=pipe)
+        pipe.execute()
         await ctx.send(f"Ok, {esc(user.name)} can use the bot!")
 
     # unban command - prevents certain users from using the bot
@@ -268,7 +288,7 @@ class Meta(commands.Cog):
             ctx,
             f"Top Correct Birds ({esc(user.name)})",
             1,
-            database_key=f"correct.user:{user.id}",
+            database_key=f"correct.user:{{{user.id}}}",
             items_per_page=25,
         )
 
@@ -279,6 +299,17 @@ class Meta(commands.Cog):
         sync = await self.bot.tree.sync()
         await ctx.send(f"Synced {len(sync)} commands")
 
+    # reload command - reloads the bird lists from the data files
+    @commands.command(help="- reload bird lists", hidden=True)
+    @commands.is_owner()
+    async def reloaddata(self, ctx: commands.Context, force: bool = False):
+        logger.info("command: reloaddata")
+        await ctx.send("Reloading bird lists...")
+        if await reload_data(force):
+            await ctx.send("Bird lists reloaded!")
+        else:
+            await ctx.send("No changes found. Use `b!reloaddata yes` to reload anyway.")
+
 
 async def setup(bot):
     await bot.add_cog(Meta(bot))
@@ -22,7 +22,6 @@ from difflib import get_close_matches
 
 import aiohttp
 import discord
-import wikipedia
 from discord import app_commands
 from discord.ext import commands
 
@@ -39,36 +38,19 @@ from bot.data import (
 )
 from bot.filters import Filter, MediaType, state_autocomplete, taxon_autocomplete
 from bot.functions import CustomCooldown, build_id_list, cache, decrypt_chacha
+from bot.outbox import Outbox
+from bot.lazy import lazy_import
 
-# Discord max message length is 2000 characters, leave some room just in case
-MAX_MESSAGE = 1900
+wikipedia = lazy_import("wikipedia")
+
+# lists that take more messages than this are sent as a text file
+LIST_PAGES = 4
 
 
 class Other(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
 
-    @staticmethod
-    def broken_join(input_list: list[str], max_size: int = MAX_MESSAGE) -> list[str]:
-        pages: list[str] = []
-        lines: list[str] = []
-        block_length = 0
-        for line in input_list:
-            # add 2 to account for newlines
-            if block_length + len(line) + 2 > max_size:
-                page = "\n".join(lines)
-                pages.append(page)
-                lines.clear()
-                block_length = 0
-            lines.append(line)
-            block_length += len(line) + 2
-
-        if lines:
-            page = "\n".join(lines)
-            pages.append(page)
-
-        return pages
-
     # Info - Gives call+image of 1 bird
     @commands.hybrid_command(
         brief="- Gives an image and call of a bird",
@@ -144,7 +126,7 @@ class Other(commands.Cog):
         return
 
     @staticmethod
-    @cache()
+    @cache(maxsize=512, persist=True)
     async def bird_from_asset(asset_id: str):
         url = f"https://www.macaulaylibrary.org/asset/{asset_id}/embed"
 
@@ -268,19 +250,20 @@ class Other(commands.Cog):
             build_id_list(user_id=ctx.author.id, state=state, media_type=MediaType.SONG)
         )
 
-        birdLists = self.broken_join(state_birdlist)
-        songLists = self.broken_join(state_songlist)
-
         if ctx.author.dm_channel is None:
             await ctx.author.create_dm()
 
-        await ctx.author.dm_channel.send(f"**The {state} bird list:**")
-        for birds in birdLists:
-            await ctx.author.dm_channel.send(f"```\n{birds}```")
-
-        await ctx.author.dm_channel.send(f"**The {state} bird songs:**")
-        for birds in songLists:
-            await ctx.author.dm_channel.send(f"```\n{birds}```")
+        outbox = Outbox(
+            ctx.author.dm_channel,
+            max_pages=LIST_PAGES,
+            filename=f"{state.lower()}.txt",
+            summary=f"**The {state} bird list and songs:**",
+        )
+        outbox.add(f"**The {state} bird list:**")
+        outbox.add_block(state_birdlist)
+        outbox.add(f"**The {state} bird songs:**")
+        outbox.add_block(state_songlist)
+        await outbox.flush()
 
         await ctx.send(
             f"The `{state}` bird list has **{len(state_birdlist)}** birds.\n"
@@ -353,23 +336,20 @@ class Other(commands.Cog):
             )
             return
 
-        birdLists = self.broken_join(bird_list)
-        songLists = self.broken_join(song_bird_list)
-
         if ctx.author.dm_channel is None:
             await ctx.author.create_dm()
 
-        await ctx.author.dm_channel.send(
-            f"**The `{taxon}` in the `{state}` bird list:**"
-        )
-        for birds in birdLists:
-            await ctx.author.dm_channel.send(f"```\n{birds}```")
-
-        await ctx.author.dm_channel.send(
-            f"**The `{taxon}` in the `{state}` bird songs:**"
+        outbox = Outbox(
+            ctx.author.dm_channel,
+            max_pages=LIST_PAGES,
+            filename=f"{taxon}-{state.lower()}.txt",
+            summary=f"**The `{taxon}` in the `{state}` bird list and songs:**",
         )
-        for birds in songLists:
-            await ctx.author.dm_channel.send(f"```\n{birds}```")
+        outbox.add(f"**The `{taxon}` in the `{state}` bird list:**")
+        outbox.add_block(bird_list)
+        outbox.add(f"**The `{taxon}` in the `{state}` bird songs:**")
+        outbox.add_block(song_bird_list)
+        await outbox.flush()
 
         await ctx.send(
             f"The `{taxon}` in the `{state}` bird list has **{len(bird_list)}** birds.\n"
@@ -415,7 +395,7 @@ class Other(commands.Cog):
         logger.info(f"args: {args}")
         channel_id = int(args.split(" ")[0])
         message = args.strip(str(channel_id))
-        channel = self.bot.get_channel(channel_id)
+        channel = self.bot.get_partial_messageable(channel_id)
         await channel.send(message)
         await ctx.send("Ok, sent!")
 
@@ -25,83 +25,72 @@ from discord.utils import escape_markdown as esc
 import bot.voice as voice_functions
 from bot.data import database, logger, states, taxons
 from bot.filters import Filter, arg_autocomplete
-from bot.functions import CustomCooldown, fetch_get_user
+from bot.functions import CustomCooldown, fetch_leaderboard_names
+from bot.races import Race as ActiveRace
+from bot.races import end_race, get_race, start_race
 
 
 class Race(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
 
-    async def _get_options(self, ctx: commands.Context):
-        filter_int, state, media, limit, taxon, strict, alpha = database.hmget(
-            f"race.data:{ctx.channel.id}",
-            ["filter", "state", "media", "limit", "taxon", "strict", "alpha"],
-        )
-        filters = Filter.from_int(int(filter_int))
+    @staticmethod
+    def _get_options(race: ActiveRace):
         options = (
-            f"**Active Filters:** `{'`, `'.join(filters.display())}`\n"
-            + f"**Special bird list:** {state.decode('utf-8') if state else 'None'}\n"
-            + f"**Taxons:** {taxon.decode('utf-8') if taxon else 'None'}\n"
-            + f"**Media Type:** {media.decode('utf-8')}\n"
-            + f"**Amount to Win:** {limit.decode('utf-8')}\n"
-            + f"**Strict Spelling:** {strict == b'strict'}\n"
-            + f"**Alpha Codes:** {'Enabled' if alpha == b'alpha' else 'Disabled'}"
+            f"**Active Filters:** `{'`, `'.join(race.filters.display())}`\n"
+            + f"**Special bird list:** {race.state if race.state else 'None'}\n"
+            + f"**Taxons:** {race.taxon if race.taxon else 'None'}\n"
+            + f"**Media Type:** {race.media}\n"
+            + f"**Amount to Win:** {race.limit}\n"
+            + f"**Strict Spelling:** {race.strict}\n"
+            + f"**Alpha Codes:** {'Enabled' if race.alpha else 'Disabled'}"
         )
         return options
 
-    async def _send_stats(self, ctx: commands.Context, preamble):
+    async def _send_stats(self, ctx: commands.Context, race: ActiveRace, preamble):
         placings = 5
-        database_key = f"race.scores:{ctx.channel.id}"
-        if database.zcard(database_key) == 0:
-            logger.info(f"no users in {database_key}")
+        if not race.scores:
+            logger.info(f"no users in race {race.channel_id}")
             await ctx.send("There are no users in the database.")
             return
 
-        if placings > database.zcard(database_key):
-            placings = database.zcard(database_key)
-
-        leaderboard_list = database.zrevrangebyscore(
-            database_key, "+inf", "-inf", 0, placings, True
-        )
+        leaderboard_list = race.leaderboard(placings)
         embed = discord.Embed(
             type="rich", colour=discord.Color.blurple(), title=preamble
         )
         embed.set_author(name="Bird ID - An Ornithology Bot")
         leaderboard = []
 
+        names, members = await fetch_leaderboard_names(
+            (stats[0] for stats in leaderboard_list),
+            ctx.bot,
+            ctx.guild.id if ctx.guild is not None else None,
+        )
         for i, stats in enumerate(leaderboard_list):
-            if ctx.guild is not None:
-                user = await fetch_get_user(int(stats[0]), ctx=ctx, member=True)
-            else:
-                user = None
-
-            if user is None:
-                user = await fetch_get_user(int(stats[0]), ctx=ctx, member=False)
-                if user is None:
-                    user_info = "**Deleted**"
-                else:
-                    user_info = f"**{esc(user.name)}#{user.discriminator}**"
+            user_id = int(stats[0])
+            if user_id not in names:
+                # couldn't be fetched right now
+                user_info = f"<@{user_id}>"
+            elif names[user_id] is None:
+                user_info = "**Deleted**"
+            elif user_id in members:
+                user_info = f"**{esc(names[user_id])}** (<@{user_id}>)"
             else:
-                user_info = (
-                    f"**{esc(user.name)}#{user.discriminator}** ({user.mention})"
-                )
+                user_info = f"**{esc(names[user_id])}**"
 
             leaderboard.append(f"{i+1}. {user_info} - {int(stats[1])}\n")
 
-        start = int(database.hget(f"race.data:{ctx.channel.id}", "start"))
-        elapsed = str(datetime.timedelta(seconds=round(time.time()) - start))
+        elapsed = str(datetime.timedelta(seconds=round(time.time()) - race.start))
 
-        embed.add_field(
-            name="Options", value=await self._get_options(ctx), inline=False
-        )
+        embed.add_field(name="Options", value=self._get_options(race), inline=False)
         embed.add_field(
             name="Stats", value=f"**Race Duration:** `{elapsed}`", inline=False
         )
         embed.add_field(name="Leaderboard", value="".join(leaderboard), inline=False)
 
         if ctx.author:
-            if database.zscore(database_key, str(ctx.author.id)) is not None:
-                placement = int(database.zrevrank(database_key, str(ctx.author.id))) + 1
+            if str(ctx.author.id) in race.scores:
+                placement = race.rank(str(ctx.author.id)) + 1
                 embed.add_field(
                     name="You:", value=f"You are #{placement}.", inline=False
                 )
@@ -113,26 +102,28 @@ class Race(commands.Cog):
         await ctx.send(embed=embed)
 
     async def stop_race_(self, ctx: commands.Context):
-        if Filter.from_int(
-            int(database.hget(f"race.data:{ctx.channel.id}", "filter"))
-        ).vc:
+        race = get_race(ctx.channel.id)
+        if race is None:
+            # another event already ended it
+            return
+        if race.filters.vc:
             await voice_functions.disconnect(ctx, silent=True)
-            database.delete(f"voice.server:{ctx.guild.id}")
-
-        first = database.zrevrange(f"race.scores:{ctx.channel.id}", 0, 0, True)[0]
-        if ctx.guild is not None:
-            user = await fetch_get_user(int(first[0]), ctx=ctx, member=True)
-        else:
-            user = None
+            database.delete(f"voice.server:{{{ctx.guild.id}}}")
 
-        if user is None:
-            user = await fetch_get_user(int(first[0]), ctx=ctx, member=False)
-            if user is None:
-                user_info = "Deleted"
-            else:
-                user_info = f"{esc(user.name)}#{user.discriminator}"
+        first = race.leaderboard(1)[0]
+        user_id = int(first[0])
+        names, members = await fetch_leaderboard_names(
+            [user_id], ctx.bot, ctx.guild.id if ctx.guild is not None else None
+        )
+        name = names.get(user_id)
+        if user_id not in names:
+            user_info = f"<@{user_id}>"
+        elif name is None:
+            user_info = "Deleted"
+        elif user_id in members:
+            user_info = f"{esc(name)} (<@{user_id}>)"
         else:
-            user_info = f"{esc(user.name)}#{user.discriminator} ({user.mention})"
+            user_info = esc(name)
 
         await ctx.send(
             f"**Congratulations, {user_info}!**\n"
@@ -140,15 +131,14 @@ class Race(commands.Cog):
             + "*Way to go!*"
         )
 
-        database.hset(f"race.data:{ctx.channel.id}", "stop", round(time.time()))
+        race.set_stop()
 
-        await self._send_stats(ctx, "**Race stopped.**")
-        database.delete(f"race.data:{ctx.channel.id}")
-        database.delete(f"race.scores:{ctx.channel.id}")
+        await self._send_stats(ctx, race, "**Race stopped.**")
+        end_race(ctx.channel.id)
 
         logger.info("race end: skipping last bird")
-        database.hset(f"channel:{ctx.channel.id}", "bird", "")
-        database.hset(f"channel:{ctx.channel.id}", "answered", "1")
+        database.hset(f"channel:{{{ctx.channel.id}}}", "bird", "")
+        database.hset(f"channel:{{{ctx.channel.id}}}", "answered", "1")
 
     @commands.hybrid_group(
         brief="- Base race command",
@@ -192,7 +182,7 @@ class Race(commands.Cog):
             )
             return
 
-        if database.exists(f"race.data:{ctx.channel.id}"):
+        if get_race(ctx.channel.id) is not None:
             logger.info("already race")
             await ctx.send(
                 "**There is already a race in session.** *Change settings/view stats with `b!race view`*"
@@ -201,7 +191,7 @@ class Race(commands.Cog):
 
         filters = Filter.parse(args_str, use_numbers=False)
         if filters.vc:
-            if database.get(f"voice.server:{ctx.guild.id}") is not None:
+            if database.get(f"voice.server:{{{ctx.guild.id}}}") is not None:
                 logger.info("already vc race")
                 await ctx.send(
                     "**There is already a VC race in session in this server!**"
@@ -210,7 +200,7 @@ class Race(commands.Cog):
             client = await voice_functions.get_voice_client(ctx, connect=True)
             if client is None:
                 return
-            database.set(f"voice.server:{ctx.guild.id}", str(ctx.channel.id))
+            database.set(f"voice.server:{{{ctx.guild.id}}}", str(ctx.channel.id))
 
         args = args_str.split(" ")
         logger.info(f"args: {args}")
@@ -235,8 +225,8 @@ class Race(commands.Cog):
         if states_args:
             if {"CUSTOM"}.issubset(states_args):
                 if database.exists(
-                    f"custom.list:{ctx.author.id}"
-                ) and not database.exists(f"custom.confirm:{ctx.author.id}"):
+                    f"custom.list:{{{ctx.author.id}}}"
+                ) and not database.exists(f"custom.confirm:{{{ctx.author.id}}}"):
                     states_args.discard("CUSTOM")
                     states_args.add(f"CUSTOM:{ctx.author.id}")
                 else:
@@ -288,9 +278,9 @@ class Race(commands.Cog):
             f"adding filters: {filters}; state: {state}; media: {media}; limit: {limit}"
         )
 
-        database.hset(
-            f"race.data:{ctx.channel.id}",
-            mapping={
+        race = start_race(
+            ctx.channel.id,
+            {
                 "start": round(time.time()),
                 "stop": 0,
                 "limit": limit,
@@ -301,30 +291,17 @@ class Race(commands.Cog):
                 "strict": strict,
                 "alpha": alpha,
             },
+            str(ctx.author.id),
         )
+        await ctx.send(f"**Race started with options:**\n{self._get_options(race)}")
 
-        database.zadd(f"race.scores:{ctx.channel.id}", {str(ctx.author.id): 0})
-        await ctx.send(
-            f"**Race started with options:**\n{await self._get_options(ctx)}"
-        )
-
-        media = database.hget(f"race.data:{ctx.channel.id}", "media").decode("utf-8")
         logger.info("clearing previous bird")
-        database.hset(f"channel:{ctx.channel.id}", "bird", "")
-        database.hset(f"channel:{ctx.channel.id}", "answered", "1")
+        database.hset(f"channel:{{{ctx.channel.id}}}", "bird", "")
+        database.hset(f"channel:{{{ctx.channel.id}}}", "answered", "1")
 
-        logger.info(f"auto sending next bird {media}")
-        filter_int, taxon, state = database.hmget(
-            f"race.data:{ctx.channel.id}", ["filter", "taxon", "state"]
-        )
+        logger.info(f"auto sending next bird {race.media}")
         birds = self.bot.get_cog("Birds")
-        await birds.send_bird_(
-            ctx,
-            media,
-            Filter.from_int(int(filter_int)),  # type: ignore
-            taxon.decode("utf-8"),  # type: ignore
-            state.decode("utf-8"),  # type: ignore
-        )
+        await birds.send_bird_(ctx, race.media, race.filters, race.taxon, race.state)
 
     @race.command(
         brief="- Views race",
@@ -334,8 +311,9 @@ class Race(commands.Cog):
     async def view(self, ctx: commands.Context):
         logger.info("command: view race")
 
-        if database.exists(f"race.data:{ctx.channel.id}"):
-            await self._send_stats(ctx, "**Race In Progress**")
+        race = get_race(ctx.channel.id)
+        if race is not None:
+            await self._send_stats(ctx, race, "**Race In Progress**")
         else:
             await ctx.send(
                 "**There is no race in session.** *You can start one with `b!race start`*"
@@ -346,8 +324,9 @@ class Race(commands.Cog):
     async def stop(self, ctx: commands.Context):
         logger.info("command: stop race")
 
-        if database.exists(f"race.data:{ctx.channel.id}"):
-            await self.stop_race_(ctx)
+        race = get_race(ctx.channel.id)
+        if race is not None:
+            await race.run(self.stop_race_, ctx)
         else:
             await ctx.send(
                 "**There is no race in session.** *You can start one with `b!race start`*"
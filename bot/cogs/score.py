@@ -18,13 +18,15 @@ import datetime
 from typing import Literal, Optional, Union
 
 import discord
-import pandas as pd
 from discord import app_commands
 from discord.ext import commands
 from discord.utils import escape_markdown as esc
 
-from bot.data import GenericError, database, logger
-from bot.functions import CustomCooldown, send_leaderboard, fetch_get_user
+from bot.data import GenericError, database, logger, read_database
+from bot.functions import CustomCooldown, send_leaderboard, fetch_leaderboard_names
+from bot.lazy import lazy_import
+
+pd = lazy_import("pandas")
 
 
 class Score(commands.Cog):
@@ -34,11 +36,13 @@ class Score(commands.Cog):
     @staticmethod
     def _server_total(ctx: commands.Context):
         logger.info("fetching server totals")
+        reader = read_database()
         channels = map(
             lambda x: x.decode("utf-8"),
-            database.smembers(f"channels:{ctx.guild.id}"),
+            reader.smembers(f"channels:{{{ctx.guild.id}}}"),
         )
-        pipe = database.pipeline()  # use a pipeline to get all the scores
+        # use a pipeline to get all the scores
+        pipe = reader.pipeline(transaction=False)
         for channel in channels:
             pipe.zscore("score:global", channel)
         scores = pipe.execute()
@@ -58,7 +62,7 @@ class Score(commands.Cog):
         past_month = pd.date_range(  # pylint: disable=no-member
             today - datetime.timedelta(29), today
         ).date
-        pipe = database.pipeline()
+        pipe = read_database().pipeline(transaction=False)
         for day in past_month:
             pipe.zrevrangebyscore(f"{key}:{day}", "+inf", "-inf", withscores=True)
         result = pipe.execute()
@@ -79,13 +83,14 @@ class Score(commands.Cog):
     @staticmethod
     def _server_lb(guild_id):
         logger.info("generating server leaderboard")
+        reader = read_database()
         users = tuple(
             map(
                 lambda x: x.decode("utf8"),
-                database.smembers(f"users.server.id:{guild_id}"),
+                reader.smembers(f"users.server.id:{{{guild_id}}}"),
             )
         )
-        pipe = database.pipeline()
+        pipe = reader.pipeline(transaction=False)
         for user in users:
             pipe.zscore("users:global", user)
         scores = map(int, pipe.execute())
@@ -102,9 +107,10 @@ class Score(commands.Cog):
             raise GenericError("database_key and data are both set", 990)
 
         page = max(1, page)
+        reader = read_database()
 
         user_amount = (
-            int(database.zcard(database_key))
+            int(reader.zcard(database_key))
             if database_key is not None
             else data.count()
         )
@@ -120,7 +126,7 @@ class Score(commands.Cog):
 
         users_per_page = 10
         leaderboard_list = (
-            database.zrevrangebyscore(
+            reader.zrevrangebyscore(
                 database_key, "+inf", "-inf", page, users_per_page, True
             )
             if database_key is not None
@@ -131,40 +137,41 @@ class Score(commands.Cog):
         embed.set_author(name="Bird ID - An Ornithology Bot")
         leaderboard = []
 
+        leaderboard_list = list(leaderboard_list)
+        names, members = await fetch_leaderboard_names(
+            (stats[0] for stats in leaderboard_list),
+            ctx.bot,
+            ctx.guild.id if ctx.guild is not None else None,
+        )
         for i, stats in enumerate(leaderboard_list):
-            if ctx.guild is not None:
-                user = await fetch_get_user(int(stats[0]), ctx=ctx, member=True)
+            user_id = int(stats[0])
+            if user_id not in names:
+                # couldn't be fetched right now
+                user_info = f"<@{user_id}>"
+            elif names[user_id] is None:
+                user_info = "**Deleted**"
+            elif user_id in members:
+                user_info = f"**{esc(names[user_id])}** (<@{user_id}>)"
             else:
-                user = None
-
-            if user is None:
-                user = await fetch_get_user(int(stats[0]), ctx=ctx, member=False)
-                if user is None:
-                    user_info = "**Deleted**"
-                else:
-                    user_info = f"**{esc(user.name)}#{user.discriminator}**"
-            else:
-                user_info = (
-                    f"**{esc(user.name)}#{user.discriminator}** ({user.mention})"
-                )
+                user_info = f"**{esc(names[user_id])}**"
 
             leaderboard.append(f"{i+1+page}. {user_info} - {int(stats[1])}\n")
 
         embed.add_field(name=title, value="".join(leaderboard), inline=False)
 
         user_score = (
-            database.zscore(database_key, str(ctx.author.id))
+            reader.zscore(database_key, str(ctx.author.id))
             if database_key is not None
             else data.get(str(ctx.author.id))
         )
 
         if user_score is not None:
             if database_key is not None:
-                placement = int(database.zrevrank(database_key, str(ctx.author.id))) + 1
+                placement = int(reader.zrevrank(database_key, str(ctx.author.id))) + 1
                 distance = int(
-                    database.zrevrange(
-                        database_key, placement - 2, placement - 2, True
-                    )[0][1]
+                    reader.zrevrange(database_key, placement - 2, placement - 2, True)[
+                        0
+                    ][1]
                 ) - int(user_score)
             else:
                 placement = int(data.rank(ascending=False)[str(ctx.author.id)])
@@ -492,7 +499,7 @@ class Score(commands.Cog):
         if scope in ("server", "s"):
             data = None
             if ctx.guild is not None:
-                database_key = f"incorrect.server:{ctx.guild.id}"
+                database_key = f"incorrect.server:{{{ctx.guild.id}}}"
                 scope = "server"
             else:
                 logger.info("dm context")
@@ -503,7 +510,7 @@ class Score(commands.Cog):
                 database_key = "incorrect:global"
         elif scope in ("me", "m"):
             data = None
-            database_key = f"incorrect.user:{ctx.author.id}"
+            database_key = f"incorrect.user:{{{ctx.author.id}}}"
             scope = "me"
         elif scope in ("month", "monthly", "mo"):
             data = self._monthly_lb("missed")
@@ -33,7 +33,7 @@ class Sessions(commands.Cog):
 
     async def _get_options(self, ctx: commands.Context):
         filter_int, state, taxon, wiki, strict = database.hmget(
-            f"session.data:{ctx.author.id}",
+            f"session.data:{{{ctx.author.id}}}",
             ["filter", "state", "taxon", "wiki", "strict"],
         )
         filters = Filter.from_int(int(filter_int))
@@ -52,7 +52,7 @@ class Sessions(commands.Cog):
         start, correct, incorrect, total = map(
             int,
             database.hmget(
-                f"session.data:{ctx.author.id}",
+                f"session.data:{{{ctx.author.id}}}",
                 ["start", "correct", "incorrect", "total"],
             ),
         )
@@ -74,7 +74,7 @@ class Sessions(commands.Cog):
         return stats
 
     async def _send_stats(self, ctx: commands.Context, preamble):
-        database_key = f"session.incorrect:{ctx.author.id}"
+        database_key = f"session.incorrect:{{{ctx.author.id}}}"
 
         embed = discord.Embed(
             type="rich", colour=discord.Color.blurple(), title=preamble
@@ -137,7 +137,7 @@ class Sessions(commands.Cog):
     async def start(self, ctx: commands.Context, *, args_str: str = ""):
         logger.info("command: start session")
 
-        if database.exists(f"session.data:{ctx.author.id}"):
+        if database.exists(f"session.data:{{{ctx.author.id}}}"):
             logger.info("already session")
             await ctx.send(
                 "**There is already a session running.** *Change settings/view stats with `b!session edit`*"
@@ -179,7 +179,7 @@ class Sessions(commands.Cog):
         )
 
         database.hset(
-            f"session.data:{ctx.author.id}",
+            f"session.data:{{{ctx.author.id}}}",
             mapping={
                 "start": round(time.time()),
                 "stop": 0,
@@ -198,8 +198,8 @@ class Sessions(commands.Cog):
         )
 
         logger.info("session start: skipping bird")
-        database.hset(f"channel:{ctx.channel.id}", "bird", "")
-        database.hset(f"channel:{ctx.channel.id}", "answered", "1")
+        database.hset(f"channel:{{{ctx.channel.id}}}", "bird", "")
+        database.hset(f"channel:{{{ctx.channel.id}}}", "answered", "1")
 
     # views session
     @session.command(
@@ -219,7 +219,7 @@ class Sessions(commands.Cog):
     async def edit(self, ctx: commands.Context, *, args_str: str = ""):
         logger.info("command: view session")
 
-        if not database.exists(f"session.data:{ctx.author.id}"):
+        if not database.exists(f"session.data:{{{ctx.author.id}}}"):
             await ctx.send(
                 "**There is no session running.** *You can start one with `b!session start`*"
             )
@@ -233,31 +233,31 @@ class Sessions(commands.Cog):
         args = args_str.lower().split(" ")
         logger.info(f"args: {args}")
 
-        new_filter ^= int(database.hget(f"session.data:{ctx.author.id}", "filter"))
+        new_filter ^= int(database.hget(f"session.data:{{{ctx.author.id}}}", "filter"))
         database.hset(
-            f"session.data:{ctx.author.id}", "filter", str(new_filter.to_int())
+            f"session.data:{{{ctx.author.id}}}", "filter", str(new_filter.to_int())
         )
 
         if "wiki" in args:
-            if database.hget(f"session.data:{ctx.author.id}", "wiki"):
+            if database.hget(f"session.data:{{{ctx.author.id}}}", "wiki"):
                 logger.info("enabling wiki embeds")
-                database.hset(f"session.data:{ctx.author.id}", "wiki", "")
+                database.hset(f"session.data:{{{ctx.author.id}}}", "wiki", "")
             else:
                 logger.info("disabling wiki embeds")
-                database.hset(f"session.data:{ctx.author.id}", "wiki", "wiki")
+                database.hset(f"session.data:{{{ctx.author.id}}}", "wiki", "wiki")
 
         if "strict" in args:
-            if database.hget(f"session.data:{ctx.author.id}", "strict"):
+            if database.hget(f"session.data:{{{ctx.author.id}}}", "strict"):
                 logger.info("disabling strict spelling")
-                database.hset(f"session.data:{ctx.author.id}", "strict", "")
+                database.hset(f"session.data:{{{ctx.author.id}}}", "strict", "")
             else:
                 logger.info("enabling strict spelling")
-                database.hset(f"session.data:{ctx.author.id}", "strict", "strict")
+                database.hset(f"session.data:{{{ctx.author.id}}}", "strict", "strict")
 
         states_args = set(states.keys()).intersection({arg.upper() for arg in args})
         if states_args:
             current_states = set(
-                database.hget(f"session.data:{ctx.author.id}", "state")
+                database.hget(f"session.data:{{{ctx.author.id}}}", "state")
                 .decode("utf-8")
                 .split(" ")
             )
@@ -267,7 +267,7 @@ class Sessions(commands.Cog):
             states_args.discard("")
             logger.info(f"new states: {states_args}")
             database.hset(
-                f"session.data:{ctx.author.id}",
+                f"session.data:{{{ctx.author.id}}}",
                 "state",
                 " ".join(states_args).strip(),
             )
@@ -275,7 +275,7 @@ class Sessions(commands.Cog):
         taxon_args = set(taxons.keys()).intersection({arg.lower() for arg in args})
         if taxon_args:
             current_taxons = set(
-                database.hget(f"session.data:{ctx.author.id}", "taxon")
+                database.hget(f"session.data:{{{ctx.author.id}}}", "taxon")
                 .decode("utf-8")
                 .split(" ")
             )
@@ -285,7 +285,7 @@ class Sessions(commands.Cog):
             taxon_args.discard("")
             logger.info(f"new taxons: {taxon_args}")
             database.hset(
-                f"session.data:{ctx.author.id}",
+                f"session.data:{{{ctx.author.id}}}",
                 "taxon",
                 " ".join(taxon_args).strip(),
             )
@@ -298,16 +298,18 @@ class Sessions(commands.Cog):
     async def stop(self, ctx: commands.Context):
         logger.info("command: stop session")
 
-        if database.exists(f"session.data:{ctx.author.id}"):
-            database.hset(f"session.data:{ctx.author.id}", "stop", round(time.time()))
+        if database.exists(f"session.data:{{{ctx.author.id}}}"):
+            database.hset(
+                f"session.data:{{{ctx.author.id}}}", "stop", round(time.time())
+            )
 
             await self._send_stats(ctx, "**Session stopped.**\n")
-            database.delete(f"session.data:{ctx.author.id}")
-            database.delete(f"session.incorrect:{ctx.author.id}")
+            database.delete(f"session.data:{{{ctx.author.id}}}")
+            database.delete(f"session.incorrect:{{{ctx.author.id}}}")
 
             logger.info("session end: skipping bird")
-            database.hset(f"channel:{ctx.channel.id}", "bird", "")
-            database.hset(f"channel:{ctx.channel.id}", "answered", "1")
+            database.hset(f"channel:{{{ctx.channel.id}}}", "bird", "")
+            database.hset(f"channel:{{{ctx.channel.id}}}", "answered", "1")
         else:
             await ctx.send(
                 "**There is no session running.** *You can start one with `b!session start`*"
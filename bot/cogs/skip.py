@@ -19,8 +19,8 @@ from discord.ext import commands
 import bot.voice as voice_functions
 from bot.data import database, format_wiki_url, logger
 from bot.data_functions import streak_increment
-from bot.filters import Filter
 from bot.functions import CustomCooldown
+from bot.races import get_race
 
 
 class Skip(commands.Cog):
@@ -33,9 +33,19 @@ class Skip(commands.Cog):
     async def skip(self, ctx: commands.Context):
         logger.info("command: skip")
 
-        currentBird = database.hget(f"channel:{ctx.channel.id}", "bird").decode("utf-8")
-        database.hset(f"channel:{ctx.channel.id}", "bird", "")
-        database.hset(f"channel:{ctx.channel.id}", "answered", "1")
+        race = get_race(ctx.channel.id)
+        if race is not None:
+            # skips are handled in order with answers to the race
+            await race.run(self._skip, ctx)
+        else:
+            await self._skip(ctx)
+
+    async def _skip(self, ctx: commands.Context):
+        currentBird = database.hget(f"channel:{{{ctx.channel.id}}}", "bird").decode(
+            "utf-8"
+        )
+        database.hset(f"channel:{{{ctx.channel.id}}}", "bird", "")
+        database.hset(f"channel:{{{ctx.channel.id}}}", "answered", "1")
         if currentBird != "":  # check if there is bird
             url = format_wiki_url(ctx, currentBird)
             await ctx.send(f"Ok, skipping {currentBird.lower()}")
@@ -43,27 +53,15 @@ class Skip(commands.Cog):
 
             streak_increment(ctx, None)  # reset streak
 
-            if database.exists(f"race.data:{ctx.channel.id}"):
-                if Filter.from_int(
-                    int(database.hget(f"race.data:{ctx.channel.id}", "filter"))
-                ).vc:
+            race = get_race(ctx.channel.id)
+            if race is not None:
+                if race.filters.vc:
                     await voice_functions.stop(ctx, silent=True)
 
-                media = database.hget(f"race.data:{ctx.channel.id}", "media").decode(
-                    "utf-8"
-                )
-
-                logger.info(f"auto sending next bird {media}")
-                filter_int, taxon, state = database.hmget(
-                    f"race.data:{ctx.channel.id}", ["filter", "taxon", "state"]
-                )
+                logger.info(f"auto sending next bird {race.media}")
                 birds = self.bot.get_cog("Birds")
                 await birds.send_bird_(
-                    ctx,
-                    media,
-                    Filter.from_int(int(filter_int)),
-                    taxon.decode("utf-8"),
-                    state.decode("utf-8"),
+                    ctx, race.media, race.filters, race.taxon, race.state
                 )
         else:
             await ctx.send("You need to ask for a bird first!")
@@ -28,32 +28,42 @@ from sentry_sdk import capture_message
 
 from bot.core import valid_bird, cookies
 from bot.data import database, logger, states
+from bot.data_functions import mark_dirty
 from bot.filters import state_autocomplete
 from bot.functions import CustomCooldown, auto_decode, handle_error
+from bot.outbox import Outbox
+
+# custom lists that take more messages than this are sent as a text file
+CUSTOM_PAGES = 4
 
 
 class States(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
 
-    async def broken_send(self, ctx, message: str, between: str = ""):
-        pages: list[str] = []
-        temp_lines: list[str] = []
-        temp_len = 0
-        for line in message.splitlines(keepends=True):
-            temp_lines.append(line)
-            temp_len += len(line)
-            if temp_len > 1700:
-                temp_out = f"{between}{''.join(temp_lines)}{between}"
-                pages.append(temp_out)
-                temp_lines.clear()
-
-        if temp_lines:
-            temp_out = f"{between}{''.join(temp_lines)}{between}"
-            pages.append(temp_out)
-
-        for page in pages:
-            await ctx.send(page)
+    @staticmethod
+    async def broken_send(
+        ctx, message: str, between: str = "", before: str = "", after: str = ""
+    ):
+        """Sends a long message in as few messages as possible.
+
+        Very long messages are sent as a text file.
+
+        `message` (str) - text to send, split between lines\n
+        `between` (str) - fence around each part, like "```"\n
+        `before` (str) - text sent before the message\n
+        `after` (str) - text sent after the message
+        """
+        outbox = Outbox(ctx, max_pages=CUSTOM_PAGES, filename="birds.txt")
+        if before:
+            outbox.add(before)
+        if between:
+            outbox.add_block(message.splitlines(), fence=between.strip())
+        elif message:
+            outbox.add(message.rstrip("\n"))
+        if after:
+            outbox.add(after)
+        await outbox.flush()
 
     # set state role
     @commands.hybrid_command(
@@ -74,8 +84,8 @@ class States(commands.Cog):
         args = args.upper().split(" ")
 
         if "CUSTOM" in args and (
-            not database.exists(f"custom.list:{ctx.author.id}")
-            or database.exists(f"custom.confirm:{ctx.author.id}")
+            not database.exists(f"custom.list:{{{ctx.author.id}}}")
+            or database.exists(f"custom.confirm:{{{ctx.author.id}}}")
         ):
             await ctx.send(
                 "Sorry, you don't have a custom list! Use `b!custom` to set your custom list.",
@@ -174,7 +184,7 @@ class States(commands.Cog):
         if (
             "replace" not in command
             and attachment
-            and database.exists(f"custom.list:{ctx.author.id}")
+            and database.exists(f"custom.list:{{{ctx.author.id}}}")
         ):
             await ctx.send(
                 "Woah there. You already have a custom list. "
@@ -183,19 +193,29 @@ class States(commands.Cog):
             )
             return
 
-        if "delete" in command and database.exists(f"custom.list:{ctx.author.id}"):
+        if "delete" in command and database.exists(f"custom.list:{{{ctx.author.id}}}"):
             if (
-                database.exists(f"custom.confirm:{ctx.author.id}")
-                and database.get(f"custom.confirm:{ctx.author.id}").decode("utf-8")
+                database.exists(f"custom.confirm:{{{ctx.author.id}}}")
+                and database.get(f"custom.confirm:{{{ctx.author.id}}}").decode("utf-8")
                 == "delete"
             ):
-                database.delete(
-                    f"custom.list:{ctx.author.id}", f"custom.confirm:{ctx.author.id}"
+                pipe = database.pipeline(transaction=False)
+                pipe.delete(
+                    f"custom.list:{{{ctx.author.id}}}",
+                    f"custom.confirm:{{{ctx.author.id}}}",
                 )
+                pipe.incr(f"custom.version:{{{ctx.author.id}}}")
+                mark_dirty(
+                    f"custom.list:{{{ctx.author.id}}}",
+                    f"custom.version:{{{ctx.author.id}}}",
+                    pipe=pipe,
+                )
+                pipe.execute()
                 await ctx.send("Ok, your list was deleted.")
                 return
 
-            database.set(f"custom.confirm:{ctx.author.id}", "delete", ex=86400)
+            database.set(f"custom.confirm:{{{ctx.author.id}}}", "delete", ex=86400)
+            database.incr(f"custom.version:{{{ctx.author.id}}}")
             await ctx.send(
                 "Are you sure you want to permanently delete your list? "
                 + "Use `b!custom delete` again within 24 hours to clear your custom list."
@@ -204,15 +224,23 @@ class States(commands.Cog):
 
         if (
             "confirm" in command
-            and database.exists(f"custom.confirm:{ctx.author.id}")
-            and database.get(f"custom.confirm:{ctx.author.id}").decode("utf-8")
+            and database.exists(f"custom.confirm:{{{ctx.author.id}}}")
+            and database.get(f"custom.confirm:{{{ctx.author.id}}}").decode("utf-8")
             == "confirm"
         ):
             # list was validated by server and user, making permanent
             logger.info("user confirmed")
-            database.persist(f"custom.list:{ctx.author.id}")
-            database.delete(f"custom.confirm:{ctx.author.id}")
-            database.set(f"custom.cooldown:{ctx.author.id}", 0, ex=86400)
+            pipe = database.pipeline(transaction=False)
+            pipe.persist(f"custom.list:{{{ctx.author.id}}}")
+            pipe.delete(f"custom.confirm:{{{ctx.author.id}}}")
+            pipe.set(f"custom.cooldown:{{{ctx.author.id}}}", 0, ex=86400)
+            pipe.incr(f"custom.version:{{{ctx.author.id}}}")
+            mark_dirty(
+                f"custom.list:{{{ctx.author.id}}}",
+                f"custom.version:{{{ctx.author.id}}}",
+                pipe=pipe,
+            )
+            pipe.execute()
             await ctx.send(
                 "Ok, your custom bird list is now available. Use `b!custom view` "
                 + "to view your list. You can change your list again in 24 hours."
@@ -221,32 +249,33 @@ class States(commands.Cog):
 
         if (
             "validate" in command
-            and database.exists(f"custom.confirm:{ctx.author.id}")
-            and database.get(f"custom.confirm:{ctx.author.id}").decode("utf-8")
+            and database.exists(f"custom.confirm:{{{ctx.author.id}}}")
+            and database.get(f"custom.confirm:{{{ctx.author.id}}}").decode("utf-8")
             == "valid"
         ):
             # list was validated, now for user confirm
             logger.info("valid list, user needs to confirm")
-            database.expire(f"custom.list:{ctx.author.id}", 86400)
-            database.set(f"custom.confirm:{ctx.author.id}", "confirm", ex=86400)
+            database.expire(f"custom.list:{{{ctx.author.id}}}", 86400)
+            database.set(f"custom.confirm:{{{ctx.author.id}}}", "confirm", ex=86400)
+            database.incr(f"custom.version:{{{ctx.author.id}}}")
             birdlist = "\n".join(
                 bird.decode("utf-8")
-                for bird in database.smembers(f"custom.list:{ctx.author.id}")
+                for bird in database.smembers(f"custom.list:{{{ctx.author.id}}}")
             )
-            await ctx.send(
-                f"**Please confirm the following list.** ({int(database.scard(f'custom.list:{ctx.author.id}'))} items)"
-            )
-            await self.broken_send(ctx, birdlist, between="```\n")
-            await ctx.send(
-                "Once you have looked over the list and are sure you want to add it, "
+            await self.broken_send(
+                ctx,
+                birdlist,
+                between="```\n",
+                before=f"**Please confirm the following list.** ({int(database.scard(f'custom.list:{{{ctx.author.id}}}'))} items)",
+                after="Once you have looked over the list and are sure you want to add it, "
                 + "please use `b!custom confirm` to have this list added as a custom list. "
                 + "You have another 24 hours to confirm. "
-                + "To start over, upload a new list with the message `b!custom replace`."
+                + "To start over, upload a new list with the message `b!custom replace`.",
             )
             return
 
         if "view" in command:
-            if not database.exists(f"custom.list:{ctx.author.id}"):
+            if not database.exists(f"custom.list:{{{ctx.author.id}}}"):
                 await ctx.send(
                     "You don't have a custom list. To add a custom list, "
                     + "upload a txt file with a bird's name on each line to this DM "
@@ -255,19 +284,24 @@ class States(commands.Cog):
                 return
             birdlist = "\n".join(
                 bird.decode("utf-8")
-                for bird in database.smembers(f"custom.list:{ctx.author.id}")
+                for bird in database.smembers(f"custom.list:{{{ctx.author.id}}}")
             )
             birdlist = f"{birdlist}"
-            await ctx.send(
-                f"**Your Custom Bird List** ({int(database.scard(f'custom.list:{ctx.author.id}'))} items)"
+            await self.broken_send(
+                ctx,
+                birdlist,
+                between="```\n",
+                before=f"**Your Custom Bird List** ({int(database.scard(f'custom.list:{{{ctx.author.id}}}'))} items)",
             )
-            await self.broken_send(ctx, birdlist, between="```\n")
             return
 
-        if not database.exists(f"custom.list:{ctx.author.id}") or "replace" in command:
+        if (
+            not database.exists(f"custom.list:{{{ctx.author.id}}}")
+            or "replace" in command
+        ):
             # user inputted bird list, now validating
             start = time.perf_counter()
-            if database.exists(f"custom.cooldown:{ctx.author.id}"):
+            if database.exists(f"custom.cooldown:{{{ctx.author.id}}}"):
                 await ctx.send(
                     "Sorry, you'll have to wait 24 hours between changing lists."
                 )
@@ -314,9 +348,18 @@ class States(commands.Cog):
                         f"Error on line starting with `{item[:100]}`, position {search.span()[0]}"
                     )
                     return
-            database.delete(
-                f"custom.list:{ctx.author.id}", f"custom.confirm:{ctx.author.id}"
+            pipe = database.pipeline(transaction=False)
+            pipe.delete(
+                f"custom.list:{{{ctx.author.id}}}",
+                f"custom.confirm:{{{ctx.author.id}}}",
             )
+            pipe.incr(f"custom.version:{{{ctx.author.id}}}")
+            mark_dirty(
+                f"custom.list:{{{ctx.author.id}}}",
+                f"custom.version:{{{ctx.author.id}}}",
+                pipe=pipe,
+            )
+            pipe.execute()
             await self.validate(ctx, parsed_birdlist)
             elapsed = time.perf_counter() - start
             await ctx.send(
@@ -327,8 +370,10 @@ class States(commands.Cog):
             )
             return
 
-        if database.exists(f"custom.confirm:{ctx.author.id}"):
-            next_step = database.get(f"custom.confirm:{ctx.author.id}").decode("utf-8")
+        if database.exists(f"custom.confirm:{{{ctx.author.id}}}"):
+            next_step = database.get(f"custom.confirm:{{{ctx.author.id}}}").decode(
+                "utf-8"
+            )
             if next_step == "valid":
                 await ctx.send(
                     "You need to validate your list. Use `b!custom validate` to do so. "
@@ -390,29 +435,42 @@ class States(commands.Cog):
             logger.info("done validating")
 
         if valid_output:
-            logger.info("sending validation success")
             valid_output = (
                 "**Succeeded Items:** Please verify items were detected correctly.\n"
                 + "".join(valid_output)
             )
-            await self.broken_send(ctx, valid_output)
         if invalid_output:
             logger.info("sending validation failure")
             invalid_output = "**FAILED ITEMS:** Please fix and resubmit.\n" + "".join(
                 invalid_output
             )
-            await self.broken_send(ctx, invalid_output)
+            # send both results together
+            await self.broken_send(
+                ctx,
+                invalid_output,
+                before=valid_output.rstrip("\n") if valid_output else "",
+            )
             return False
 
-        await ctx.send("**Saving bird list...**")
-        database.sadd(f"custom.list:{ctx.author.id}", *validated_birdlist)
-        database.expire(f"custom.list:{ctx.author.id}", 86400)
-        database.set(f"custom.confirm:{ctx.author.id}", "valid", ex=86400)
-        await ctx.send(
-            "**Ok!** Your bird list has been temporarily saved. "
+        logger.info("saving bird list")
+        pipe = database.pipeline(transaction=False)
+        pipe.sadd(f"custom.list:{{{ctx.author.id}}}", *validated_birdlist)
+        pipe.expire(f"custom.list:{{{ctx.author.id}}}", 86400)
+        pipe.set(f"custom.confirm:{{{ctx.author.id}}}", "valid", ex=86400)
+        pipe.incr(f"custom.version:{{{ctx.author.id}}}")
+        mark_dirty(
+            f"custom.list:{{{ctx.author.id}}}",
+            f"custom.version:{{{ctx.author.id}}}",
+            pipe=pipe,
+        )
+        pipe.execute()
+        await self.broken_send(
+            ctx,
+            valid_output or "",
+            after="**Ok!** Your bird list has been temporarily saved. "
             + "Please use `b!custom validate` to view and confirm your bird list. "
             + "To start over, upload a new list with the message `b!custom replace`. "
-            + "You have 24 hours to confirm before your bird list will automatically be deleted."
+            + "You have 24 hours to confirm before your bird list will automatically be deleted.",
         )
         return True
 
@@ -19,13 +19,16 @@ from io import BytesIO, StringIO
 from typing import Literal
 
 import discord
-import numpy as np
-import pandas as pd
 from discord import app_commands
 from discord.ext import commands
 
-from bot.data import database, logger
-from bot.functions import CustomCooldown, send_leaderboard, fetch_get_user
+from bot.data import logger, read_database
+from bot.data_functions import daily_keys
+from bot.functions import CustomCooldown, send_leaderboard, fetch_user_names
+from bot.lazy import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
 
 
 class Stats(commands.Cog):
@@ -36,7 +39,9 @@ class Stats(commands.Cog):
     def generate_series(database_key):
         """Generates a pandas.Series from a Redis sorted set."""
         logger.info("generating series")
-        data = database.zrevrangebyscore(database_key, "+inf", "-inf", withscores=True)
+        data = read_database().zrevrangebyscore(
+            database_key, "+inf", "-inf", withscores=True
+        )
         return pd.Series(
             {e[0]: e[1] for e in map(lambda x: (x[0].decode("utf-8"), int(x[1])), data)}
         )
@@ -44,7 +49,7 @@ class Stats(commands.Cog):
     @staticmethod
     def generate_dataframe(database_keys, titles, index=None):
         """Generates a pandas.DataFrame from multiple Redis sorted sets."""
-        pipe = database.pipeline()
+        pipe = read_database().pipeline(transaction=False)
         for key in database_keys:
             pipe.zrevrangebyscore(key, "+inf", "-inf", withscores=True)
         result = pipe.execute()
@@ -68,16 +73,10 @@ class Stats(commands.Cog):
 
     async def convert_users(self, df):
         """Converts discord user ids in DataFrames or Series indexes to usernames."""
-        current_ids = df.index
-        new_index = []
-        for user_id in current_ids:
-            user = await fetch_get_user(int(user_id), bot=self.bot, member=False)
-
-            if user is None:
-                new_index.append("User Unavailable")
-            else:
-                new_index.append(f"{user.name}#{user.discriminator}")
-        df.index = new_index
+        names = await fetch_user_names(df.index, self.bot)
+        df.index = [
+            names.get(int(user_id)) or "User Unavailable" for user_id in df.index
+        ]
         return df
 
     # give frequency stats
@@ -226,7 +225,7 @@ class Stats(commands.Cog):
             today = today.loc[today != 0]
 
             channels_see = len(list(self.bot.get_all_channels()))
-            channels_used = int(database.zcard("score:global"))
+            channels_used = int(read_database().zcard("score:global"))
 
             embed.add_field(
                 name="Today (Since midnight UTC)",
@@ -298,23 +297,13 @@ class Stats(commands.Cog):
             web_usage_week = web_usage_month.loc[:, 7:1]
             web_usage_today = web_usage_week.loc[:, 1]
 
-            score_totals_keys = sorted(
-                map(
-                    lambda x: x.decode("utf-8"),
-                    database.scan_iter(match="daily.webscore:????-??-??", count=5000),
-                )
-            )
+            score_totals_keys = daily_keys("webscore")
             score_totals_titles = map(lambda x: x.split(":")[1], score_totals_keys)
             web_score_total = self.generate_dataframe(
                 score_totals_keys, score_totals_titles
             )
 
-            usage_totals_keys = sorted(
-                map(
-                    lambda x: x.decode("utf-8"),
-                    database.scan_iter(match="daily.web:????-??-??", count=5000),
-                )
-            )
+            usage_totals_keys = daily_keys("web")
             usage_totals_titles = map(lambda x: x.split(":")[1], usage_totals_keys)
             web_usage_total = self.generate_dataframe(
                 usage_totals_keys, usage_totals_titles, index=("check", "skip", "hint")
@@ -453,12 +442,7 @@ class Stats(commands.Cog):
         )
 
         logger.info("exporting missed")
-        keys = sorted(
-            map(
-                lambda x: x.decode("utf-8"),
-                database.scan_iter(match="daily.incorrect:????-??-??", count=5000),
-            )
-        )
+        keys = daily_keys("incorrect")
         titles = ",".join(map(lambda x: x.split(":")[1], keys))
         keys = ["incorrect:global"] + keys
         await _export_helper(
@@ -466,12 +450,7 @@ class Stats(commands.Cog):
         )
 
         logger.info("exporting scores")
-        keys = sorted(
-            map(
-                lambda x: x.decode("utf-8"),
-                database.scan_iter(match="daily.score:????-??-??", count=5000),
-            )
-        )
+        keys = daily_keys("score")
         titles = ",".join(map(lambda x: x.split(":")[1], keys))
         keys = ["users:global"] + keys
         await _export_helper(
@@ -479,24 +458,14 @@ class Stats(commands.Cog):
         )
 
         logger.info("exporting web scores")
-        keys = sorted(
-            map(
-                lambda x: x.decode("utf-8"),
-                database.scan_iter(match="daily.webscore:????-??-??", count=5000),
-            )
-        )
+        keys = daily_keys("webscore")
         titles = ",".join(map(lambda x: x.split(":")[1], keys))
         await _export_helper(
             keys, f"username#discrim,{titles}\n", "web_scores.csv", users=True
         )
 
         logger.info("exporting web usage")
-        keys = sorted(
-            map(
-                lambda x: x.decode("utf-8"),
-                database.scan_iter(match="daily.web:????-??-??", count=5000),
-            )
-        )
+        keys = daily_keys("web")
         titles = ",".join(map(lambda x: x.split(":")[1], keys))
         await _export_helper(keys, f"command,{titles}\n", "web_usage.csv", users=False)
 
@@ -14,20 +14,22 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from discord.ext import commands, tasks
+from discord.ext import commands
 
 import bot.voice as voice_functions
 from bot.data import logger, database
 from bot.functions import CustomCooldown
+from bot.scheduler import Job, scheduler
 
 
 class Voice(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.cleanup.start()
+        # voice connections are in this process, so this runs in every process
+        scheduler.add(Job("voice_cleanup", self.cleanup, 10 * 60))
 
     def cog_unload(self):
-        self.cleanup.cancel()
+        scheduler.remove("voice_cleanup")
 
     @commands.hybrid_command(help="- Play a sound")
     @commands.check(CustomCooldown(3.0, bucket=commands.BucketType.channel))
@@ -86,14 +88,13 @@ class Voice(commands.Cog):
     @commands.guild_only()
     async def disconnect(self, ctx: commands.Context):
         logger.info("command: disconnect")
-        current_voice = database.get(f"voice.server:{ctx.guild.id}")
+        current_voice = database.get(f"voice.server:{{{ctx.guild.id}}}")
         if current_voice is not None:
             race = ctx.bot.get_cog("Race")
             await race.stop_race_(ctx)
         else:
             await voice_functions.disconnect(ctx)
 
-    @tasks.loop(minutes=10)
     async def cleanup(self):
         logger.info("running cleanup task")
         await voice_functions.cleanup(self.bot)
@@ -0,0 +1,203 @@
+# cooldowns.py | cooldowns shared by all bot processes
+# Copyright (C) 2019-2021  EraserBird, person_v1.32, hmmm
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Cooldown buckets are token buckets kept in the database at
+# cooldown.bucket:{<command>:<bucket key>}, so a user can't go over a
+# cooldown by using commands in guilds on different processes. Redis
+# updates a bucket with one script call, and SQLite in one transaction.
+#
+# A bucket also records who took its last token. Until another process
+# takes a token, the process that did holds a lease on the bucket: its
+# own cooldowns are exact, so it takes tokens without waiting on the
+# database and updates the bucket in the background. If the background
+# update shows another process took a token in between, the lease is
+# dropped, so a user switching processes gets at most one extra use.
+
+import asyncio
+import functools
+import os
+import time
+import uuid
+from typing import Dict, Tuple
+
+from discord.ext import commands
+
+from bot.data import database, logger
+from bot.scheduler import run_blocking
+from bot.sharding import SHARD_PROCESSES
+from bot.storage import SQLiteStorage
+
+# keep cooldowns in the database, by default when running several processes
+SHARED_COOLDOWNS = (
+    os.getenv(
+        "SCIOLY_ID_BOT_SHARED_COOLDOWNS", "true" if SHARD_PROCESSES > 1 else "false"
+    )
+    == "true"
+)
+
+# all events of these go to one shard, so the process's own cooldowns are exact
+LOCAL_BUCKETS = (
+    commands.BucketType.guild,
+    commands.BucketType.channel,
+    commands.BucketType.member,
+    commands.BucketType.category,
+    commands.BucketType.role,
+)
+
+# seconds a lease lasts after the last use of the bucket
+LEASE_TIME = 60
+
+# KEYS[1] - bucket key
+# ARGV - rate (tokens), per (seconds), now (unix time), owner
+# returns the seconds until a token is available as a string, 0 if one was
+# taken, and 1 if no one else took the last token or 0 if someone did
+TOKEN_BUCKET = """
+local rate = tonumber(ARGV[1])
+local per = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call("HMGET", KEYS[1], "tokens", "updated", "owner")
+local tokens = tonumber(state[1]) or rate
+local updated = tonumber(state[2]) or now
+local owned = 1
+if state[3] and state[3] ~= ARGV[4] then
+    owned = 0
+end
+tokens = math.min(rate, tokens + math.max(0, now - updated) * rate / per)
+local retry_after = 0
+if tokens < 1 then
+    retry_after = (1 - tokens) * per / rate
+else
+    tokens = tokens - 1
+    redis.call("HSET", KEYS[1], "owner", ARGV[4])
+end
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "updated", tostring(now))
+redis.call("PEXPIRE", KEYS[1], math.ceil(per * 1000))
+return {tostring(retry_after), owned}
+"""
+
+_script = None
+
+
+def is_shared(bucket: commands.BucketType) -> bool:
+    """Returns if a bucket type needs a cooldown shared by all processes."""
+    return SHARED_COOLDOWNS and bucket not in LOCAL_BUCKETS
+
+
+def bucket_key(command: str, key) -> str:
+    if isinstance(key, tuple):
+        key = ".".join(str(part) for part in key)
+    return f"cooldown.bucket:{{{command}:{key}}}"
+
+
+def take_token(key: str, rate: int, per: float, owner: str = "") -> float:
+    """Takes a token from a shared bucket.
+
+    Returns the seconds until a token is available, or 0 if one was taken.
+
+    `key` (str) - database key of the bucket\n
+    `rate` (int) - tokens in a full bucket\n
+    `per` (float) - seconds to refill the bucket\n
+    `owner` (str) - recorded as the taker of the token
+    """
+    return _take_token(key, rate, per, owner)[0]
+
+
+def _take_token(key: str, rate: int, per: float, owner: str) -> Tuple[float, bool]:
+    """Returns the seconds until a token is available, and if no one
+    other than `owner` took the last token."""
+    global _script
+    now = time.time()
+    if isinstance(database, SQLiteStorage):
+        return _take_token_sqlite(key, rate, per, now, owner)
+    if _script is None:
+        _script = database.register_script(TOKEN_BUCKET)
+    retry_after, owned = _script(keys=[key], args=[rate, per, now, owner])
+    return float(retry_after), bool(owned)
+
+
+def _take_token_sqlite(
+    key: str, rate: int, per: float, now: float, owner: str
+) -> Tuple[float, bool]:
+    """Same as TOKEN_BUCKET, in a transaction since SQLite can't run Lua."""
+    with database._transaction():  # pylint: disable=protected-access
+        tokens, updated, last_owner = database.hmget(key, "tokens", "updated", "owner")
+        owned = last_owner is None or last_owner.decode("utf-8") == owner
+        tokens = rate if tokens is None else float(tokens)
+        updated = now if updated is None else float(updated)
+        tokens = min(rate, tokens + max(0, now - updated) * rate / per)
+        retry_after = 0.0
+        if tokens < 1:
+            retry_after = (1 - tokens) * per / rate
+        else:
+            tokens -= 1
+            database.hset(key, "owner", owner)
+        database.hset(key, mapping={"tokens": tokens, "updated": now})
+        database.expire(key, per)
+    return retry_after, owned
+
+
+class TokenLeases:
+    """Shared buckets leased by one cooldown.
+
+    Tokens of leased buckets are taken in the background, so uses that
+    the local bucket allows don't wait on the database.
+    """
+
+    def __init__(self):
+        self.owner = uuid.uuid4().hex
+        self._expires: Dict[str, float] = {}
+        self._next_prune = 0.0
+
+    def take(self, key: str, rate: int, per: float) -> float:
+        """Takes a token from a shared bucket, without waiting if it's leased.
+
+        The local bucket must allow the use before this is called.
+        Returns the seconds until a token is available, or 0 if one was taken.
+        """
+        now = time.time()
+        if self._expires.get(key, 0) > now:
+            self._expires[key] = now + LEASE_TIME
+            future = asyncio.ensure_future(
+                run_blocking(_take_token, key, rate, per, self.owner)
+            )
+            future.add_done_callback(functools.partial(self._confirm, key))
+            return 0.0
+        retry_after, _ = _take_token(key, rate, per, self.owner)
+        if not retry_after:
+            self._expires[key] = now + LEASE_TIME
+            self._prune(now)
+        return retry_after
+
+    def _confirm(self, key: str, future: asyncio.Future):
+        """Drops the lease if another process took a token."""
+        if future.cancelled():
+            self._expires.pop(key, None)
+            return
+        if future.exception() is not None:
+            logger.info(f"taking leased token failed: {future.exception()}")
+            self._expires.pop(key, None)
+            return
+        retry_after, owned = future.result()
+        if retry_after or not owned:
+            logger.info(f"lost cooldown lease {key}")
+            self._expires.pop(key, None)
+
+    def _prune(self, now: float):
+        if now < self._next_prune:
+            return
+        self._next_prune = now + LEASE_TIME
+        for key in [key for key, expires in self._expires.items() if expires <= now]:
+            del self._expires[key]
@@ -24,20 +24,24 @@ import os
 import random
 import shutil
 import string
+import time
 import urllib
 from io import BytesIO
-from typing import Iterable, Tuple
+from typing import Iterable, Optional, Tuple
 
 import aiohttp
 import discord
-import eyed3
-from PIL import Image
 from sentry_sdk import capture_exception
 
 import bot.voice as voice_functions
 from bot.data import GenericError, birdListMaster, database, logger, screech_owls
+from bot.data_functions import mark_dirty
 from bot.filters import Filter, MediaType
 from bot.functions import cache, encrypt_chacha
+from bot.lazy import lazy_import
+
+eyed3 = lazy_import("eyed3")
+Image = lazy_import("PIL.Image")
 
 # Macaulay URL definitions
 SCINAME_URL = "https://api.ebird.org/v2/ref/taxonomy/ebird?fmt=json&species={}"
@@ -50,6 +54,14 @@ COUNT = 5  # fetch 5 media from macaulay at a time
 
 MAX_FILESIZE = 6000000  # limit media to 6mb
 
+# link images that were already uploaded instead of uploading them again
+REUSE_UPLOADS = os.getenv("SCIOLY_ID_BOT_REUSE_UPLOADS") != "false"
+CDN_URL_MARGIN = 60 * 60  # stop using urls an hour before they expire
+CDN_URL_TTL = 60 * 60 * 12  # for urls without an expiration
+
+# edit the "Fetching" message into the bird instead of sending more messages
+LEAN_SEND = os.getenv("SCIOLY_ID_BOT_LEAN_SEND") == "true"
+
 
 class CookieManager:
     def __init__(self):
@@ -79,7 +91,11 @@ class CookieManager:
 cookies = CookieManager()
 
 
-@cache(pre=lambda x: string.capwords(x.strip().replace("-", " ")), local=False)
+@cache(
+    pre=lambda x: string.capwords(x.strip().replace("-", " ")),
+    local=False,
+    ttl=60 * 60 * 24,
+)
 async def get_sciname(bird: str, session=None, retries=0) -> str:
     """Returns the scientific name of a bird.
 
@@ -131,7 +147,11 @@ async def get_sciname(bird: str, session=None, retries=0) -> str:
     return sciname
 
 
-@cache(pre=lambda x: string.capwords(x.strip().replace("-", " ")), local=False)
+@cache(
+    pre=lambda x: string.capwords(x.strip().replace("-", " ")),
+    local=False,
+    ttl=60 * 60 * 24,
+)
 async def get_taxon(bird: str, session=None, retries=0) -> Tuple[str, str]:
     """Returns the taxonomic code of a bird.
 
@@ -254,17 +274,89 @@ def _black_and_white(input_image_path) -> BytesIO:
     return final_buffer
 
 
+def _cdn_url_ttl(url: str) -> int:
+    """Returns how many seconds a Discord attachment url can be reused for.
+
+    Attachment urls are signed, with the expiration as a hex timestamp
+    in the `ex` parameter.
+    """
+    query = urllib.parse.parse_qs(urllib.parse.urlsplit(url).query)
+    try:
+        expires = int(query["ex"][0], 16)
+    except (KeyError, ValueError):
+        return CDN_URL_TTL
+    return int(expires - time.time() - CDN_URL_MARGIN)
+
+
+def _cached_cdn_url(key: str) -> Optional[str]:
+    """Returns the saved attachment url of an image, if any.
+
+    Urls are saved until shortly before they expire, and removed when
+    the message with the attachment is deleted (`forget_uploads`), so
+    they aren't checked before they're used.
+    """
+    url = database.get(key)
+    return None if url is None else url.decode("utf-8")
+
+
+def _save_cdn_url(key: str, message: discord.Message):
+    """Saves the attachment url of a sent image for `_cached_cdn_url`."""
+    url = message.attachments[0].url
+    ttl = _cdn_url_ttl(url)
+    if ttl <= 0:
+        return
+    pipe = database.pipeline(transaction=False)
+    pipe.set(key, url, ex=ttl)
+    pipe.set(f"cdn.message:{{{message.id}}}", key, ex=ttl)
+    pipe.execute()
+
+
+def forget_uploads(message_ids: Iterable[int]):
+    """Removes the saved attachment urls of deleted messages."""
+    message_ids = list(message_ids)
+    pipe = database.pipeline(transaction=False)
+    for message_id in message_ids:
+        pipe.get(f"cdn.message:{{{message_id}}}")
+    keys = [key for key in pipe.execute() if key is not None]
+    if not keys:
+        return
+    logger.info(f"forgetting {len(keys)} deleted uploads")
+    for key in keys:
+        pipe.delete(key)
+    for message_id in message_ids:
+        pipe.delete(f"cdn.message:{{{message_id}}}")
+    pipe.execute()
+
+
+async def _black_and_white_file(filename: str) -> BytesIO:
+    # prevent the black and white conversion from blocking
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        None, functools.partial(_black_and_white, filename)
+    )
+
+
 async def send_bird(
-    ctx, bird: str, media_type: MediaType, filters: Filter, on_error=None, message=None
+    ctx,
+    bird: str,
+    media_type: MediaType,
+    filters: Filter,
+    on_error=None,
+    message=None,
+    header=None,
 ):
     """Gets bird media and sends it to the user.
 
+    In lean mode (`LEAN_SEND`), the media is fetched while the "Fetching"
+    message is sent, and that message is edited into the bird.
+
     `ctx` - Discord context object\n
     `bird` (str) - bird to send\n
     `media_type` (MediaType) - type of media (images/songs)\n
     `filters` (bot.filters Filter)\n
     `on_error` (function) - async function to run when an error occurs, passes error as argument\n
     `message` (str) - text message to send before bird\n
+    `header` (str) - text shown above the "Fetching" message and the bird\n
     """
     if bird == "":
         logger.error("error - bird is blank")
@@ -282,13 +374,29 @@ async def send_bird(
         logger.info("choosing specific Screech Owl")
         bird = random.choice(screech_owls)
 
-    # trigger "typing" discord message
-    if ctx.interaction is None:
+    lean = LEAN_SEND and ctx.interaction is None
+    media_task = None
+    if lean:
+        # start fetching before the placeholder is sent
+        media_task = asyncio.ensure_future(get_media(ctx, bird, media_type, filters))
+        try:
+            delete = await ctx.send(
+                (f"{header}\n" if header else "")
+                + "**Fetching.** This may take a while."
+            )
+        except BaseException:
+            media_task.cancel()
+            raise
+    elif ctx.interaction is None:
+        # trigger "typing" discord message
         delete = await ctx.send("**Fetching.** This may take a while.")
         await ctx.typing()
 
     try:
-        filename, extension = await get_media(ctx, bird, media_type, filters)
+        if media_task is not None:
+            filename, extension = await media_task
+        else:
+            filename, extension = await get_media(ctx, bird, media_type, filters)
         macaulay_asset_id = filename.split("/")[-1].split(".")[0]
     except GenericError as e:
         if ctx.interaction is None:
@@ -325,12 +433,16 @@ async def send_bird(
         )
         return
 
+    # images that were already uploaded are linked in an embed instead
+    cdn_key = cdn_url = None
+    if REUSE_UPLOADS and media_type is MediaType.IMAGE and macaulay_asset_id:
+        variant = f"{extension}.bw" if filters.bw else extension
+        cdn_key = f"cdn.url:{{{macaulay_asset_id}.{variant}}}"
+        cdn_url = _cached_cdn_url(cdn_key)
+
     if media_type is MediaType.IMAGE:
-        if filters.bw:
-            # prevent the black and white conversion from blocking
-            loop = asyncio.get_running_loop()
-            fn = functools.partial(_black_and_white, filename)
-            filename = await loop.run_in_executor(None, fn)
+        if filters.bw and cdn_url is None:
+            filename = await _black_and_white_file(filename)
 
     elif media_type is MediaType.SONG and not filters.vc:
         # remove spoilers in tag metadata
@@ -339,6 +451,8 @@ async def send_bird(
             audio_file.tag.remove(filename)
 
     output_message = ""
+    if lean and header:
+        output_message += f"{header}\n"
     if message is not None:
         output_message += message
 
@@ -350,14 +464,40 @@ async def send_bird(
         )
 
     if media_type is MediaType.SONG and filters.vc:
-        await ctx.send(output_message)
+        if lean:
+            await delete.edit(content=output_message)
+        else:
+            await ctx.send(output_message)
         await voice_functions.play(ctx, filename)
     else:
-        # change filename to avoid spoilers
-        file_obj = discord.File(filename, filename=f"bird.{extension}")
-        await ctx.send(output_message, file=file_obj)
+        if cdn_url is not None:
+            embed = discord.Embed()
+            embed.set_image(url=cdn_url)
+            try:
+                if lean:
+                    await delete.edit(content=output_message, embed=embed)
+                else:
+                    await ctx.send(output_message, embed=embed)
+            except discord.HTTPException as e:
+                # upload the file instead
+                logger.info(f"sending attachment url failed: {e}")
+                database.delete(cdn_key)
+                cdn_url = None
+                if filters.bw:
+                    filename = await _black_and_white_file(filename)
+        if cdn_url is None:
+            # change filename to avoid spoilers
+            file_obj = discord.File(filename, filename=f"bird.{extension}")
+            if lean:
+                sent = await delete.edit(
+                    content=output_message, embed=None, attachments=[file_obj]
+                )
+            else:
+                sent = await ctx.send(output_message, file=file_obj)
+            if cdn_key and sent is not None and sent.attachments:
+                _save_cdn_url(cdn_key, sent)
 
-    if ctx.interaction is None:
+    if ctx.interaction is None and not lean:
         await delete.delete()
 
 
@@ -382,7 +522,7 @@ async def get_media(ctx, bird: str, media_type: MediaType, filters: Filter):
         sciBird = bird
     media = await get_files(sciBird, media_type, filters)
     logger.info("media: " + str(media))
-    prevJ = int(database.hget(f"channel:{ctx.channel.id}", "prevJ"))
+    prevJ = int(database.hget(f"channel:{{{ctx.channel.id}}}", "prevJ"))
     # Randomize start (choose beginning 4/5ths in case it fails checks)
     if media:
         j = (prevJ + 1) % len(media)
@@ -404,7 +544,7 @@ async def get_media(ctx, bird: str, media_type: MediaType, filters: Filter):
                 break
             raise GenericError(f"No Valid {media_type.name().title()} Found", code=999)
 
-        database.hset(f"channel:{ctx.channel.id}", "prevJ", str(j))
+        database.hset(f"channel:{{{ctx.channel.id}}}", "prevJ", str(j))
     else:
         raise GenericError(f"No {media_type.name().title()} Found", code=100)
 
@@ -427,14 +567,20 @@ async def get_files(
     logger.info(f"get_files retries: {retries}")
     directory = f"bot_files/cache/{media_type.name()}/{sciBird}{filters.to_int()}/"
     # track counts for more accurate eviction
-    database.zincrby(
+    pipe = database.pipeline(transaction=False)
+    pipe.zincrby(
         "frequency.media:global",
         1,
         f"{media_type.name()}/{sciBird}{filters.to_int()}",
     )
+    mark_dirty("frequency.media:global", pipe=pipe)
+    pipe.execute()
     try:
         logger.info("trying")
-        files_dir = os.listdir(directory)
+        # skip files other processes are still downloading
+        files_dir = [
+            path for path in os.listdir(directory) if not path.endswith(".tmp")
+        ]
         logger.info(directory)
         if not files_dir:
             raise GenericError("No Files", code=100)
@@ -475,8 +621,7 @@ async def download_media(
                 aiohttp.ClientSession(cookie_jar=(await cookies()))
             )
         urls = await _get_urls(session, bird, media_type, filters)
-        if not os.path.exists(directory):
-            os.makedirs(directory)
+        os.makedirs(directory, exist_ok=True)
         urls = [(f"{directory}{asset_id}", url) for url, asset_id in urls]
         sem = asyncio.BoundedSemaphore(3)
         filenames = await asyncio.gather(
@@ -543,7 +688,10 @@ async def _get_urls(
             cursor_mark = catalog_data[-1]["cursorMark"]
         else:
             cursor_mark = b""
-        database.set(f"media.cursor:{database_key}", cursor_mark)
+        pipe = database.pipeline(transaction=False)
+        pipe.set(f"media.cursor:{database_key}", cursor_mark)
+        mark_dirty(f"media.cursor:{database_key}", pipe=pipe)
+        pipe.execute()
 
         if media_type is MediaType.IMAGE:
             if filters.large:
@@ -613,8 +761,11 @@ async def _download_helper(path, url, session, sem):
                     raise GenericError("Invalid content-type.")
 
                 filename = f"{path}.{ext}"
+                # download to a temporary file, since other shard processes
+                # may be reading or downloading the same file
+                temp = f"{filename}.{os.getpid()}.tmp"
                 # from https://stackoverflow.com/questions/38358521/alternative-of-urllib-urlretrieve-in-python-3-5
-                with open(filename, "wb") as out_file:
+                with open(temp, "wb") as out_file:
                     block_size = 1024 * 8
                     while True:
                         block = await response.content.read(
@@ -623,6 +774,7 @@ async def _download_helper(path, url, session, sem):
                         if not block:
                             break
                         out_file.write(block)
+                os.replace(temp, filename)
                 return filename
 
         except aiohttp.ClientError as e:
@@ -673,7 +825,10 @@ def evict_media():
             num=3,
         ),
     ):
-        database.zadd("frequency.media:global", {item: 0})
+        pipe = database.pipeline(transaction=False)
+        pipe.zadd("frequency.media:global", {item: 0})
+        mark_dirty("frequency.media:global", pipe=pipe)
+        pipe.execute()
         shutil.rmtree(f"bot_files/cache/{item}/")
         logger.info(f"{item} removed")
 
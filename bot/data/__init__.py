@@ -14,35 +14,129 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import asyncio
+import collections
+import collections.abc
+import contextvars
 import csv
+import hashlib
 import logging
 import logging.handlers
+import marshal
 import os
 import string
 import sys
-from typing import Dict, List
+import time
+from typing import Callable, Dict, List, Optional
 
 import redis
+import redis.cluster
 import sentry_sdk
-import wikipedia
 from discord.ext import commands
 from dotenv import find_dotenv, load_dotenv
 from sentry_sdk.integrations.aiohttp import AioHttpIntegration
 from sentry_sdk.integrations.redis import RedisIntegration
 
+from bot.lazy import lazy_import
+from bot.storage import SQLiteStorage
+
+wikipedia = lazy_import("wikipedia")
+
 load_dotenv(find_dotenv(), verbose=True)
 
 
 # define database for one connection
-if os.getenv("SCIOLY_ID_BOT_LOCAL_REDIS") == "true":
+# set SCIOLY_ID_BOT_REDIS_CLUSTER to true to connect to a Redis Cluster
+# set SCIOLY_ID_BOT_STORAGE to sqlite to use an embedded database instead of redis
+if os.getenv("SCIOLY_ID_BOT_STORAGE") == "sqlite":
+    database = SQLiteStorage(
+        os.getenv("SCIOLY_ID_BOT_STORAGE_PATH", "bot_files/database.sqlite3")
+    )
+elif os.getenv("SCIOLY_ID_BOT_LOCAL_REDIS") == "true":
     host = os.getenv("SCIOLY_ID_BOT_LOCAL_REDIS_HOST")
     if host is None:
         host = "localhost"
-    database = redis.Redis(host=host, port=6379, db=0)
+    if os.getenv("SCIOLY_ID_BOT_REDIS_CLUSTER") == "true":
+        database = redis.cluster.RedisCluster(host=host, port=6379)
+    else:
+        database = redis.Redis(host=host, port=6379, db=0)
+elif os.getenv("SCIOLY_ID_BOT_REDIS_CLUSTER") == "true":
+    database = redis.cluster.RedisCluster.from_url(os.getenv("REDIS_URL"))
 else:
     database = redis.from_url(os.getenv("REDIS_URL"))
 
 
+# optional read replica for analytics and leaderboards
+# SCIOLY_ID_BOT_REPLICA_URL is the replica's url, and reads go to the primary
+# if the replica is more than SCIOLY_ID_BOT_REPLICA_MAX_LAG seconds behind
+REPLICA_URL = os.getenv("SCIOLY_ID_BOT_REPLICA_URL")
+REPLICA_MAX_LAG = float(os.getenv("SCIOLY_ID_BOT_REPLICA_MAX_LAG", "30"))
+REPLICA_CHECK_INTERVAL = 5
+replica = redis.from_url(REPLICA_URL) if REPLICA_URL else None
+_replica_status = {"checked": 0.0, "ok": False}
+# (time, primary replication offset) at each check, to turn offsets into seconds
+_primary_offsets: collections.deque = collections.deque()
+
+
+def _replica_lag(now: float, replica_offset: int) -> float:
+    """Returns how many seconds of writes the replica is missing.
+
+    The replica has every write from before the latest check where the
+    primary's offset was at most `replica_offset`. Lag is infinite if
+    there is no such check yet.
+    """
+    # keep checks old enough to measure lags just over the max
+    while (
+        len(_primary_offsets) > 1
+        and _primary_offsets[1][0] < now - REPLICA_MAX_LAG - REPLICA_CHECK_INTERVAL
+    ):
+        _primary_offsets.popleft()
+    if replica_offset >= _primary_offsets[-1][1]:
+        return 0.0
+    applied = [
+        checked for checked, offset in _primary_offsets if offset <= replica_offset
+    ]
+    return now - applied[-1] if applied else float("inf")
+
+
+def _replica_ok() -> bool:
+    """Checks that the replica is connected and not too far behind."""
+    now = time.monotonic()
+    if now - _replica_status["checked"] < REPLICA_CHECK_INTERVAL:
+        return _replica_status["ok"]
+    try:
+        # the primary first, so the replica's offset is never older
+        _primary_offsets.append(
+            (now, database.info("replication")["master_repl_offset"])
+        )
+        info = replica.info("replication")
+        ok = (
+            info.get("master_link_status") == "up"
+            and not info.get("master_sync_in_progress")
+            and _replica_lag(now, info.get("slave_repl_offset", -1)) <= REPLICA_MAX_LAG
+        )
+    except (redis.exceptions.RedisError, KeyError) as e:
+        logger.info(f"replica check failed: {e!r}")
+        ok = False
+    if ok != _replica_status["ok"]:
+        logger.info(f"replica {'available' if ok else 'unavailable'}")
+    _replica_status.update(checked=now, ok=ok)
+    return ok
+
+
+def read_database():
+    """Returns the connection to use for read-only analytics queries.
+
+    This is the read replica if one is configured and up to date,
+    otherwise the primary `database`. Results may be up to
+    REPLICA_MAX_LAG seconds old, so don't use this for reads that
+    must see the latest writes.
+    """
+    if replica is not None and _replica_ok():
+        return replica
+    return database
+
+
 def before_sentry_send(event, hint):
     """Fingerprint certain events before sending to Sentry."""
     if "exc_info" in hint:
@@ -70,8 +164,13 @@ if os.getenv("SCIOLY_ID_BOT_USE_SENTRY") != "false":
 
 # Database Format Definitions
 
+# Keys for one user, channel, or guild have the id in a hash tag,
+# like channel:{channel_id}, so they are in the same Redis Cluster slot.
+# Commands that use multiple keys should only use keys from one group.
+# see bot/migrations.py hash_tag_keys
+
 # server format:
-# channel:channel_id : {
+# channel:{channel_id} : {
 #                    "bird",
 #                    "answered",
 #                    "prevB", (make sure it sends diff birds)
@@ -79,7 +178,7 @@ if os.getenv("SCIOLY_ID_BOT_USE_SENTRY") != "false":
 # }
 
 # session format:
-# session.data:user_id : {
+# session.data:{user_id} : {
 #                    "start": 0,
 #                    "stop": 0,
 #                    "correct": 0,
@@ -90,10 +189,10 @@ if os.getenv("SCIOLY_ID_BOT_USE_SENTRY") != "false":
 #                    "wiki": wiki, - Enables if "wiki", disables if empty (""), default "wiki"
 #                    "strict": strict - Enables strict spelling if "strict", disables if empty, default ""
 # }
-# session.incorrect:user_id : [bird name, # incorrect]
+# session.incorrect:{user_id} : [bird name, # incorrect]
 
 # race format:
-# race.data:ctx.channel.id : {
+# race.data:{channel_id} : {
 #                    "start": 0
 #                    "stop": 0,
 #                    "limit": 10,
@@ -104,26 +203,44 @@ if os.getenv("SCIOLY_ID_BOT_USE_SENTRY") != "false":
 #                    "strict": strict - Enables strict spelling if "strict", disables if empty, default "",
 #                    "alpha": alpha - Enables alpha codes if "alpha", disables if empty, default ""
 # }
-# race.scores:ctx.channel.id : [ctx.author.id, #correct]
+# race.scores:{channel_id} : [ctx.author.id, #correct]
 
 # voice formats:
-# voice.server:guild_id : channel_id
+# voice.server:{guild_id} : channel_id
 
 # leaderboard formats:
 #    users:global : [user id, # of correct]
-#    users.server.id:guild_id : [user id ... ]
+#    users.server.id:{guild_id} : [user id ... ]
+
+# user sync format (see get_all_users):
+#    users.synced:{scope} : [user id, last sync timestamp]
+#    users.sync.checkpoint:{scope} : last synced user id of an unfinished sync
+#    scope is global, or process.{index} for sharded processes
+
+# sharding format (see bot.sharding):
+#    shards.guilds:global : {process index : number of guilds}
+
+# user display format (names for leaderboards and exports):
+#    user.display:{user_id} : {
+#                    name : username,
+#                    discriminator : "0000",
+#                    avatar : avatar hash or ""
+#    }
 
 # streaks format:
 #    streak:global : [user id, current streak]
 #    streak.max:global : [user id, max streak]
 
+# stat sorted sets (incorrect, correct, daily) only store non-zero counts,
+# missing entries should be read as 0. see bot/migrations.py compact_stats
+
 # incorrect birds format:
 #    incorrect:global : [bird name, # incorrect]
-#    incorrect.server:guild_id : [bird name, # incorrect]
-#    incorrect.user:user_id: : [bird name, # incorrect]
+#    incorrect.server:{guild_id} : [bird name, # incorrect]
+#    incorrect.user:{user_id} : [bird name, # incorrect]
 
 # correct birds format:
-#    correct.user:user_id : [bird name, # correct]
+#    correct.user:{user_id} : [bird name, # correct]
 
 # bird frequency format:
 #   frequency.bird:global : [bird name, # displayed]
@@ -133,13 +250,14 @@ if os.getenv("SCIOLY_ID_BOT_USE_SENTRY") != "false":
 
 # channel score format:
 #   score:global : [channel id, # of correct]
-#   channels:guild_id : [channel id ... ]
+#   channels:{guild_id} : [channel id ... ]
 
 # daily update format:
 #     daily.score:YYYY-MM-DD : [user id, # correct today]
 #     daily.incorrect:YYYY-MM-DD : [bird name, # incorrect today]
 #     daily.web:YYYY-MM-DD : [("check", "skip", "hint"), daily value]
 #     daily.webscore:YYYY-MM-DD : [user id, # correct today]
+#     daily.dates:(score, incorrect, web, webscore) : { YYYY-MM-DD, ... }
 
 # ban format:
 #   banned:global : [user id, 0]
@@ -151,18 +269,21 @@ if os.getenv("SCIOLY_ID_BOT_USE_SENTRY") != "false":
 #   noholiday:global : { guild id, ... }
 
 # leave confirm format:
-#   leave:guild_id : 0
+#   leave:{guild_id} : 0
 
 # custom list confirm format:
-#   custom.confirm:user_id : "valid" after server list validation
+#   custom.confirm:{user_id} : "valid" after server list validation
 #                            "confirm" after user list validation
 #                            "delete" if user is about to delete lists
 
 # custom list cooldown format:
-#   custom.cooldown:user_id : 0
+#   custom.cooldown:{user_id} : 0
 
 # custom list format (set):
-#   custom.list:user_id : [validated birds, ...]
+#   custom.list:{user_id} : [validated birds, ...]
+
+# custom list version format (incremented when the list or confirm changes):
+#   custom.version:{user_id} : 0
 
 # cooldown rate limit format:
 #   cooldown:global : 0
@@ -171,6 +292,19 @@ if os.getenv("SCIOLY_ID_BOT_USE_SENTRY") != "false":
 # (for media eviction)
 #   frequency.media:global : ["{type}/{sciname}{filter}", count]
 
+# redis cache format (see bot/cache.py):
+#   cache.function_name:sha1 : serialized result
+#   cache.index:function_name : [sha1, expiration timestamp]
+
+# backup format (see bot/backup.py):
+#   backup.dirty:{backup} : { keys changed since the last backup, ... }
+#   backup.dirty.swap:{backup}, backup.dirty.processing:{backup} :
+#                    { keys in the running incremental backup, ... }
+#   backup.meta:{backup} : {
+#                    "full": timestamp of last full backup,
+#                    "delta": timestamp of last incremental backup
+#   }
+
 # media cursor format:
 #   media.cursor:{type}/{sciname}{filter} : cursor
 
@@ -308,8 +442,11 @@ def format_wiki_url(ctx, bird: str = None) -> str:
     else:
         logger.info("found in cache")
 
-    if database.hget(f"session.data:{user_id}", "wiki") == b"" or database.exists(
-        f"race.data:{channel_id}"
+    # bot.races imports this module
+    from bot.races import get_race  # pylint: disable=import-outside-toplevel
+
+    if database.hget(f"session.data:{{{user_id}}}", "wiki") == b"" or (
+        channel_id and get_race(channel_id) is not None
     ):
         logger.info("disabling preview")
         url = f"<{url}>"
@@ -416,12 +553,12 @@ def _state_lists():
     return states_
 
 
-def _all_birds() -> List[str]:
+def _all_birds(bird_list: List[str], states_: dict) -> List[str]:
     """Combines all state and national lists."""
     logger.info("Working on master lists")
     birds = []
-    birds += birdList
-    for state in states.values():
+    birds += bird_list
+    for state in states_.values():
         birds += state["birdList"]
     birds += screech_owls
     birds += goatsuckers
@@ -430,17 +567,253 @@ def _all_birds() -> List[str]:
     return birds
 
 
-(  # pylint: disable=unbalanced-tuple-unpacking
-    birdList,
-    songBirds,
-    sciListMaster,
-    memeList,
-) = _nats_lists()
-states = _state_lists()
-birdListMaster = _all_birds()
-taxons = _taxons()
-wikipedia_urls = _wiki_urls()
-alpha_codes = _alpha_codes()
+# compiled copy of the parsed text files, rebuilt when the files change
+# build it ahead of time with python3 -m bot.data
+SNAPSHOT_PATH = os.getenv("SCIOLY_ID_BOT_DATA_SNAPSHOT", "bot_files/data.snapshot")
+SNAPSHOT_MAGIC = b"BIRDDAT1"
+
+
+def _source_signature() -> bytes:
+    """Hashes the path, size, and mtime of every data file."""
+    signature = hashlib.sha1(sys.version.encode())
+    for root, dirs, files in os.walk("bot/data"):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename.endswith(".txt"):
+                path = os.path.join(root, filename)
+                stat = os.stat(path)
+                signature.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return signature.digest()
+
+
+def _parse_data() -> dict:
+    """Reads the bird lists from the text files."""
+    bird_list, song_birds, sci_list, meme_list = _nats_lists()
+    states_ = _state_lists()
+    return {
+        "birdList": bird_list,
+        "songBirds": song_birds,
+        "sciListMaster": sci_list,
+        "memeList": meme_list,
+        "states": states_,
+        "birdListMaster": _all_birds(bird_list, states_),
+        "taxons": _taxons(),
+        "wikipedia_urls": _wiki_urls(),
+        "alpha_codes": _alpha_codes(),
+    }
+
+
+def _load_snapshot(signature: bytes):
+    """Returns the data from the snapshot, or None if it is missing or stale."""
+    try:
+        with open(SNAPSHOT_PATH, "rb") as f:
+            raw = f.read()
+    except OSError:
+        return None
+    header = len(SNAPSHOT_MAGIC) + len(signature)
+    if raw[:header] != SNAPSHOT_MAGIC + signature:
+        logger.info("data snapshot is out of date")
+        return None
+    try:
+        return marshal.loads(raw[header:])
+    except (EOFError, ValueError, TypeError) as e:
+        logger.info(f"unable to read data snapshot: {e}")
+        return None
+
+
+def build_snapshot(signature: bytes = None) -> dict:
+    """Parses the text files and saves them as a snapshot."""
+    if signature is None:
+        signature = _source_signature()
+    data = _parse_data()
+    try:
+        os.makedirs(os.path.dirname(SNAPSHOT_PATH) or ".", exist_ok=True)
+        # sharded processes may save at the same time
+        temp = f"{SNAPSHOT_PATH}.{os.getpid()}.tmp"
+        with open(temp, "wb") as f:
+            f.write(SNAPSHOT_MAGIC + signature + marshal.dumps(data, 4))
+        os.replace(temp, SNAPSHOT_PATH)
+        logger.info(f"data snapshot saved to {SNAPSHOT_PATH}")
+    except OSError as e:
+        logger.info(f"unable to save data snapshot: {e}")
+    return data
+
+
+def load_data(signature: bytes = None) -> dict:
+    """Loads the bird lists from the snapshot, falling back to the text files."""
+    if signature is None:
+        signature = _source_signature()
+    data = _load_snapshot(signature)
+    if data is None:
+        return build_snapshot(signature)
+    logger.info("loaded data snapshot")
+    return data
+
+
+class _DataView:
+    """A read-only view of one item of the current bird data.
+
+    Modules import the lists by name, so reloading can't rebind them.
+    Views look up the item in `current_data()` on every use instead.
+    """
+
+    __slots__ = ("_name",)
+
+    def __init__(self, name: str):
+        self._name = name
+
+    def _get(self):
+        return current_data()[self._name]
+
+    def __len__(self):
+        return len(self._get())
+
+    def __iter__(self):
+        return iter(self._get())
+
+    def __contains__(self, item):
+        return item in self._get()
+
+    def __getitem__(self, key):
+        return self._get()[key]
+
+    def __eq__(self, other):
+        return self._get() == (other._get() if isinstance(other, _DataView) else other)
+
+    def __repr__(self):
+        return repr(self._get())
+
+
+class _ListView(_DataView, collections.abc.Sequence):
+    __slots__ = ()
+
+    def __add__(self, other):
+        return list(self._get()) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self._get())
+
+    def index(self, *args):
+        return self._get().index(*args)
+
+    def count(self, value):
+        return self._get().count(value)
+
+
+class _DictView(_DataView, collections.abc.Mapping):
+    __slots__ = ()
+
+    def get(self, key, default=None):
+        return self._get().get(key, default)
+
+    def keys(self):
+        return self._get().keys()
+
+    def values(self):
+        return self._get().values()
+
+    def items(self):
+        return self._get().items()
+
+
+# functions that build indexes from the data, rerun on every reload
+_derived: Dict[str, Callable[[dict], object]] = {}
+# the data a command started with, so a reload doesn't change it mid-command
+_pinned: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar(
+    "bird_data", default=None
+)
+_signature = _source_signature()
+_current = load_data(_signature)
+
+
+def current_data() -> dict:
+    """Returns the bird data pinned by this task, or the latest data."""
+    return _pinned.get() or _current
+
+
+def pin_data() -> dict:
+    """Pins the latest bird data for the current task and the tasks it starts.
+
+    Call this when a command starts, so a reload during the command
+    doesn't mix lists from before and after.
+    """
+    _pinned.set(_current)
+    return _current
+
+
+def register_derived(name: str, build: Callable[[dict], object]):
+    """Adds an index built from the data, rebuilt on every reload.
+
+    The index is stored in the data as `name`, so it is swapped and
+    pinned together with the lists it was built from.
+
+    `name` (str) - key of the index in the data\n
+    `build` (function) - builds the index from the data
+    """
+    _derived[name] = build
+    _current[name] = build(_current)
+
+
+def _build_data(signature: bytes) -> dict:
+    data = build_snapshot(signature)
+    for name, build in _derived.items():
+        data[name] = build(data)
+    return data
+
+
+_reload_lock = asyncio.Lock()
+
+
+async def reload_data(force: bool = False) -> bool:
+    """Rebuilds the bird data in the background and swaps it in.
+
+    The lists and indexes are built in a thread, then replaced all at
+    once. Commands already running keep the data they pinned.
+    Returns whether the data was reloaded.
+
+    `force` (bool) - whether to reload even if no files changed
+    """
+    global _current, _signature  # pylint: disable=global-statement
+    async with _reload_lock:
+        loop = asyncio.get_running_loop()
+        signature = await loop.run_in_executor(None, _source_signature)
+        if signature == _signature and not force:
+            logger.info("data files unchanged, not reloading")
+            return False
+        start = time.perf_counter()
+        data = await loop.run_in_executor(None, _build_data, signature)
+        _current, _signature = data, signature
+        logger.info(
+            f"data reloaded in {time.perf_counter() - start:.2f} s: "
+            + f"{len(data['birdList'])} birds, {len(data['states'])} states, "
+            + f"{len(data['taxons'])} taxons"
+        )
+        return True
+
+
+async def watch_data(interval: float = 30.0):
+    """Reloads the bird data whenever the text files change.
+
+    `interval` (float) - seconds between checks
+    """
+    logger.info(f"watching data files every {interval} s")
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await reload_data()
+        except Exception as e:  # pylint: disable=broad-except
+            logger.exception(f"data reload failed: {e}")
+
+
+birdList = _ListView("birdList")
+songBirds = _ListView("songBirds")
+sciListMaster = _ListView("sciListMaster")
+memeList = _ListView("memeList")
+states = _DictView("states")
+birdListMaster = _ListView("birdListMaster")
+taxons = _DictView("taxons")
+wikipedia_urls = _DictView("wikipedia_urls")
+alpha_codes = _DictView("alpha_codes")
 logger.info(f"National Lengths: {len(birdList)}, {len(songBirds)}")
 logger.info(f"Master Lengths: {len(birdListMaster)}, {len(sciListMaster)}")
 logger.info("Done importing data!")
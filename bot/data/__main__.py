@@ -0,0 +1,52 @@
+# data/__main__.py | build the data snapshot
+# Copyright (C) 2019-2021  EraserBird, person_v1.32, hmmm
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Usage: python3 -m bot.data
+# Rebuilds the snapshot and compares loading it with parsing the text files.
+
+import logging
+import time
+
+from bot.data import (
+    SNAPSHOT_PATH,
+    _load_snapshot,
+    _parse_data,
+    _source_signature,
+    build_snapshot,
+    logger,
+)
+
+if __name__ == "__main__":
+    build_snapshot()
+
+    # the parsers log every file, which would be part of the measurement
+    logger.setLevel(logging.WARNING)
+    runs = 5
+    start = time.perf_counter()
+    for _ in range(runs):
+        parsed = _parse_data()
+    parse_time = (time.perf_counter() - start) / runs
+    start = time.perf_counter()
+    for _ in range(runs):
+        loaded = _load_snapshot(_source_signature())
+    load_time = (time.perf_counter() - start) / runs
+    logger.setLevel(logging.DEBUG)
+
+    assert loaded == parsed, "snapshot does not match the text files"
+    print(f"snapshot: {SNAPSHOT_PATH}")
+    print(f"text files: {parse_time * 1000:.1f} ms")
+    print(f"snapshot: {load_time * 1000:.1f} ms (including validation)")
+    print(f"saved: {(parse_time - load_time) * 1000:.1f} ms per import")
@@ -17,7 +17,79 @@
 import datetime
 import string
 
-from bot.data import database, logger, states
+from bot.cache import Cache
+from bot.data import database, logger, read_database, states
+from bot.races import get_race
+
+# last display recorded for each user, to skip unchanged writes
+_user_displays = Cache("user_display", maxsize=10000, ttl=60 * 60)
+
+
+def mark_dirty(*keys, pipe=None):
+    """Records that `keys` changed since the last backup.
+
+    Incremental backups only dump the keys in this set. Keys
+    that are not marked are only saved in full backups.
+
+    `keys` (str) - changed keys\n
+    `pipe` (Pipeline) - pipeline of the write, to mark the keys in the
+    same round trip. The keys should be marked after the write is queued.
+    """
+    (database if pipe is None else pipe).sadd("backup.dirty:{backup}", *keys)
+
+
+def daily_increment(family: str, member, amount: int = 1):
+    """Increments `member` in today's `daily.{family}` sorted set.
+
+    The date is also added to `daily.dates:{family}` so the days
+    with data can be found without scanning the keyspace.
+
+    `family` (str) - one of "score", "incorrect", "web", "webscore"\n
+    `member` - member to increment\n
+    `amount` (int) - amount to increment by, usually 1
+    """
+    date = str(datetime.datetime.now(datetime.timezone.utc).date())
+    pipe = database.pipeline(transaction=False)
+    pipe.zincrby(f"daily.{family}:{date}", amount, member)
+    pipe.sadd(f"daily.dates:{family}", date)
+    mark_dirty(f"daily.{family}:{date}", f"daily.dates:{family}", pipe=pipe)
+    pipe.execute()
+
+
+def daily_keys(family: str) -> list:
+    """Returns the `daily.{family}` keys for every recorded day, oldest first.
+
+    `family` (str) - one of "score", "incorrect", "web", "webscore"
+    """
+    dates = sorted(
+        map(
+            lambda x: x.decode("utf-8"),
+            read_database().smembers(f"daily.dates:{family}"),
+        )
+    )
+    return [f"daily.{family}:{date}" for date in dates]
+
+
+def user_display_setup(user):
+    """Records a user's name, discriminator, and avatar.
+
+    Leaderboards and exports read names from `user.display:{user_id}`
+    instead of fetching every user from Discord.
+
+    `user` - Discord user or member object
+    """
+    display = {
+        "name": user.name,
+        "discriminator": str(user.discriminator),
+        "avatar": user.avatar.key if user.avatar else "",
+    }
+    if _user_displays.get(user.id) == display:
+        return
+    pipe = database.pipeline(transaction=False)
+    pipe.hset(f"user.display:{{{user.id}}}", mapping=display)
+    mark_dirty(f"user.display:{{{user.id}}}", pipe=pipe)
+    pipe.execute()
+    _user_displays.set(user.id, display)
 
 
 async def channel_setup(ctx):
@@ -26,9 +98,9 @@ async def channel_setup(ctx):
     `ctx` - Discord context object
     """
     logger.info("checking channel setup")
-    if not database.exists(f"channel:{ctx.channel.id}"):
+    if not database.exists(f"channel:{{{ctx.channel.id}}}"):
         database.hset(
-            f"channel:{ctx.channel.id}",
+            f"channel:{{{ctx.channel.id}}}",
             mapping={"bird": "", "answered": 1, "prevB": "", "prevJ": 20},
         )
         # true = 1, false = 0, index 0 is last arg, prevJ is 20 to define as integer
@@ -36,12 +108,18 @@ async def channel_setup(ctx):
         await ctx.send("Ok, setup! I'm all ready to use!")
 
     if database.zscore("score:global", str(ctx.channel.id)) is None:
-        database.zadd("score:global", {str(ctx.channel.id): 0})
+        pipe = database.pipeline(transaction=False)
+        pipe.zadd("score:global", {str(ctx.channel.id): 0})
+        mark_dirty("score:global", pipe=pipe)
+        pipe.execute()
         logger.info("channel score added")
 
     if ctx.guild is not None:
         channels = map(lambda x: str(x.id), ctx.guild.text_channels)
-        database.sadd(f"channels:{ctx.guild.id}", *channels)
+        # only marked when a channel is new, since marking it on every
+        # command would put the set in every incremental backup
+        if database.sadd(f"channels:{{{ctx.guild.id}}}", *channels):
+            mark_dirty(f"channels:{{{ctx.guild.id}}}")
 
 
 async def user_setup(ctx):
@@ -58,37 +136,50 @@ async def user_setup(ctx):
         guild = ctx.guild
 
     logger.info("checking user data")
+    if ctx is not None:
+        user_display_setup(ctx.author)
+
     if database.zscore("users:global", user_id) is None:
-        database.zadd("users:global", {user_id: 0})
+        pipe = database.pipeline(transaction=False)
+        pipe.zadd("users:global", {user_id: 0})
+        mark_dirty("users:global", pipe=pipe)
+        pipe.execute()
         logger.info("user global added")
         if ctx is not None:
             await ctx.send("Welcome <@" + user_id + ">!")
 
-    date = str(datetime.datetime.now(datetime.timezone.utc).date())
-    if database.zscore(f"daily.score:{date}", user_id) is None:
-        database.zadd(f"daily.score:{date}", {user_id: 0})
-        logger.info("user daily added")
-
     # Add streak
     if (database.zscore("streak:global", user_id) is None) or (
         database.zscore("streak.max:global", user_id) is None
     ):
-        database.zadd("streak:global", {user_id: 0})
-        database.zadd("streak.max:global", {user_id: 0})
+        pipe = database.pipeline(transaction=False)
+        pipe.zadd("streak:global", {user_id: 0})
+        pipe.zadd("streak.max:global", {user_id: 0})
+        mark_dirty("streak:global", "streak.max:global", pipe=pipe)
+        pipe.execute()
         logger.info("added streak")
 
     if guild is not None:
-        if database.exists(f"users.server:{ctx.guild.id}"):
+        if database.exists(f"users.server:{{{ctx.guild.id}}}"):
             users = map(
                 lambda x: x.decode("utf-8"),
-                database.zrange(f"users.server:{ctx.guild.id}", 0, -1),
+                database.zrange(f"users.server:{{{ctx.guild.id}}}", 0, -1),
             )
-            database.sadd(f"users.server.id:{ctx.guild.id}", *users)
-            database.delete(f"users.server:{ctx.guild.id}")
-        database.sadd(f"users.server.id:{ctx.guild.id}", str(ctx.author.id))
+            pipe = database.pipeline(transaction=False)
+            pipe.sadd(f"users.server.id:{{{ctx.guild.id}}}", *users)
+            pipe.delete(f"users.server:{{{ctx.guild.id}}}")
+            mark_dirty(
+                f"users.server.id:{{{ctx.guild.id}}}",
+                f"users.server:{{{ctx.guild.id}}}",
+                pipe=pipe,
+            )
+            pipe.execute()
+        # only marked when the user is new to the server, like channels
+        if database.sadd(f"users.server.id:{{{ctx.guild.id}}}", str(ctx.author.id)):
+            mark_dirty(f"users.server.id:{{{ctx.guild.id}}}")
         logger.info("synced user to server")
 
-        if not database.exists(f"custom.list:{ctx.author.id}"):
+        if not database.exists(f"custom.list:{{{ctx.author.id}}}"):
             role_ids = [role.id for role in ctx.author.roles]
             role_names = [role.name.lower() for role in ctx.author.roles]
             if set(role_names).intersection(set(states["CUSTOM"]["aliases"])):
@@ -100,80 +191,6 @@ async def user_setup(ctx):
                 logger.info("synced roles")
 
 
-def bird_setup(ctx, bird: str):
-    """Sets up a new bird for incorrect tracking.
-
-    `ctx` - Discord context object or user id\n
-    `bird` - bird to setup
-    """
-    if isinstance(ctx, (str, int)):
-        user_id = ctx
-        guild = None
-    else:
-        user_id = ctx.author.id
-        guild = ctx.guild
-
-    logger.info("checking bird data")
-    if database.zscore("incorrect:global", string.capwords(bird)) is not None:
-        logger.info("bird global ok")
-    else:
-        database.zadd("incorrect:global", {string.capwords(bird): 0})
-        logger.info("bird global added")
-
-    if database.zscore(f"incorrect.user:{user_id}", string.capwords(bird)) is not None:
-        logger.info("incorrect bird user ok")
-    else:
-        database.zadd(f"incorrect.user:{user_id}", {string.capwords(bird): 0})
-        logger.info("incorrect bird user added")
-
-    if database.zscore(f"correct.user:{user_id}", string.capwords(bird)) is not None:
-        logger.info("correct bird user ok")
-    else:
-        database.zadd(f"correct.user:{user_id}", {string.capwords(bird): 0})
-        logger.info("correct bird user added")
-
-    date = str(datetime.datetime.now(datetime.timezone.utc).date())
-    if database.zscore(f"daily.incorrect:{date}", string.capwords(bird)) is not None:
-        logger.info("bird daily ok")
-    else:
-        database.zadd(f"daily.incorrect:{date}", {string.capwords(bird): 0})
-        logger.info("bird daily added")
-
-    if database.zscore("frequency.bird:global", string.capwords(bird)) is not None:
-        logger.info("bird freq global ok")
-    else:
-        database.zadd("frequency.bird:global", {string.capwords(bird): 0})
-        logger.info("bird freq global added")
-
-    if guild is not None:
-        logger.info("no dm")
-        if (
-            database.zscore(f"incorrect.server:{ctx.guild.id}", string.capwords(bird))
-            is not None
-        ):
-            logger.info("bird server ok")
-        else:
-            database.zadd(
-                f"incorrect.server:{ctx.guild.id}", {string.capwords(bird): 0}
-            )
-            logger.info("bird server added")
-    else:
-        logger.info("dm context")
-
-    if database.exists(f"session.data:{user_id}"):
-        logger.info("session in session")
-        if (
-            database.zscore(f"session.incorrect:{user_id}", string.capwords(bird))
-            is not None
-        ):
-            logger.info("bird session ok")
-        else:
-            database.zadd(f"session.incorrect:{user_id}", {string.capwords(bird): 0})
-            logger.info("bird session added")
-    else:
-        logger.info("no session")
-
-
 def session_increment(ctx, item: str, amount: int):
     """Increments the value of a database hash field by `amount`.
 
@@ -187,12 +204,12 @@ def session_increment(ctx, item: str, amount: int):
     else:
         user_id = ctx.author.id
 
-    if database.exists(f"session.data:{user_id}"):
+    if database.exists(f"session.data:{{{user_id}}}"):
         logger.info("session active")
         logger.info(f"incrementing {item} by {amount}")
-        value = int(database.hget(f"session.data:{user_id}", item))
+        value = int(database.hget(f"session.data:{{{user_id}}}", item))
         value += int(amount)
-        database.hset(f"session.data:{user_id}", item, str(value))
+        database.hset(f"session.data:{{{user_id}}}", item, str(value))
     else:
         logger.info("session not active")
 
@@ -212,21 +229,24 @@ def incorrect_increment(ctx, bird: str, amount: int):
         guild = ctx.guild
 
     logger.info(f"incrementing incorrect {bird} by {amount}")
-    date = str(datetime.datetime.now(datetime.timezone.utc).date())
-    database.zincrby("incorrect:global", amount, string.capwords(str(bird)))
-    database.zincrby(f"incorrect.user:{user_id}", amount, string.capwords(str(bird)))
-    database.zincrby(f"daily.incorrect:{date}", amount, string.capwords(str(bird)))
+    pipe = database.pipeline(transaction=False)
+    pipe.zincrby("incorrect:global", amount, string.capwords(str(bird)))
+    pipe.zincrby(f"incorrect.user:{{{user_id}}}", amount, string.capwords(str(bird)))
+    mark_dirty("incorrect:global", f"incorrect.user:{{{user_id}}}", pipe=pipe)
     if guild is not None:
         logger.info("no dm")
-        database.zincrby(
-            f"incorrect.server:{ctx.guild.id}", amount, string.capwords(str(bird))
+        pipe.zincrby(
+            f"incorrect.server:{{{ctx.guild.id}}}", amount, string.capwords(str(bird))
         )
+        mark_dirty(f"incorrect.server:{{{ctx.guild.id}}}", pipe=pipe)
     else:
         logger.info("dm context")
-    if database.exists(f"session.data:{user_id}"):
+    pipe.execute()
+    daily_increment("incorrect", string.capwords(str(bird)), amount)
+    if database.exists(f"session.data:{{{user_id}}}"):
         logger.info("session in session")
         database.zincrby(
-            f"session.incorrect:{user_id}", amount, string.capwords(str(bird))
+            f"session.incorrect:{{{user_id}}}", amount, string.capwords(str(bird))
         )
     else:
         logger.info("no session")
@@ -248,13 +268,16 @@ def score_increment(ctx, amount: int):
         channel_id = str(ctx.channel.id)
 
     logger.info(f"incrementing score by {amount}")
-    date = str(datetime.datetime.now(datetime.timezone.utc).date())
-    database.zincrby("score:global", amount, channel_id)
-    database.zincrby("users:global", amount, user_id)
-    database.zincrby(f"daily.score:{date}", amount, user_id)
-    if guild is not None and database.exists(f"race.data:{ctx.channel.id}"):
+    pipe = database.pipeline(transaction=False)
+    pipe.zincrby("score:global", amount, channel_id)
+    pipe.zincrby("users:global", amount, user_id)
+    mark_dirty("score:global", "users:global", pipe=pipe)
+    pipe.execute()
+    daily_increment("score", user_id, amount)
+    race = get_race(ctx.channel.id) if guild is not None else None
+    if race is not None:
         logger.info("race in session")
-        database.zincrby(f"race.scores:{ctx.channel.id}", amount, user_id)
+        race.add_score(user_id, amount)
     else:
         logger.info("dm context")
 
@@ -271,15 +294,18 @@ def streak_increment(ctx, amount: int):
     else:
         user_id = str(ctx.author.id)
 
+    pipe = database.pipeline(transaction=False)
     if amount is not None:
         # increment streak and update max
-        database.zincrby("streak:global", amount, user_id)
-        if database.zscore("streak:global", user_id) > database.zscore(
-            "streak.max:global", user_id
-        ):
-            database.zadd(
-                "streak.max:global",
-                {user_id: database.zscore("streak:global", user_id)},
-            )
+        pipe.zincrby("streak:global", amount, user_id)
+        pipe.zscore("streak.max:global", user_id)
+        mark_dirty("streak:global", pipe=pipe)
+        streak, max_streak, _ = pipe.execute()
+        if max_streak is None or streak > max_streak:
+            pipe.zadd("streak.max:global", {user_id: streak})
+            mark_dirty("streak.max:global", pipe=pipe)
+            pipe.execute()
     else:
-        database.zadd("streak:global", {user_id: 0})
+        pipe.zadd("streak:global", {user_id: 0})
+        mark_dirty("streak:global", pipe=pipe)
+        pipe.execute()
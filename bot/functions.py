@@ -19,136 +19,35 @@ import base64
 import concurrent.futures
 import difflib
 import errno
-import functools
-import hashlib
-import itertools
 import os
-import pickle
 import random
-from typing import List, Union
+import time
+from typing import Dict, List, Optional, Set, Tuple, Union
 
 import aiohttp
 import chardet
 import discord
 import redis
-import wikipedia
-from Crypto.Cipher import ChaCha20
 from discord.ext import commands
 from sentry_sdk import capture_exception
 
+from bot.bird_index import current_index, custom_list
+from bot.cache import cache, load_caches
+from bot.cooldowns import TokenLeases, bucket_key, is_shared
 from bot.data import (
     GenericError,
-    birdList,
     birdListMaster,
     database,
     logger,
+    read_database,
     sciListMaster,
-    songBirds,
-    states,
-    taxons,
 )
-from bot.data_functions import channel_setup
+from bot.data_functions import channel_setup, mark_dirty, user_display_setup
 from bot.filters import MediaType
+from bot.lazy import lazy_import
 
-
-def cache(pre=None, local=True):
-    """Cache decorator based on functools.lru_cache.
-
-    This is not a very good cache, but it "works" for our
-    purposes.
-
-    This (optionally) caches items into a Redis database
-    (bot.data.database). It does not have a max_size but sets
-    key expiration to 90 days. Items are pickled before storing
-    into the database.
-
-    Cache keys are based on a sha1 hash. Currently, only strings
-    and integers are supported and it will not tell the difference
-    between a string and an integer with the same value.
-
-    If multiple functions with the same name are used, colisions
-    will occur.
-
-    In addition, results are only cached by the first positional
-    argument. If pre is provided, the cache key will be the
-    first positional argument transformed by pre.
-    """
-
-    def wrapper(func):
-        _cache = {}
-        sentinel = object()
-        hits = misses = 0
-
-        def _cache_store(key, value):
-            if local:
-                _cache[key] = value
-                return
-            pickled = pickle.dumps(value, protocol=4)
-            database.set(
-                f"cache.{func.__name__}:{key}", pickled, ex=7776000
-            )  # 60*60*24*90
-
-        def _cache_get(key, default=None):
-            if local:
-                return _cache.get(key, default)
-            data = database.get(f"cache.{func.__name__}:{key}")
-            if data is None:
-                return default
-            return pickle.loads(data)
-
-        def _cache_len():
-            if local:
-                return _cache.__len__()
-            return sum(
-                1
-                for _ in database.scan_iter(
-                    match=f"cache.{func.__name__}:*", count=1000
-                )
-            )
-
-        def _get_hash(item):
-            if local:
-                return hash(item)
-            if not isinstance(item, (str, int)):
-                raise TypeError(
-                    "cache is only available with strings or ints in non-local mode!"
-                )
-            return hashlib.sha1(str(item).encode()).hexdigest()
-
-        def evict():
-            """Evicts a random item from the local cache."""
-            if not local:
-                raise ValueError("Cannot evict from Redis cache!")
-            _cache.pop(random.choice((*_cache, object())), 0)
-
-        @functools.wraps(func)
-        async def wrapped(*args, **kwds):
-            # Simple caching without ordering or size limit
-            nonlocal hits, misses
-            if pre:
-                key = _get_hash(pre(args[0]))
-            else:
-                key = _get_hash(args[0])
-            result = _cache_get(key, sentinel)
-            if result is not sentinel:
-                # print("hit")
-                hits += 1
-                return result
-            # print("miss")
-            misses += 1
-            result = await func(*args, **kwds)
-            _cache_store(key, result)
-            return result
-
-        def cache_info():
-            """Report cache statistics"""
-            return functools._CacheInfo(hits, misses, None, _cache_len())
-
-        wrapped.cache_info = cache_info
-        wrapped.evict = evict
-        return wrapped
-
-    return wrapper
+wikipedia = lazy_import("wikipedia")
+ChaCha20 = lazy_import("Crypto.Cipher.ChaCha20")
 
 
 def check_state_role(ctx) -> list:
@@ -160,12 +59,8 @@ def check_state_role(ctx) -> list:
     user_states = []
     if ctx.guild is not None:
         logger.info("server context")
-        user_role_names = [role.name.lower() for role in ctx.author.roles]
-        user_states = list(
-            filter(
-                lambda x: set(user_role_names).intersection(set(states[x]["aliases"])),
-                states.keys(),
-            )
+        user_states = current_index().states_for_roles(
+            role.name.lower() for role in ctx.author.roles
         )
     else:
         logger.info("dm context")
@@ -173,33 +68,184 @@ def check_state_role(ctx) -> list:
     return user_states
 
 
-async def fetch_get_user(user_id: int, ctx=None, bot=None, member: bool = False):
-    if (ctx is None and bot is None) or (ctx is not None and bot is not None):
-        raise ValueError("Only one of ctx or bot must be passed")
-    if ctx:
-        bot = ctx.bot
-    elif member:
-        raise ValueError("ctx must be passed for member lookup")
-    if not member:
-        return await _fetch_cached_user(user_id, bot)
-    if bot.intents.members:
-        return ctx.guild.get_member(user_id)
-    try:
-        return await ctx.guild.fetch_member(user_id)
-    except discord.HTTPException:
-        return None
+# users fetched by get_all_users within this many seconds are skipped
+USER_SYNC_INTERVAL = 60 * 60 * 24
+
+
+async def fetch_user_names(user_ids, bot) -> Dict[int, Optional[str]]:
+    """Returns "name#discriminator" for each user id, or None if the user was deleted.
+
+    Names come from the `user.display` hashes in one pipeline. Only
+    users without a hash are fetched from Discord, and recorded. Users
+    that Discord can't return right now are left out.
+
+    `user_ids` (list) - user ids as ints or strings\n
+    `bot` - Discord bot object
+    """
+    return (await _fetch_user_names(user_ids, bot, None))[0]
+
+
+async def fetch_leaderboard_names(
+    user_ids, bot, guild_id: Optional[int]
+) -> Tuple[Dict[int, Optional[str]], Set[int]]:
+    """Returns the names like `fetch_user_names`, and the users in a guild.
+
+    Whether the users are in `users.server.id:{guild_id}` is checked in
+    the same pipeline as the names, so leaderboards can mention them.
+
+    `user_ids` (list) - user ids as ints or strings\n
+    `bot` - Discord bot object\n
+    `guild_id` (int) - guild to check, None for no guild
+    """
+    return await _fetch_user_names(user_ids, bot, guild_id)
+
+
+async def _fetch_user_names(user_ids, bot, guild_id: Optional[int]):
+    user_ids = [int(user_id) for user_id in user_ids]
+    pipe = read_database().pipeline(transaction=False)
+    for user_id in user_ids:
+        pipe.hmget(f"user.display:{{{user_id}}}", "name", "discriminator")
+    if guild_id is not None:
+        for user_id in user_ids:
+            pipe.sismember(f"users.server.id:{{{guild_id}}}", str(user_id))
+    results = pipe.execute()
+    names = {}
+    missing = []
+    for user_id, (name, discriminator) in zip(user_ids, results):
+        if name is None:
+            missing.append(user_id)
+        else:
+            names[user_id] = f"{name.decode('utf-8')}#{discriminator.decode('utf-8')}"
+    members = {
+        user_id for user_id, member in zip(user_ids, results[len(user_ids) :]) if member
+    }
+    for user_id, user in (await UserResolver(bot).resolve(missing)).items():
+        if user is None:
+            names[user_id] = None
+            continue
+        user_display_setup(user)
+        names[user_id] = f"{user.name}#{user.discriminator}"
+    return names, members
+
+
+class UserUnavailable(Exception):
+    """Raised when a user can't be fetched, but may not be deleted."""
+
+
+class UserResolver:
+    """Fetches many users from Discord concurrently.
+
+    Requests are limited to `concurrency` at once and started at most
+    `rate` times a second, which keeps a large batch under the global
+    rate limit. discord.py waits on the per-route buckets itself, and
+    a request that still gets a 429 is retried after Retry-After.
+
+    `bot` - Discord bot object\n
+    `concurrency` (int) - max number of requests in flight\n
+    `rate` (float) - max requests started per second
+    """
+
+    def __init__(self, bot, concurrency: int = 10, rate: float = 40.0):
+        self.bot = bot
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._interval = 1 / rate
+        self._next = 0.0
+
+    async def _pace(self):
+        now = time.monotonic()
+        wait = self._next - now
+        self._next = max(now, self._next) + self._interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def fetch(self, user_id: int, retries: int = 3):
+        """Returns a user, or None if the user is deleted.
+
+        Raises UserUnavailable if the user can't be fetched right now.
+        """
+        user = _fetch_cached_user.cache.get(user_id, _fetch_cached_user)
+        if user is not _fetch_cached_user:
+            return user
+        async with self._semaphore:
+            for _ in range(retries):
+                if not self.bot.intents.members:
+                    await self._pace()
+                try:
+                    return await _fetch_cached_user(user_id, self.bot)
+                except discord.HTTPException as e:
+                    if e.status != 429:
+                        raise UserUnavailable(user_id) from e
+                    retry_after = float(e.response.headers.get("Retry-After", 1))
+                    logger.info(f"rate limited, retrying in {retry_after}s")
+                    await asyncio.sleep(retry_after)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    raise UserUnavailable(user_id) from e
+        raise UserUnavailable(user_id)
+
+    async def _try_fetch(self, user_id: int):
+        try:
+            return await self.fetch(user_id)
+        except UserUnavailable as e:
+            logger.info(f"unable to fetch user {user_id}: {e.__cause__!r}")
+            return e
+
+    async def resolve(self, user_ids) -> dict:
+        """Returns a dict of user id to user (or None if deleted).
+
+        Users that can't be fetched right now are left out.
+
+        `user_ids` (list) - user ids as ints or strings
+        """
+        user_ids = list(dict.fromkeys(map(int, user_ids)))
+        users = await asyncio.gather(
+            *(self._try_fetch(user_id) for user_id in user_ids)
+        )
+        return {
+            user_id: user
+            for user_id, user in zip(user_ids, users)
+            if not isinstance(user, UserUnavailable)
+        }
 
 
-@cache()
+@cache(key=lambda user_id, bot: user_id, maxsize=20000, ttl=60 * 60 * 3, persist=True)
 async def _fetch_cached_user(user_id: int, bot):
     if bot.intents.members:
         return bot.get_user(user_id)
     try:
         return await bot.fetch_user(user_id)
-    except discord.HTTPException:
+    except discord.NotFound:
         return None
 
 
+def _user_payload(user: Optional[discord.User]) -> Optional[dict]:
+    """Converts a cached user to the data Discord sends, for saving."""
+    if user is None:
+        return None
+    return {
+        "id": user.id,
+        "username": user.name,
+        "discriminator": user.discriminator,
+        "global_name": user.global_name,
+        "avatar": user.avatar.key if user.avatar else None,
+        "bot": user.bot,
+    }
+
+
+_fetch_cached_user.cache.encode = _user_payload
+
+
+def restore_caches(bot) -> int:
+    """Restores the caches saved on the last shutdown.
+
+    Saved users are also added to discord.py's user cache.
+    Returns the number of items restored.
+    """
+    _fetch_cached_user.cache.decode = lambda data: (
+        None if data is None else bot._connection.store_user(data)
+    )
+    return load_caches()
+
+
 async def send_leaderboard(
     ctx, title, page, database_key=None, data=None, items_per_page=10
 ):
@@ -213,8 +259,9 @@ async def send_leaderboard(
     if page < 1:
         page = 1
 
+    reader = read_database()
     entry_count = (
-        int(database.zcard(database_key)) if database_key is not None else data.count()
+        int(reader.zcard(database_key)) if database_key is not None else data.count()
     )
     page = (page * 10) - 10
 
@@ -229,7 +276,7 @@ async def send_leaderboard(
     leaderboard_list = (
         map(
             lambda x: (x[0].decode("utf-8"), x[1]),
-            database.zrevrangebyscore(
+            reader.zrevrangebyscore(
                 database_key, "+inf", "-inf", page, items_per_page, True
             ),
         )
@@ -254,9 +301,11 @@ def build_id_list(
     taxon: Union[list, str] = None,
     state: Union[list, str] = None,
     media_type: MediaType = MediaType.IMAGE,
-) -> list:
+) -> tuple:
     """Generates an ID list based on given arguments
 
+    Lists are looked up in the precomputed bird index.
+
     - `user_id`: User ID of custom list
     - `taxon`: taxon string/list
     - `state`: state string/list
@@ -269,50 +318,16 @@ def build_id_list(
         state = state.split(" ")
 
     state_roles: List[str] = state if isinstance(state, list) else []
-    if media_type is MediaType.SONG:
-        state_list = "songBirds"
-        default = songBirds
-    elif media_type is MediaType.IMAGE:
-        state_list = "birdList"
-        default = birdList
-    else:
+    if media_type not in (MediaType.IMAGE, MediaType.SONG):
         raise GenericError("Invalid media type", code=990)
 
-    custom_list = []
-    if (
-        user_id
-        and "CUSTOM" in state_roles
-        and database.exists(f"custom.list:{user_id}")
-        and not database.exists(f"custom.confirm:{user_id}")
-    ):
-        custom_list = [
-            bird.decode("utf-8") for bird in database.smembers(f"custom.list:{user_id}")
-        ]
-
-    birds = []
-    if taxon:
-        birds_in_taxon = set(
-            itertools.chain.from_iterable(taxons.get(o, []) for o in taxon)
-        )
-        if state_roles:
-            birds_in_state = set(
-                itertools.chain(
-                    *(states[state][state_list] for state in state_roles), custom_list
-                )
-            )
-            birds = list(birds_in_taxon.intersection(birds_in_state))
-        else:
-            birds = list(birds_in_taxon.intersection(set(default)))
-    elif state_roles:
-        birds = list(
-            set(
-                itertools.chain(
-                    *(states[state][state_list] for state in state_roles), custom_list
-                )
-            )
-        )
-    else:
-        birds = default
+    custom = None
+    if user_id and "CUSTOM" in state_roles:
+        custom = custom_list(user_id)
+
+    birds = current_index().lookup(
+        tuple(state_roles), tuple(taxon or ()), media_type, custom
+    )
     logger.info(f"number of birds: {len(birds)}")
     return birds
 
@@ -468,45 +483,63 @@ async def drone_attack(ctx):
     raise GenericError(code=666)
 
 
-def backup_all():
-    """Backs up the database to a file.
+async def get_all_users(bot, batch_size: int = 100, scope: str = "global"):
+    """Adds every user to the `users.server.id` set of their mutual guilds.
 
-    This function serializes all data in the REDIS database
-    into a file in the `backups` directory.
+    Users synced in the last USER_SYNC_INTERVAL seconds are skipped.
+    The last finished user id is saved after each batch, so a sync
+    that is interrupted resumes where it stopped.
 
-    This function is run with a task every 6 hours and sends the files
-    to a specified discord channel.
+    `bot` - Discord bot object\n
+    `batch_size` (int) - number of users to fetch between checkpoints\n
+    `scope` (str) - names the sync state, so processes with different
+        guilds sync separately
     """
-    logger.info("Starting Backup")
-    logger.info("Creating Dump")
-    keys = (key.decode("utf-8") for key in database.keys())
-    dump = ((database.dump(key), key) for key in keys)
-    logger.info("Finished Dump")
-    logger.info("Writing To File")
-    os.makedirs("bot_files/backups", exist_ok=True)
-    with open("bot_files/backups/dump.dump", "wb") as f:
-        with open("bot_files/backups/keys.txt", "w") as k:
-            for item, key in dump:
-                pickle.dump(item, f)
-                k.write(f"{key}\n")
-    logger.info("Backup Finished")
-
-
-async def get_all_users(bot):
     logger.info("Starting user cache")
-    user_ids = map(int, database.zrangebyscore("users:global", "-inf", "+inf"))
-    for user_id in user_ids:
-        user = await fetch_get_user(user_id, bot=bot, member=False)
-        if user:
+    checkpoint = int(database.get(f"users.sync.checkpoint:{scope}") or 0)
+    recent = set(
+        map(
+            int,
+            database.zrangebyscore(
+                f"users.synced:{scope}", time.time() - USER_SYNC_INTERVAL, "+inf"
+            ),
+        )
+    )
+    user_ids = sorted(
+        user_id
+        for user_id in map(int, database.zrangebyscore("users:global", "-inf", "+inf"))
+        if user_id > checkpoint and user_id not in recent
+    )
+    logger.info(f"syncing {len(user_ids)} users, {len(recent)} recently synced")
+    resolver = UserResolver(bot)
+    for i in range(0, len(user_ids), batch_size):
+        batch = user_ids[i : i + batch_size]
+        users = await resolver.resolve(batch)
+        guild_keys = []
+        pipe = database.pipeline(transaction=False)
+        for user_id, user in users.items():
+            if user is None:
+                continue
+            user_display_setup(user)
             for guild in user.mutual_guilds:
-                database.sadd(f"users.server.id:{guild.id}", str(user.id))
+                guild_keys.append(f"users.server.id:{{{guild.id}}}")
+                pipe.sadd(guild_keys[-1], str(user_id))
+        added = pipe.execute()
+        changed = {key for key, count in zip(guild_keys, added) if count}
+        if changed:
+            mark_dirty(*changed, pipe=pipe)
+        # users that couldn't be fetched are tried again next time
+        if users:
+            pipe.zadd(f"users.synced:{scope}", dict.fromkeys(users, time.time()))
+        pipe.set(f"users.sync.checkpoint:{scope}", batch[-1])
+        pipe.execute()
+    database.delete(f"users.sync.checkpoint:{scope}")
     logger.info("User cache finished")
 
 
 def prune_user_cache(count: int = 5):
-    """Evicts `count` items from the user cache."""
-    for _ in range(count):
-        _fetch_cached_user.evict()
+    """Evicts the `count` least recently used items from the user cache."""
+    _fetch_cached_user.evict(count)
 
 
 async def auto_decode(data: bytes):
@@ -560,8 +593,31 @@ def decrypt_chacha(encrypted: str) -> bytes:
     return cipher.decrypt(ciphertext)
 
 
+# seconds between checking if cooldowns are increased
+RATE_LIMIT_CHECK_INTERVAL = 5
+_rate_limit_status = {"checked": 0.0, "active": False}
+
+
+def rate_limited() -> bool:
+    """Returns if core command cooldowns are increased due to Macaulay issues.
+
+    The result is kept for RATE_LIMIT_CHECK_INTERVAL seconds, so
+    commands don't check the database every time.
+    """
+    now = time.monotonic()
+    if now - _rate_limit_status["checked"] >= RATE_LIMIT_CHECK_INTERVAL:
+        count = database.get("cooldown:global")
+        _rate_limit_status["active"] = count is not None and int(count) > 1
+        _rate_limit_status["checked"] = now
+    return _rate_limit_status["active"]
+
+
 class CustomCooldown:
-    """Halve cooldown times in DM channels."""
+    """Halve cooldown times in DM channels.
+
+    Buckets that can be used from several processes are shared through
+    the database when bot.cooldowns.SHARED_COOLDOWNS is set.
+    """
 
     # Code adapted from discord.py example
     def __init__(
@@ -593,6 +649,7 @@ class CustomCooldown:
         self.rate_limit_mapping = commands.CooldownMapping.from_cooldown(
             rate, rate_limit_per, bucket
         )
+        self.leases = TokenLeases()
 
     def __call__(self, ctx: commands.Context):
         if (
@@ -604,23 +661,39 @@ class CustomCooldown:
                 "check",
                 "skip",
             )
-            and database.exists("cooldown:global")
-            and int(database.get("cooldown:global")) > 1
+            and rate_limited()
         ):
-            bucket = self.rate_limit_mapping.get_bucket(ctx.message)
+            kind, mapping = "rate_limit", self.rate_limit_mapping
 
         elif not self.disable and ctx.guild is None:
-            bucket = self.dm_mapping.get_bucket(ctx.message)
+            kind, mapping = "dm", self.dm_mapping
 
         elif ctx.channel.name.startswith("racing") and ctx.command.name.startswith(
             "check"
         ):
-            bucket = self.race_mapping.get_bucket(ctx.message)
+            kind, mapping = "race", self.race_mapping
 
         else:
-            bucket = self.default_mapping.get_bucket(ctx.message)
+            kind, mapping = "default", self.default_mapping
 
-        retry_after = bucket.update_rate_limit()
+        bucket = mapping.get_bucket(ctx.message)
+        if not is_shared(mapping.type):
+            retry_after = bucket.update_rate_limit()
+        else:
+            # this process's uses are part of the shared bucket, so a
+            # cooldown here is a cooldown everywhere
+            retry_after = bucket.get_retry_after()
+            if not retry_after:
+                retry_after = self.leases.take(
+                    bucket_key(
+                        f"{ctx.command.qualified_name}.{kind}",
+                        mapping.type.get_key(ctx.message),
+                    ),
+                    bucket.rate,
+                    bucket.per,
+                )
+                if not retry_after:
+                    bucket.update_rate_limit()
         if retry_after:
             raise commands.CommandOnCooldown(self, retry_after, bucket)
         return True
@@ -738,7 +811,7 @@ async def handle_error(ctx, error):
     elif isinstance(error, commands.CommandInvokeError):
         if isinstance(error.original, redis.exceptions.ResponseError):
             capture_exception(error.original)
-            if database.exists(f"channel:{ctx.channel.id}"):
+            if database.exists(f"channel:{{{ctx.channel.id}}}"):
                 await ctx.send(
                     "**An unexpected ResponseError has occurred.**\n"
                     + "*Please log this message in #support in the support server below, or try again.*\n"
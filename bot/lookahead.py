@@ -0,0 +1,123 @@
+# lookahead.py | picks and downloads the next birds of races ahead of time
+# Copyright (C) 2019-2021  EraserBird, person_v1.32, hmmm
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import collections
+import functools
+import os
+import random
+from typing import Deque, Dict, Sequence, Tuple
+
+from bot.core import get_files, get_sciname
+from bot.data import GenericError, logger
+from bot.filters import Filter, MediaType
+
+# how many birds to pick ahead in races, 0 to disable
+RACE_LOOKAHEAD = int(os.getenv("SCIOLY_ID_BOT_RACE_LOOKAHEAD", "3"))
+
+
+async def _prefetch(bird: str, media_type: MediaType, filters: Filter):
+    """Downloads the media of a bird to the cache."""
+    try:
+        sciBird = await get_sciname(bird)
+    except GenericError:
+        sciBird = bird
+    await get_files(sciBird, media_type, filters)
+
+
+def _prefetch_done(bird: str, task: asyncio.Future):
+    """Logs a failed download, so it isn't reported as never retrieved."""
+    if not task.cancelled() and task.exception() is not None:
+        logger.info(f"prefetch failed for {bird}: {task.exception()}")
+
+
+class RaceLookahead:
+    """The next birds of a race, with their media downloading in the background.
+
+    `media_type` (MediaType) - media type of the race\n
+    `filters` (Filter) - filters of the race\n
+    `size` (int) - how many birds to keep ready
+    """
+
+    def __init__(self, media_type: MediaType, filters: Filter, size: int):
+        self.media_type = media_type
+        self.filters = filters
+        self.size = size
+        self.queue: Deque[Tuple[str, asyncio.Future]] = collections.deque()
+
+    def _fill(self, birds: Sequence[str], prev: str):
+        while len(self.queue) < self.size:
+            last = self.queue[-1][0] if self.queue else prev
+            bird = random.choice(birds)
+            while bird == last and len(birds) > 1:
+                bird = random.choice(birds)
+            logger.info(f"prefetching {bird}")
+            task = asyncio.ensure_future(_prefetch(bird, self.media_type, self.filters))
+            task.add_done_callback(functools.partial(_prefetch_done, bird))
+            self.queue.append((bird, task))
+
+    async def next(self, birds: Sequence[str], prev: str) -> str:
+        """Returns the next bird once its media is downloaded, and refills the queue.
+
+        `birds` (list) - birds the race can use\n
+        `prev` (str) - the previous bird, to avoid repeats
+        """
+        valid = set(birds)
+        while self.queue and self.queue[0][0] not in valid:
+            self.queue.popleft()[1].cancel()
+        self._fill(birds, prev)
+        bird, task = self.queue.popleft()
+        self._fill(birds, bird)
+        # usually done already, otherwise it's further along than a new download
+        try:
+            await task
+        except Exception:  # pylint: disable=broad-except
+            # logged by _prefetch_done, send_bird will try again and handle the error
+            pass
+        return bird
+
+    def cancel(self):
+        """Stops all downloads that haven't finished."""
+        for _, task in self.queue:
+            task.cancel()
+        self.queue.clear()
+
+
+_races: Dict[int, RaceLookahead] = {}
+
+
+def race_lookahead(
+    channel_id: int, media_type: MediaType, filters: Filter
+) -> RaceLookahead:
+    """Returns the lookahead of the race in a channel, creating it if needed."""
+    lookahead = _races.get(channel_id)
+    if (
+        lookahead is None
+        or lookahead.media_type is not media_type
+        or lookahead.filters.to_int() != filters.to_int()
+    ):
+        if lookahead is not None:
+            lookahead.cancel()
+        lookahead = RaceLookahead(media_type, filters, RACE_LOOKAHEAD)
+        _races[channel_id] = lookahead
+    return lookahead
+
+
+def clear_race_lookahead(channel_id: int):
+    """Stops prefetching for the race in a channel."""
+    lookahead = _races.pop(channel_id, None)
+    if lookahead is not None:
+        lookahead.cancel()
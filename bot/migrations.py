@@ -0,0 +1,241 @@
+# migrations.py | one-off database migrations
+# Copyright (C) 2019-2021  EraserBird, person_v1.32, hmmm
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Usage: python3 -m bot.migrations <migration name> [<migration name> ...]
+
+import sys
+import time
+
+import redis
+
+from bot.data import database, logger
+
+MIGRATIONS = {}
+
+# sorted sets that only store non-zero counts
+SPARSE_STATS_PATTERNS = (
+    "daily.score:????-??-??",
+    "daily.incorrect:????-??-??",
+    "incorrect.user:*",
+    "correct.user:*",
+    "incorrect.server:*",
+    "session.incorrect:*",
+)
+SPARSE_STATS_KEYS = ("incorrect:global",)
+
+# sorted sets with at most this many entries are stored as listpacks
+ZSET_LISTPACK_ENTRIES = 256
+
+
+def migration(func):
+    """Registers a function as a runnable migration."""
+    MIGRATIONS[func.__name__] = func
+    return func
+
+
+def _sparse_stats_keys():
+    yield from SPARSE_STATS_KEYS
+    for pattern in SPARSE_STATS_PATTERNS:
+        yield from database.scan_iter(match=pattern, count=5000)
+
+
+@migration
+def compact_stats(batch_size: int = 500):
+    """Removes zero-count entries from the statistic sorted sets.
+
+    Older versions added every user and bird to the stat keys
+    with a score of 0 before anything was recorded. Missing entries
+    are now read as 0, so those placeholders only take up memory.
+
+    Sorted sets that fit under the listpack limits after pruning are
+    rewritten in place so Redis stores them with the compact encoding.
+
+    `batch_size` (int) - number of keys to process per pipeline
+    """
+    limit = ZSET_LISTPACK_ENTRIES
+    for option in ("zset-max-listpack-entries", "zset-max-ziplist-entries"):
+        # the option was renamed to listpack in Redis 7
+        try:
+            database.config_set(option, limit)
+            logger.info(f"{option} set to {limit}")
+            break
+        except redis.exceptions.ResponseError as e:
+            logger.info(f"unable to set {option}: {e}")
+    else:
+        current = database.config_get("zset-max-*-entries")
+        limit = int(next(iter(current.values()), 0))
+
+    keys = []
+    removed = 0
+    encoded = 0
+    total = 0
+
+    def flush():
+        nonlocal removed, encoded, total
+        with database.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.zremrangebyscore(key, 0, 0)
+                pipe.zcard(key)
+                pipe.object("encoding", key)
+            results = pipe.execute()
+        with database.pipeline(transaction=False) as pipe:
+            for key, pruned, size, encoding in zip(
+                keys, results[::3], results[1::3], results[2::3]
+            ):
+                removed += pruned
+                if encoding == b"skiplist" and 0 < size <= limit:
+                    # ZUNIONSTORE builds a new sorted set, which is
+                    # converted to a listpack when it is small enough
+                    pipe.zunionstore(key, [key])
+                    encoded += 1
+            pipe.execute()
+        total += len(keys)
+        keys.clear()
+
+    for key in _sparse_stats_keys():
+        keys.append(key)
+        if len(keys) >= batch_size:
+            flush()
+    if keys:
+        flush()
+
+    logger.info(
+        f"compact_stats: {total} keys, {removed} zero entries removed, {encoded} keys re-encoded"
+    )
+
+
+@migration
+def index_keys(batch_size: int = 500):
+    """Builds the key indexes used in place of keyspace scans.
+
+    Adds every existing daily stat date to `daily.dates:{family}`,
+    every Redis cache entry to `cache.index:{function}`,
+    scored by its expiration time, and every active race to
+    `races:global`.
+
+    `batch_size` (int) - number of keys to process per pipeline
+    """
+    for family in ("score", "incorrect", "web", "webscore"):
+        dates = [
+            key.decode("utf-8").split(":")[1]
+            for key in database.scan_iter(
+                match=f"daily.{family}:????-??-??", count=5000
+            )
+        ]
+        if dates:
+            database.sadd(f"daily.dates:{family}", *dates)
+        logger.info(f"index_keys: {len(dates)} dates indexed for daily.{family}")
+
+    keys = [
+        key
+        for key in database.scan_iter(match="cache.*:*", count=5000)
+        if not key.startswith(b"cache.index:")
+    ]
+    for i in range(0, len(keys), batch_size):
+        batch = keys[i : i + batch_size]
+        with database.pipeline(transaction=False) as pipe:
+            for key in batch:
+                pipe.pttl(key)
+            ttls = pipe.execute()
+        now = time.time()
+        with database.pipeline(transaction=False) as pipe:
+            for key, ttl in zip(batch, ttls):
+                if ttl == -2:  # expired since the scan
+                    continue
+                name, item = key.decode("utf-8").split(":", 1)
+                expire = now + ttl / 1000 if ttl >= 0 else float("inf")
+                pipe.zadd(f"cache.index:{name[len('cache.'):]}", {item: expire})
+            pipe.execute()
+    logger.info(f"index_keys: {len(keys)} cache keys indexed")
+
+    channel_ids = [
+        key.decode("utf-8").split(":", 1)[1].strip("{}")
+        for key in database.scan_iter(match="race.data:*", count=5000)
+    ]
+    if channel_ids:
+        database.sadd("races:global", *channel_ids)
+    logger.info(f"index_keys: {len(channel_ids)} races indexed")
+
+
+# key prefixes that get the id in a hash tag
+HASH_TAG_PREFIXES = (
+    "channel",
+    "race.data",
+    "race.scores",
+    "session.data",
+    "session.incorrect",
+    "incorrect.user",
+    "correct.user",
+    "custom.list",
+    "custom.confirm",
+    "custom.cooldown",
+    "web.user",
+    "incorrect.server",
+    "users.server",
+    "users.server.id",
+    "channels",
+    "voice.server",
+    "leave",
+)
+
+
+@migration
+def hash_tag_keys(batch_size: int = 500):
+    """Renames per user, channel, and guild keys to use hash tags.
+
+    `incorrect.user:1234` becomes `incorrect.user:{1234}` so all the
+    keys for one id are in the same Redis Cluster slot. RENAME can't
+    move keys between slots, so run this on a single Redis instance
+    before migrating to a cluster. Keys that already exist under the
+    new name are left alone.
+
+    The next backup after this will be a full backup.
+
+    `batch_size` (int) - number of keys to process per pipeline
+    """
+    for prefix in HASH_TAG_PREFIXES:
+        keys = [
+            key.decode("utf-8")
+            for key in database.scan_iter(match=f"{prefix}:*", count=5000)
+            if b"{" not in key
+        ]
+        renamed = 0
+        for i in range(0, len(keys), batch_size):
+            with database.pipeline(transaction=False) as pipe:
+                for key in keys[i : i + batch_size]:
+                    item = key[len(prefix) + 1 :]
+                    pipe.renamenx(key, f"{prefix}:{{{item}}}")
+                renamed += sum(map(bool, pipe.execute(raise_on_error=False)))
+        logger.info(f"hash_tag_keys: {renamed}/{len(keys)} {prefix} keys renamed")
+
+    # the dirty sets refer to the old key names
+    database.delete(
+        "backup.dirty:global", "backup.dirty.processing:global", "backup.meta:global"
+    )
+
+
+def main(args):
+    if not args or any(name not in MIGRATIONS for name in args):
+        print(f"Usage: python3 -m bot.migrations {{{','.join(MIGRATIONS)}}} ...")
+        return 1
+    for name in args:
+        logger.info(f"running migration: {name}")
+        MIGRATIONS[name]()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,135 @@
+# outbox.py | combines messages to the same channel
+# Copyright (C) 2019-2021  EraserBird, person_v1.32, hmmm
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from io import BytesIO
+from typing import Iterable, List, Optional, Tuple
+
+import discord
+
+from bot.data import logger
+
+# Discord max message length is 2000 characters, leave some room just in case
+MAX_MESSAGE = 1900
+
+
+def _split_lines(lines: Iterable[str], max_size: int) -> List[List[str]]:
+    """Groups lines so each group joined with newlines fits in `max_size`."""
+    groups: List[List[str]] = []
+    group: List[str] = []
+    length = 0
+    for line in lines:
+        # add 1 to account for the newline
+        if group and length + len(line) + 1 > max_size:
+            groups.append(group)
+            group = []
+            length = 0
+        group.append(line)
+        length += len(line) + 1
+    if group:
+        groups.append(group)
+    return groups
+
+
+class Outbox:
+    """Collects the messages a command sends to one destination.
+
+    Nothing is sent until `flush`, which packs the text into as few
+    messages as fit in MAX_MESSAGE and attaches any files to the last
+    one. If the text would take more than `max_pages` messages, it is
+    sent as a text file instead.
+
+    `destination` - where to send, like a context, channel, or user\n
+    `max_pages` (int) - max messages before using a file, None for no limit\n
+    `filename` (str) - name of the text file\n
+    `summary` (str) - message sent with the text file
+    """
+
+    def __init__(
+        self,
+        destination,
+        max_pages: Optional[int] = None,
+        filename: str = "list.txt",
+        summary: str = "**This is too long for Discord, so here it is as a file.**",
+    ):
+        self.destination = destination
+        self.max_pages = max_pages
+        self.filename = filename
+        self.summary = summary
+        # (text as sent, text for the file)
+        self._parts: List[Tuple[str, str]] = []
+        self._files: List[discord.File] = []
+
+    def add(self, content: str):
+        """Adds text, sent on its own line."""
+        if len(content) > MAX_MESSAGE:
+            for lines in _split_lines(content.split("\n"), MAX_MESSAGE):
+                text = "\n".join(lines)
+                self._parts.append((text, text))
+        else:
+            self._parts.append((content, content))
+
+    def add_block(self, lines: Iterable[str], fence: str = "```"):
+        """Adds lines in code blocks, split to fit in messages.
+
+        `lines` (list) - lines of the block\n
+        `fence` (str) - string around each block
+        """
+        room = MAX_MESSAGE - 2 * len(fence) - 1
+        for group in _split_lines(lines, room):
+            text = "\n".join(group)
+            self._parts.append((f"{fence}\n{text}{fence}", text))
+
+    def add_file(self, file: discord.File):
+        """Adds a file, attached to the last message."""
+        self._files.append(file)
+
+    def pages(self) -> List[str]:
+        """Returns the text as it would be split into messages."""
+        pages: List[str] = []
+        for text, _ in self._parts:
+            if pages and len(pages[-1]) + len(text) + 1 <= MAX_MESSAGE:
+                pages[-1] += f"\n{text}"
+            else:
+                pages.append(text)
+        return pages
+
+    async def flush(self) -> List[discord.Message]:
+        """Sends everything that was added and empties the outbox."""
+        pages = self.pages()
+        files = list(self._files)
+        if self.max_pages is not None and len(pages) > self.max_pages:
+            text = "\n".join(plain for _, plain in self._parts)
+            files.insert(
+                0, discord.File(BytesIO(text.encode("utf-8")), filename=self.filename)
+            )
+            pages = [self.summary]
+        if not pages and files:
+            pages = [None]
+        self._parts.clear()
+        self._files.clear()
+
+        sent = []
+        for i, page in enumerate(pages):
+            last = i == len(pages) - 1
+            if last and len(files) > 1:
+                sent.append(await self.destination.send(page, files=files))
+            elif last and files:
+                sent.append(await self.destination.send(page, file=files[0]))
+            else:
+                sent.append(await self.destination.send(page))
+        if sent:
+            logger.info(f"outbox: sent {len(sent)} messages")
+        return sent
@@ -0,0 +1,271 @@
+# races.py | in-memory state of active races
+# Copyright (C) 2019-2021  EraserBird, person_v1.32, hmmm
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import contextvars
+import time
+from typing import Dict, List, Optional, Tuple
+
+from bot.data import database, logger
+from bot.filters import Filter
+
+# the race whose event is running in the current task
+_current_event: contextvars.ContextVar[Optional["Race"]] = contextvars.ContextVar(
+    "race_event", default=None
+)
+
+
+class Race:
+    """An active race in a channel.
+
+    The race is kept in memory, and every change is also written to
+    `race.data:{channel_id}` and `race.scores:{channel_id}` so races can
+    be recovered after a restart. Reads never go to Redis.
+
+    Events that change the race, like answers and skips, are queued and
+    run one at a time with `run`, so two answers at once can't both be
+    counted.
+
+    `channel_id` (int) - channel of the race\n
+    `data` (dict) - fields of race.data\n
+    `scores` (dict) - user id to number of correct answers
+    """
+
+    def __init__(self, channel_id: int, data: dict, scores: Dict[str, int]):
+        self.channel_id = channel_id
+        self.start = int(data["start"])
+        self.stop = int(data.get("stop", 0))
+        self.limit = int(data["limit"])
+        self.filter_int = int(data["filter"])
+        self.state: str = data["state"]
+        self.media: str = data["media"]
+        self.taxon: str = data["taxon"]
+        self.strict = bool(data["strict"])
+        self.alpha = bool(data["alpha"])
+        self.scores = scores
+        self._events: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Future] = None
+        self._closed = False
+
+    @property
+    def filters(self) -> Filter:
+        return Filter.from_int(self.filter_int)
+
+    @classmethod
+    def from_database(cls, channel_id: int) -> Optional["Race"]:
+        """Loads a race from Redis, returning None if there isn't one."""
+        pipe = database.pipeline(transaction=False)
+        cls._queue_load(pipe, channel_id)
+        return cls._from_results(channel_id, *pipe.execute())
+
+    @staticmethod
+    def _queue_load(pipe, channel_id: int):
+        pipe.hgetall(f"race.data:{{{channel_id}}}")
+        pipe.zrange(f"race.scores:{{{channel_id}}}", 0, -1, withscores=True)
+
+    @classmethod
+    def _from_results(cls, channel_id: int, data, scores) -> Optional["Race"]:
+        if not data:
+            return None
+        data = {
+            key.decode("utf-8"): value.decode("utf-8") for key, value in data.items()
+        }
+        return cls(
+            channel_id,
+            data,
+            {user_id.decode("utf-8"): int(score) for user_id, score in scores},
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "start": self.start,
+            "stop": self.stop,
+            "limit": self.limit,
+            "filter": str(self.filter_int),
+            "state": self.state,
+            "media": self.media,
+            "taxon": self.taxon,
+            "strict": "strict" if self.strict else "",
+            "alpha": "alpha" if self.alpha else "",
+        }
+
+    def set_stop(self):
+        """Records when the race ended."""
+        self.stop = round(time.time())
+        database.hset(f"race.data:{{{self.channel_id}}}", "stop", self.stop)
+
+    def add_score(self, user_id: str, amount: int):
+        """Adds to a user's race score."""
+        self.scores[user_id] = self.scores.get(user_id, 0) + amount
+        database.zincrby(f"race.scores:{{{self.channel_id}}}", amount, user_id)
+
+    def leaderboard(self, count: Optional[int] = None) -> List[Tuple[str, int]]:
+        """Returns (user id, score) from highest to lowest, like ZREVRANGE."""
+        ranked = sorted(self.scores.items(), key=lambda item: (item[1], item[0]))
+        ranked.reverse()
+        return ranked[:count] if count is not None else ranked
+
+    def rank(self, user_id: str) -> Optional[int]:
+        """Returns the 0-based placement of a user, or None."""
+        if user_id not in self.scores:
+            return None
+        return [item[0] for item in self.leaderboard()].index(user_id)
+
+    async def run(self, func, *args):
+        """Runs the coroutine function `func` once earlier events are done.
+
+        Returns what `func` returns. Events that call `run` again for
+        the same race run right away instead of waiting on themselves,
+        as do events after the race ended.
+        """
+        if _current_event.get() is self or self._closed:
+            return await func(*args)
+        if self._worker is None:
+            self._events = asyncio.Queue()
+            self._worker = asyncio.ensure_future(self._work())
+        future = asyncio.get_running_loop().create_future()
+        # run the event with the caller's context variables
+        context = contextvars.copy_context()
+        self._events.put_nowait((context, func, args, future))
+        return await future
+
+    async def _work(self):
+        try:
+            while True:
+                event = await self._events.get()
+                if event is None:
+                    # finish the events that were already waiting
+                    self._closed = True
+                    if self._events.empty():
+                        return
+                    continue
+                context, func, args, future = event
+                if future.cancelled():
+                    continue
+                context.run(_current_event.set, self)
+                task = context.run(asyncio.ensure_future, func(*args))
+                try:
+                    # doesn't raise if the event is cancelled, so the queue goes on
+                    await asyncio.wait((task,))
+                except asyncio.CancelledError:
+                    task.cancel()
+                    future.cancel()
+                    raise
+                if future.done():
+                    continue
+                if task.cancelled():
+                    future.cancel()
+                elif task.exception() is not None:
+                    future.set_exception(task.exception())
+                else:
+                    future.set_result(task.result())
+        except asyncio.CancelledError:
+            # the worker was stopped, so the waiting events won't run
+            self._closed = True
+            while not self._events.empty():
+                event = self._events.get_nowait()
+                if event is not None:
+                    event[3].cancel()
+            raise
+
+    def close(self):
+        """Stops the event queue after the events already in it."""
+        if self._events is not None:
+            self._events.put_nowait(None)
+        else:
+            self._closed = True
+
+
+# channel ids of the races saved in Redis
+RACES_KEY = "races:global"
+
+_races: Dict[int, Race] = {}
+_loaded = False
+
+
+def load_races():
+    """Loads all races saved in Redis."""
+    global _loaded  # pylint: disable=global-statement
+    channel_ids = [int(channel_id) for channel_id in database.smembers(RACES_KEY)]
+    pipe = database.pipeline(transaction=False)
+    for channel_id in channel_ids:
+        Race._queue_load(pipe, channel_id)  # pylint: disable=protected-access
+    results = pipe.execute() if channel_ids else []
+    ended = []
+    for i, channel_id in enumerate(channel_ids):
+        # pylint: disable=protected-access
+        race = Race._from_results(channel_id, *results[2 * i : 2 * i + 2])
+        if race is None:
+            ended.append(channel_id)
+        else:
+            _races[channel_id] = race
+    if ended:
+        # the race ended before it was removed from the index
+        database.srem(RACES_KEY, *ended)
+    _loaded = True
+    logger.info(f"loaded {len(_races)} races")
+
+
+def get_race(channel_id) -> Optional[Race]:
+    """Returns the active race in a channel, or None."""
+    if not _loaded:
+        load_races()
+    return _races.get(int(channel_id))
+
+
+def race_channels():
+    """Returns the ids of channels with an active race.
+
+    Only looks at the races in memory, so it doesn't block the
+    message handlers. Races are loaded when the bot starts.
+    """
+    return _races.keys()
+
+
+def start_race(channel_id: int, data: dict, user_id: str) -> Race:
+    """Starts a race and saves it to Redis.
+
+    `channel_id` (int) - channel of the race\n
+    `data` (dict) - fields of race.data\n
+    `user_id` (str) - user who started the race
+    """
+    race = Race(channel_id, data, {user_id: 0})
+    pipe = database.pipeline(transaction=False)
+    pipe.hset(f"race.data:{{{channel_id}}}", mapping=race.to_dict())
+    pipe.zadd(f"race.scores:{{{channel_id}}}", {user_id: 0})
+    pipe.sadd(RACES_KEY, channel_id)
+    pipe.execute()
+    if not _loaded:
+        load_races()
+    _races[channel_id] = race
+    return race
+
+
+def end_race(channel_id: int):
+    """Removes a race from memory and Redis, and stops its prefetching."""
+    # bot.lookahead imports bot.core, which imports this module
+    from bot.lookahead import (  # pylint: disable=import-outside-toplevel
+        clear_race_lookahead,
+    )
+
+    race = _races.pop(int(channel_id), None)
+    if race is not None:
+        race.close()
+    clear_race_lookahead(int(channel_id))
+    pipe = database.pipeline(transaction=False)
+    pipe.delete(f"race.data:{{{channel_id}}}", f"race.scores:{{{channel_id}}}")
+    pipe.srem(RACES_KEY, channel_id)
+    pipe.execute()
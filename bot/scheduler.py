@@ -0,0 +1,327 @@
+# scheduler.py | runs background jobs once per cluster or in every process
+# Copyright (C) 2019-2021  EraserBird, person_v1.32, hmmm
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Cluster jobs (like backups) run in one process of all the bot processes
+# sharing the database. The processes elect a leader by taking a lock at
+# scheduler.leader:global, which the leader renews and other processes
+# take over if it expires. When a cluster job is due is based on the time
+# it last ran in any process, so a new leader doesn't run it again early.
+#
+# Local jobs (like evicting in-memory caches) run in every process.
+
+import asyncio
+import concurrent.futures
+import os
+import random
+import socket
+import sqlite3
+import time
+import uuid
+from typing import Callable, Dict, List, Optional
+
+import redis
+from sentry_sdk import capture_exception
+
+from bot.data import database, logger
+
+# threads shared by all jobs for blocking work
+JOB_WORKERS = int(os.getenv("SCIOLY_ID_BOT_JOB_WORKERS", "2"))
+# seconds until the leader lock expires if the leader stops renewing it
+LEADER_TIMEOUT = 30
+LEADER_KEY = "scheduler.leader:global"
+# errors from either database backend, retried on the next interval
+DATABASE_ERRORS = (redis.exceptions.RedisError, sqlite3.Error)
+
+executor = concurrent.futures.ThreadPoolExecutor(JOB_WORKERS, thread_name_prefix="job")
+
+
+async def run_blocking(func: Callable, *args):
+    """Runs a blocking function in the threads shared by jobs."""
+    return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+
+class Job:
+    """A coroutine function run every `interval` seconds.
+
+    `name` (str) - unique name of the job\n
+    `func` (coroutine function) - called with no arguments\n
+    `interval` (float) - seconds between runs\n
+    `cluster` (bool) - whether to run in one process instead of all\n
+    `jitter` (float) - fraction the interval varies by, so processes
+        started together don't all run jobs at once
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable,
+        interval: float,
+        cluster: bool = False,
+        jitter: float = 0.1,
+    ):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.cluster = cluster
+        self.jitter = jitter
+        self.next_interval = self.delay()
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.last_run: Optional[float] = None
+        self.last_duration: Optional[float] = None
+        self.total_duration = 0.0
+
+    def delay(self) -> float:
+        """Returns the interval with jitter."""
+        return self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def stats(self) -> dict:
+        return {
+            "cluster": self.cluster,
+            "running": self.running,
+            "runs": self.runs,
+            "failures": self.failures,
+            "skipped": self.skipped,
+            "last_run": self.last_run,
+            "last_duration": self.last_duration,
+            "mean_duration": self.total_duration / self.runs if self.runs else None,
+        }
+
+
+class Scheduler:
+    """Runs jobs in the background once started."""
+
+    def __init__(self):
+        self.jobs: Dict[str, Job] = {}
+        self.identity = f"{socket.gethostname()}:{os.getpid()}"
+        self.leader_lock = None
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._started = False
+
+    @property
+    def is_leader(self) -> bool:
+        return self.leader_lock is not None
+
+    def job(
+        self,
+        seconds: float = 0,
+        minutes: float = 0,
+        hours: float = 0,
+        cluster: bool = False,
+        jitter: float = 0.1,
+        name: Optional[str] = None,
+    ):
+        """Decorator that adds a coroutine function as a job.
+
+        The job is named after the function unless `name` is set.
+        """
+
+        def decorator(func):
+            interval = seconds + minutes * 60 + hours * 60 * 60
+            self.add(Job(name or func.__name__, func, interval, cluster, jitter))
+            return func
+
+        return decorator
+
+    def add(self, job: Job):
+        """Adds a job, replacing any job with the same name."""
+        self.remove(job.name)
+        self.jobs[job.name] = job
+        if self._started:
+            self._tasks[job.name] = asyncio.ensure_future(self._loop(job))
+
+    def remove(self, name: str):
+        """Stops and removes a job, if it exists."""
+        self.jobs.pop(name, None)
+        task = self._tasks.pop(name, None)
+        if task is not None:
+            task.cancel()
+
+    def start(self):
+        """Starts running the jobs. Does nothing if already started."""
+        if self._started:
+            return
+        self._started = True
+        logger.info(f"starting scheduler with {len(self.jobs)} jobs")
+        try:
+            self._elect()
+        except DATABASE_ERRORS as e:
+            # the election task tries again
+            logger.info(f"scheduler: election failed: {e}")
+        self._tasks["__election__"] = asyncio.ensure_future(self._election())
+        for job in self.jobs.values():
+            self._tasks[job.name] = asyncio.ensure_future(self._loop(job))
+
+    async def stop(self):
+        """Stops the jobs and gives up leadership."""
+        self._started = False
+        tasks = list(self._tasks.values())
+        self._tasks.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self.leader_lock is not None:
+            try:
+                self.leader_lock.release()
+            except redis.exceptions.LockError:
+                pass
+            self.leader_lock = None
+
+    def _elect(self) -> bool:
+        """Renews or tries to take the leader lock."""
+        if self.leader_lock is not None:
+            try:
+                self.leader_lock.reacquire()
+                return True
+            except redis.exceptions.LockError:
+                logger.info("scheduler: lost leadership")
+                self.leader_lock = None
+        lock = database.lock(LEADER_KEY, timeout=LEADER_TIMEOUT, thread_local=False)
+        # the token shows which process leads
+        if lock.acquire(blocking=False, token=f"{self.identity}:{uuid.uuid4().hex}"):
+            logger.info(f"scheduler: {self.identity} is the leader")
+            self.leader_lock = lock
+            return True
+        return False
+
+    async def _election(self):
+        while True:
+            await asyncio.sleep(LEADER_TIMEOUT / 3)
+            try:
+                self._elect()
+            except DATABASE_ERRORS as e:
+                # keep running local jobs if the database is unavailable
+                logger.info(f"scheduler: election failed: {e}")
+                self.leader_lock = None
+
+    @staticmethod
+    def _until_due(job: Job) -> float:
+        """Returns seconds until a cluster job is due in any process."""
+        last = database.hget("scheduler.last:global", job.name)
+        if last is None:
+            return 0
+        return float(last) + job.next_interval - time.time()
+
+    async def _loop(self, job: Job):
+        while True:
+            try:
+                if not job.cluster:
+                    await self.run(job)
+                    await asyncio.sleep(job.next_interval)
+                    continue
+                due = self._until_due(job)
+                if due > 0 or not self.is_leader:
+                    # check again in case leadership changes
+                    await asyncio.sleep(min(max(due, 1), LEADER_TIMEOUT / 3))
+                    continue
+                await self.run(job)
+            except DATABASE_ERRORS as e:
+                # keep the job scheduled if the database is unavailable
+                logger.info(f"job {job.name}: database error: {e}")
+                await asyncio.sleep(job.next_interval)
+
+    async def run(self, job: Job) -> bool:
+        """Runs a job now, unless it's already running.
+
+        Returns if the job ran.
+        """
+        if job.running:
+            logger.info(f"job {job.name}: still running, skipping")
+            job.skipped += 1
+            return False
+        lock = None
+        if job.cluster:
+            # in case another process still runs it after losing leadership
+            lock = database.lock(
+                f"scheduler.job:{{{job.name}}}",
+                timeout=max(job.interval, LEADER_TIMEOUT),
+                thread_local=False,
+            )
+            if not lock.acquire(blocking=False):
+                logger.info(f"job {job.name}: running elsewhere, skipping")
+                job.skipped += 1
+                return False
+            try:
+                database.hset("scheduler.last:global", job.name, time.time())
+            except DATABASE_ERRORS:
+                self._release(job, lock)
+                raise
+
+        job.running = True
+        job.last_run = time.time()
+        start = time.perf_counter()
+        logger.info(f"job {job.name}: starting")
+        try:
+            await job.func()
+        except Exception as e:  # pylint: disable=broad-except
+            job.failures += 1
+            logger.exception(f"job {job.name}: failed")
+            capture_exception(e)
+        finally:
+            duration = time.perf_counter() - start
+            job.running = False
+            job.runs += 1
+            job.last_duration = duration
+            job.total_duration += duration
+            job.next_interval = job.delay()
+            logger.info(f"job {job.name}: finished in {duration:.2f} s")
+            if lock is not None:
+                try:
+                    database.hset(
+                        "scheduler.duration:global", job.name, round(duration, 3)
+                    )
+                except DATABASE_ERRORS as e:
+                    logger.info(f"job {job.name}: saving duration failed: {e}")
+                self._release(job, lock)
+        return True
+
+    @staticmethod
+    def _release(job: Job, lock):
+        try:
+            lock.release()
+        except redis.exceptions.LockError:
+            logger.info(f"job {job.name}: took longer than its lock")
+        except DATABASE_ERRORS as e:
+            # the lock expires on its own
+            logger.info(f"job {job.name}: releasing lock failed: {e}")
+
+    def stats(self) -> Dict[str, dict]:
+        """Returns the stats of every job in this process."""
+        return {name: job.stats() for name, job in self.jobs.items()}
+
+    def leader(self) -> Optional[str]:
+        """Returns the process that leads, or None."""
+        token = database.get(LEADER_KEY)
+        return None if token is None else token.decode("utf-8").rpartition(":")[0]
+
+    def cluster_durations(self) -> List[tuple]:
+        """Returns (job, seconds since last run, last duration) of cluster jobs."""
+        last = database.hgetall("scheduler.last:global")
+        durations = database.hgetall("scheduler.duration:global")
+        now = time.time()
+        return [
+            (
+                name.decode("utf-8"),
+                now - float(started),
+                float(durations[name]) if name in durations else None,
+            )
+            for name, started in sorted(last.items())
+        ]
+
+
+scheduler = Scheduler()
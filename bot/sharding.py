@@ -0,0 +1,167 @@
+# sharding.py | runs the bot as several processes of gateway shards
+# Copyright (C) 2019-2021  EraserBird, person_v1.32, hmmm
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Usage: python3 -m bot.sharding [processes]
+#
+# Starts `processes` bot processes and restarts them if they exit.
+# Process i runs the shards where shard id % processes == i, out of
+# SCIOLY_ID_BOT_SHARD_COUNT shards (default: one per process).
+#
+# Everything the processes share is kept in the database. Races, caches,
+# and bird lists are kept in memory by each process, which works since
+# all events of a guild (and its channels) go to the same shard. Tasks
+# for the whole bot, like backups, run in one process chosen by
+# bot.scheduler.
+#
+# This module is imported by the launcher, so it shouldn't import
+# bot.data at the top level.
+
+import os
+import signal
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+# total number of shards, 0 to run one process without sharding
+SHARD_COUNT = int(os.getenv("SCIOLY_ID_BOT_SHARD_COUNT", "0"))
+# number of processes and the index of this one, set by the launcher
+SHARD_PROCESSES = int(os.getenv("SCIOLY_ID_BOT_SHARD_PROCESSES", "1"))
+SHARD_PROCESS = int(os.getenv("SCIOLY_ID_BOT_SHARD_PROCESS", "0"))
+
+# seconds to wait before restarting a process that exited
+RESTART_DELAY = 5
+
+# names keys for this process, like users.synced:{PROCESS_SCOPE}
+PROCESS_SCOPE = "global" if SHARD_COUNT == 0 else f"process.{SHARD_PROCESS}"
+
+
+def process_shards(
+    shard_count: int = SHARD_COUNT,
+    processes: int = SHARD_PROCESSES,
+    process: int = SHARD_PROCESS,
+) -> List[int]:
+    """Returns the shard ids run by a process.
+
+    `shard_count` (int) - total number of shards\n
+    `processes` (int) - number of processes\n
+    `process` (int) - index of the process
+    """
+    return list(range(process, shard_count, processes))
+
+
+def shard_options() -> dict:
+    """Returns the sharding arguments for AutoShardedBot."""
+    if SHARD_COUNT == 0:
+        return {"shard_count": 1}
+    return {"shard_count": SHARD_COUNT, "shard_ids": process_shards()}
+
+
+def process_path(path: str) -> str:
+    """Returns a file path for this process, for files processes can't share."""
+    if SHARD_COUNT == 0:
+        return path
+    return f"{path}.{SHARD_PROCESS}"
+
+
+def report_guilds(bot):
+    """Saves the number of guilds in this process for `guild_count`."""
+    if SHARD_COUNT == 0:
+        return
+    from bot.data import database  # pylint: disable=import-outside-toplevel
+
+    database.hset("shards.guilds:global", str(SHARD_PROCESS), len(bot.guilds))
+
+
+def guild_count(bot) -> int:
+    """Returns the number of guilds in all processes."""
+    if SHARD_COUNT == 0:
+        return len(bot.guilds)
+    from bot.data import database  # pylint: disable=import-outside-toplevel
+
+    counts = {
+        int(process): int(count)
+        for process, count in database.hgetall("shards.guilds:global").items()
+    }
+    # skip processes left over from running with more processes
+    counts = {
+        process: count for process, count in counts.items() if process < SHARD_PROCESSES
+    }
+    counts[SHARD_PROCESS] = len(bot.guilds)
+    return sum(counts.values())
+
+
+def launch(
+    processes: int, command: Optional[List[str]] = None, env: Optional[dict] = None
+) -> int:
+    """Runs `processes` bot processes until they're stopped with SIGTERM or SIGINT.
+
+    `processes` (int) - number of processes\n
+    `command` (list) - command of each process, the bot by default\n
+    `env` (dict) - environment of the processes, this one by default
+    """
+    command = command or [sys.executable, "-m", "bot"]
+    env = dict(os.environ if env is None else env)
+    env.setdefault("SCIOLY_ID_BOT_SHARD_COUNT", str(processes))
+    env["SCIOLY_ID_BOT_SHARD_PROCESSES"] = str(processes)
+    children: Dict[int, subprocess.Popen] = {}
+    stopping = False
+
+    def start(process: int):
+        print(f"starting shard process {process}", flush=True)
+        children[process] = subprocess.Popen(
+            command, env={**env, "SCIOLY_ID_BOT_SHARD_PROCESS": str(process)}
+        )
+
+    def stop(signum, frame):  # pylint: disable=unused-argument
+        nonlocal stopping
+        stopping = True
+        for child in children.values():
+            if child.poll() is None:
+                child.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for process in range(processes):
+        start(process)
+
+    while children:
+        time.sleep(0.5)
+        for process, child in list(children.items()):
+            code = child.poll()
+            if code is None:
+                continue
+            del children[process]
+            if not stopping:
+                print(f"shard process {process} exited with {code}", flush=True)
+                time.sleep(RESTART_DELAY)
+                if not stopping:
+                    start(process)
+    return 0
+
+
+def main(args: List[str]):
+    processes = (
+        int(args[0]) if args else int(os.getenv("SCIOLY_ID_BOT_SHARD_PROCESSES", "1"))
+    )
+    if processes < 1:
+        print("Usage: python3 -m bot.sharding [processes]")
+        return 1
+    return launch(processes)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
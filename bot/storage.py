@@ -0,0 +1,984 @@
+# storage.py | embedded storage backend
+# Copyright (C) 2019-2021  EraserBird, person_v1.32, hmmm
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Usage: python3 -m bot.storage bench [operations]
+
+# The storage interface is the subset of the redis-py client API listed
+# in STORAGE_COMMANDS. bot.data.database is either a redis.Redis client
+# or a SQLiteStorage, picked with SCIOLY_ID_BOT_STORAGE.
+#
+# SQLiteStorage keeps the data in a SQLite database in WAL mode inside
+# the bot process, so single node installs don't need a Redis server.
+# Results match redis-py's: values are returned as bytes, scores as floats.
+
+import datetime
+import fnmatch
+import math
+import os
+import pickle
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from typing import Dict, Iterable, List, Optional, Union
+
+import redis
+
+STORAGE_COMMANDS = (
+    # strings
+    "get",
+    "set",
+    "incrby",
+    # hashes
+    "hget",
+    "hmget",
+    "hset",
+    "hgetall",
+    # sets
+    "sadd",
+    "srem",
+    "smembers",
+    "sismember",
+    "scard",
+    "sscan",
+    "sunionstore",
+    # sorted sets
+    "zadd",
+    "zincrby",
+    "zscore",
+    "zrem",
+    "zcard",
+    "zrange",
+    "zrevrange",
+    "zrangebyscore",
+    "zrevrangebyscore",
+    "zrevrank",
+    "zremrangebyscore",
+    "zunionstore",
+    # keys
+    "delete",
+    "exists",
+    "expire",
+    "persist",
+    "pttl",
+    "rename",
+    "renamenx",
+    "scan_iter",
+    "dump",
+    "restore",
+    "pipeline",
+    "lock",
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS keys (
+    key BLOB PRIMARY KEY, type TEXT NOT NULL, expire REAL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS strings (
+    key BLOB PRIMARY KEY, value BLOB NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS hashes (
+    key BLOB, field BLOB, value BLOB NOT NULL, PRIMARY KEY (key, field)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS sets (
+    key BLOB, member BLOB, PRIMARY KEY (key, member)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS zsets (
+    key BLOB, member BLOB, score REAL NOT NULL, PRIMARY KEY (key, member)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS zsets_score ON zsets (key, score, member);
+"""
+
+TABLES = {"string": "strings", "hash": "hashes", "set": "sets", "zset": "zsets"}
+
+WRONGTYPE = "WRONGTYPE Operation against a key holding the wrong kind of value"
+
+
+def _encode(value) -> bytes:
+    """Encodes a value the same way redis-py does."""
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, bool):
+        raise redis.exceptions.DataError("Invalid input of type: 'bool'")
+    if isinstance(value, int):
+        return str(value).encode()
+    if isinstance(value, float):
+        return repr(value).encode()
+    if isinstance(value, str):
+        return value.encode("utf-8")
+    raise redis.exceptions.DataError(f"Invalid input of type: '{type(value).__name__}'")
+
+
+def _score(value, exclusive_ok: bool = True) -> (float, bool):
+    """Parses a score bound like redis: numbers, "+inf", "-inf", "(1"."""
+    if isinstance(value, (int, float)):
+        return float(value), False
+    value = value.decode() if isinstance(value, bytes) else str(value)
+    exclusive = exclusive_ok and value.startswith("(")
+    if exclusive:
+        value = value[1:]
+    return float(value), exclusive
+
+
+def _seconds(value) -> float:
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    return float(value)
+
+
+class SQLiteStorage:
+    """Embedded storage with the same interface as a redis.Redis client.
+
+    `path` (str) - database file, created if it doesn't exist
+    """
+
+    def __init__(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._lock = threading.RLock()
+        # autocommit, transactions are started explicitly
+        self._conn = sqlite3.connect(
+            path, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._depth = 0
+
+    def __repr__(self):
+        return f"SQLiteStorage<{self.path}>"
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    ######
+    # Internals
+    ######
+
+    def _transaction(self):
+        return _Transaction(self)
+
+    def _query(self, sql: str, args=()) -> list:
+        return self._conn.execute(sql, args).fetchall()
+
+    def _type(self, key: bytes) -> Optional[str]:
+        """Returns the type of a live key, deleting it if it expired."""
+        row = self._query("SELECT type, expire FROM keys WHERE key = ?", (key,))
+        if not row:
+            return None
+        key_type, expire = row[0]
+        if expire is not None and expire <= time.time():
+            self._remove(key, key_type)
+            return None
+        return key_type
+
+    def _check(self, key: bytes, expected: str) -> bool:
+        """Returns if the key exists, raising if it has the wrong type."""
+        key_type = self._type(key)
+        if key_type is None:
+            return False
+        if key_type != expected:
+            raise redis.exceptions.ResponseError(WRONGTYPE)
+        return True
+
+    def _create(self, key: bytes, expected: str):
+        if not self._check(key, expected):
+            self._conn.execute(
+                "INSERT INTO keys (key, type) VALUES (?, ?)", (key, expected)
+            )
+
+    def _remove(self, key: bytes, key_type: str):
+        self._conn.execute(f"DELETE FROM {TABLES[key_type]} WHERE key = ?", (key,))
+        self._conn.execute("DELETE FROM keys WHERE key = ?", (key,))
+
+    def _drop_if_empty(self, key: bytes, key_type: str):
+        table = TABLES[key_type]
+        if not self._query(f"SELECT 1 FROM {table} WHERE key = ? LIMIT 1", (key,)):
+            self._conn.execute("DELETE FROM keys WHERE key = ?", (key,))
+
+    def _zrange_rows(self, key: bytes, start: int, end: int, desc: bool) -> List[tuple]:
+        """Returns (member, score) rows by rank, supporting negative indexes."""
+        if not self._check(key, "zset"):
+            return []
+        count = self._query("SELECT COUNT(*) FROM zsets WHERE key = ?", (key,))[0][0]
+        if start < 0:
+            start = max(count + start, 0)
+        if end < 0:
+            end = count + end
+        end = min(end, count - 1)
+        if start > end:
+            return []
+        order = "DESC" if desc else "ASC"
+        return self._query(
+            "SELECT member, score FROM zsets WHERE key = ? "
+            + f"ORDER BY score {order}, member {order} LIMIT ? OFFSET ?",
+            (key, end - start + 1, start),
+        )
+
+    def _zrange_by_score(self, key, low, high, start, num, desc) -> List[tuple]:
+        if not self._check(key, "zset"):
+            return []
+        (low, low_ex), (high, high_ex) = _score(low), _score(high)
+        order = "DESC" if desc else "ASC"
+        sql = (
+            "SELECT member, score FROM zsets WHERE key = ? "
+            + f"AND score {'>' if low_ex else '>='} ? "
+            + f"AND score {'<' if high_ex else '<='} ? "
+            + f"ORDER BY score {order}, member {order}"
+        )
+        args = [key, low, high]
+        if start is not None and num is not None:
+            sql += " LIMIT ? OFFSET ?"
+            args += [num, start]
+        return self._query(sql, args)
+
+    @staticmethod
+    def _with_scores(rows, withscores: bool):
+        if withscores:
+            return [(member, score) for member, score in rows]
+        return [member for member, _ in rows]
+
+    ######
+    # Strings
+    ######
+
+    def get(self, name):
+        with self._lock:
+            key = _encode(name)
+            if not self._check(key, "string"):
+                return None
+            return self._query("SELECT value FROM strings WHERE key = ?", (key,))[0][0]
+
+    def set(self, name, value, ex=None, px=None, nx=False, xx=False, keepttl=False):
+        with self._transaction():
+            key = _encode(name)
+            key_type = self._type(key)
+            if (nx and key_type is not None) or (xx and key_type is None):
+                return None
+            expire = None
+            if keepttl and key_type is not None:
+                expire = self._query("SELECT expire FROM keys WHERE key = ?", (key,))[
+                    0
+                ][0]
+            if ex is not None:
+                expire = time.time() + _seconds(ex)
+            elif px is not None:
+                expire = time.time() + _seconds(px) / 1000
+            if key_type is not None:
+                self._remove(key, key_type)
+            self._conn.execute(
+                "INSERT INTO keys (key, type, expire) VALUES (?, 'string', ?)",
+                (key, expire),
+            )
+            self._conn.execute(
+                "INSERT INTO strings (key, value) VALUES (?, ?)", (key, _encode(value))
+            )
+            return True
+
+    def incrby(self, name, amount=1):
+        with self._transaction():
+            key = _encode(name)
+            current = self.get(key)
+            try:
+                value = int(current or 0) + int(amount)
+            except ValueError as e:
+                raise redis.exceptions.ResponseError(
+                    "value is not an integer or out of range"
+                ) from e
+            if current is None:
+                self._create(key, "string")
+            self._conn.execute(
+                "INSERT OR REPLACE INTO strings (key, value) VALUES (?, ?)",
+                (key, _encode(value)),
+            )
+            return value
+
+    incr = incrby
+
+    ######
+    # Hashes
+    ######
+
+    def hget(self, name, key):
+        with self._lock:
+            name = _encode(name)
+            if not self._check(name, "hash"):
+                return None
+            row = self._query(
+                "SELECT value FROM hashes WHERE key = ? AND field = ?",
+                (name, _encode(key)),
+            )
+            return row[0][0] if row else None
+
+    def hmget(self, name, keys, *args):
+        keys = list(keys) if isinstance(keys, (list, tuple)) else [keys]
+        with self._lock:
+            return [self.hget(name, key) for key in keys + list(args)]
+
+    def hset(self, name, key=None, value=None, mapping=None):
+        items = {}
+        if key is not None:
+            items[key] = value
+        if mapping:
+            items.update(mapping)
+        if not items:
+            raise redis.exceptions.DataError("'hset' with no key value pairs")
+        with self._transaction():
+            name = _encode(name)
+            self._create(name, "hash")
+            added = 0
+            for field, field_value in items.items():
+                field = _encode(field)
+                added += not self._query(
+                    "SELECT 1 FROM hashes WHERE key = ? AND field = ?", (name, field)
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO hashes (key, field, value) VALUES (?, ?, ?)",
+                    (name, field, _encode(field_value)),
+                )
+            return added
+
+    def hgetall(self, name) -> Dict[bytes, bytes]:
+        with self._lock:
+            name = _encode(name)
+            if not self._check(name, "hash"):
+                return {}
+            return dict(
+                self._query("SELECT field, value FROM hashes WHERE key = ?", (name,))
+            )
+
+    ######
+    # Sets
+    ######
+
+    def sadd(self, name, *values):
+        with self._transaction():
+            name = _encode(name)
+            self._create(name, "set")
+            added = 0
+            for value in values:
+                added += self._conn.execute(
+                    "INSERT OR IGNORE INTO sets (key, member) VALUES (?, ?)",
+                    (name, _encode(value)),
+                ).rowcount
+            return added
+
+    def srem(self, name, *values):
+        with self._transaction():
+            name = _encode(name)
+            if not self._check(name, "set"):
+                return 0
+            removed = 0
+            for value in values:
+                removed += self._conn.execute(
+                    "DELETE FROM sets WHERE key = ? AND member = ?",
+                    (name, _encode(value)),
+                ).rowcount
+            self._drop_if_empty(name, "set")
+            return removed
+
+    def smembers(self, name) -> set:
+        with self._lock:
+            name = _encode(name)
+            if not self._check(name, "set"):
+                return set()
+            return {
+                row[0]
+                for row in self._query("SELECT member FROM sets WHERE key = ?", (name,))
+            }
+
+    def sismember(self, name, value) -> bool:
+        with self._lock:
+            name = _encode(name)
+            if not self._check(name, "set"):
+                return False
+            return bool(
+                self._query(
+                    "SELECT 1 FROM sets WHERE key = ? AND member = ?",
+                    (name, _encode(value)),
+                )
+            )
+
+    def scard(self, name) -> int:
+        with self._lock:
+            name = _encode(name)
+            if not self._check(name, "set"):
+                return 0
+            return self._query("SELECT COUNT(*) FROM sets WHERE key = ?", (name,))[0][0]
+
+    def sscan(self, name, cursor=0, match=None, count=None):
+        members = self.smembers(name)
+        if match is not None:
+            members = [m for m in members if fnmatch.fnmatchcase(m, _encode(match))]
+        return 0, list(members)
+
+    def sunionstore(self, dest, keys, *args):
+        keys = list(keys) if isinstance(keys, (list, tuple)) else [keys]
+        with self._transaction():
+            members = set()
+            for key in keys + list(args):
+                members |= self.smembers(key)
+            self.delete(dest)
+            if members:
+                self.sadd(dest, *members)
+            return len(members)
+
+    ######
+    # Sorted Sets
+    ######
+
+    def zadd(self, name, mapping, nx=False, xx=False, ch=False, incr=False):
+        with self._transaction():
+            name = _encode(name)
+            self._create(name, "zset")
+            added = changed = 0
+            for member, score in mapping.items():
+                member = _encode(member)
+                row = self._query(
+                    "SELECT score FROM zsets WHERE key = ? AND member = ?",
+                    (name, member),
+                )
+                if (nx and row) or (xx and not row):
+                    continue
+                if incr:
+                    score = float(score) + (row[0][0] if row else 0)
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO zsets VALUES (?, ?, ?)",
+                        (name, member, score),
+                    )
+                    return score
+                added += not row
+                changed += not row or row[0][0] != float(score)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO zsets VALUES (?, ?, ?)",
+                    (name, member, float(score)),
+                )
+            self._drop_if_empty(name, "zset")
+            return changed if ch else added
+
+    def zincrby(self, name, amount, value) -> float:
+        with self._transaction():
+            name = _encode(name)
+            self._create(name, "zset")
+            member = _encode(value)
+            self._conn.execute(
+                "INSERT INTO zsets VALUES (?, ?, ?) "
+                + "ON CONFLICT (key, member) DO UPDATE SET score = score + excluded.score",
+                (name, member, float(amount)),
+            )
+            return self._query(
+                "SELECT score FROM zsets WHERE key = ? AND member = ?", (name, member)
+            )[0][0]
+
+    def zscore(self, name, value) -> Optional[float]:
+        with self._lock:
+            name = _encode(name)
+            if not self._check(name, "zset"):
+                return None
+            row = self._query(
+                "SELECT score FROM zsets WHERE key = ? AND member = ?",
+                (name, _encode(value)),
+            )
+            return row[0][0] if row else None
+
+    def zrem(self, name, *values) -> int:
+        with self._transaction():
+            name = _encode(name)
+            if not self._check(name, "zset"):
+                return 0
+            removed = 0
+            for value in values:
+                removed += self._conn.execute(
+                    "DELETE FROM zsets WHERE key = ? AND member = ?",
+                    (name, _encode(value)),
+                ).rowcount
+            self._drop_if_empty(name, "zset")
+            return removed
+
+    def zcard(self, name) -> int:
+        with self._lock:
+            name = _encode(name)
+            if not self._check(name, "zset"):
+                return 0
+            return self._query("SELECT COUNT(*) FROM zsets WHERE key = ?", (name,))[0][
+                0
+            ]
+
+    def zrange(self, name, start, end, desc=False, withscores=False):
+        with self._lock:
+            rows = self._zrange_rows(_encode(name), int(start), int(end), desc)
+            return self._with_scores(rows, withscores)
+
+    def zrevrange(self, name, start, end, withscores=False):
+        return self.zrange(name, start, end, desc=True, withscores=withscores)
+
+    def zrangebyscore(
+        self, name, min, max, start=None, num=None, withscores=False
+    ):  # pylint: disable=redefined-builtin
+        with self._lock:
+            rows = self._zrange_by_score(_encode(name), min, max, start, num, False)
+            return self._with_scores(rows, withscores)
+
+    def zrevrangebyscore(
+        self, name, max, min, start=None, num=None, withscores=False
+    ):  # pylint: disable=redefined-builtin
+        with self._lock:
+            rows = self._zrange_by_score(_encode(name), min, max, start, num, True)
+            return self._with_scores(rows, withscores)
+
+    def zrevrank(self, name, value) -> Optional[int]:
+        with self._lock:
+            name = _encode(name)
+            score = self.zscore(name, value)
+            if score is None:
+                return None
+            return self._query(
+                "SELECT COUNT(*) FROM zsets WHERE key = ? "
+                + "AND (score > ? OR (score = ? AND member > ?))",
+                (name, score, score, _encode(value)),
+            )[0][0]
+
+    def zremrangebyscore(
+        self, name, min, max
+    ) -> int:  # pylint: disable=redefined-builtin
+        with self._transaction():
+            name = _encode(name)
+            if not self._check(name, "zset"):
+                return 0
+            (low, low_ex), (high, high_ex) = _score(min), _score(max)
+            removed = self._conn.execute(
+                "DELETE FROM zsets WHERE key = ? "
+                + f"AND score {'>' if low_ex else '>='} ? "
+                + f"AND score {'<' if high_ex else '<='} ?",
+                (name, low, high),
+            ).rowcount
+            self._drop_if_empty(name, "zset")
+            return removed
+
+    def zunionstore(self, dest, keys, aggregate=None) -> int:
+        if isinstance(keys, dict):
+            weights = keys
+        else:
+            weights = {key: 1 for key in keys}
+        combine = {
+            None: lambda a, b: a + b,
+            "SUM": lambda a, b: a + b,
+            "MIN": min,
+            "MAX": max,
+        }[aggregate.upper() if aggregate else None]
+        with self._transaction():
+            result = {}
+            for key, weight in weights.items():
+                for member, score in self.zrange(key, 0, -1, withscores=True):
+                    score *= weight
+                    result[member] = (
+                        combine(result[member], score) if member in result else score
+                    )
+            self.delete(dest)
+            if result:
+                self.zadd(dest, result)
+            return len(result)
+
+    ######
+    # Keys
+    ######
+
+    def delete(self, *names) -> int:
+        with self._transaction():
+            deleted = 0
+            for name in names:
+                key = _encode(name)
+                key_type = self._type(key)
+                if key_type is not None:
+                    self._remove(key, key_type)
+                    deleted += 1
+            return deleted
+
+    def exists(self, *names) -> int:
+        with self._lock:
+            return sum(self._type(_encode(name)) is not None for name in names)
+
+    def expire(self, name, time_) -> bool:
+        with self._transaction():
+            key = _encode(name)
+            if self._type(key) is None:
+                return False
+            self._conn.execute(
+                "UPDATE keys SET expire = ? WHERE key = ?",
+                (time.time() + _seconds(time_), key),
+            )
+            return True
+
+    def persist(self, name) -> bool:
+        with self._transaction():
+            key = _encode(name)
+            if self._type(key) is None:
+                return False
+            return bool(
+                self._conn.execute(
+                    "UPDATE keys SET expire = NULL WHERE key = ? AND expire IS NOT NULL",
+                    (key,),
+                ).rowcount
+            )
+
+    def pttl(self, name) -> int:
+        with self._lock:
+            key = _encode(name)
+            if self._type(key) is None:
+                return -2
+            expire = self._query("SELECT expire FROM keys WHERE key = ?", (key,))[0][0]
+            if expire is None:
+                return -1
+            return max(math.ceil((expire - time.time()) * 1000), 0)
+
+    def ttl(self, name) -> int:
+        pttl = self.pttl(name)
+        return pttl if pttl < 0 else math.ceil(pttl / 1000)
+
+    def rename(self, src, dst) -> bool:
+        with self._transaction():
+            src, dst = _encode(src), _encode(dst)
+            key_type = self._type(src)
+            if key_type is None:
+                raise redis.exceptions.ResponseError("no such key")
+            if src == dst:
+                return True
+            self.delete(dst)
+            self._conn.execute("UPDATE keys SET key = ? WHERE key = ?", (dst, src))
+            self._conn.execute(
+                f"UPDATE {TABLES[key_type]} SET key = ? WHERE key = ?", (dst, src)
+            )
+            return True
+
+    def renamenx(self, src, dst) -> bool:
+        with self._transaction():
+            if self.exists(dst):
+                if not self.exists(src):
+                    raise redis.exceptions.ResponseError("no such key")
+                return False
+            return self.rename(src, dst)
+
+    def type(self, name) -> bytes:
+        with self._lock:
+            return (self._type(_encode(name)) or "none").encode()
+
+    def scan_iter(self, match=None, count=None, _type=None):
+        """Iterates over live keys. Unlike Redis, the keys are listed up front."""
+        with self._lock:
+            sql = "SELECT key FROM keys WHERE (expire IS NULL OR expire > ?)"
+            args = [time.time()]
+            if match is not None:
+                # GLOB is close enough to redis patterns for the ones we use
+                sql += " AND CAST(key AS TEXT) GLOB ?"
+                args.append(_encode(match).decode("utf-8"))
+            if _type is not None:
+                sql += " AND type = ?"
+                args.append(_type)
+            keys = [row[0] for row in self._query(sql, args)]
+        yield from keys
+
+    def dump(self, name) -> Optional[bytes]:
+        """Serializes a key. The format is not compatible with Redis DUMP."""
+        with self._lock:
+            key = _encode(name)
+            key_type = self._type(key)
+            if key_type is None:
+                return None
+            if key_type == "string":
+                value = self.get(key)
+            elif key_type == "hash":
+                value = self.hgetall(key)
+            elif key_type == "set":
+                value = self.smembers(key)
+            else:
+                value = self.zrange(key, 0, -1, withscores=True)
+            return pickle.dumps((key_type, value), protocol=4)
+
+    def restore(self, name, ttl, value, replace=False, **kwargs):
+        with self._transaction():
+            if self.exists(name):
+                if not replace:
+                    raise redis.exceptions.ResponseError(
+                        "BUSYKEY Target key name already exists."
+                    )
+                self.delete(name)
+            key_type, data = pickle.loads(value)
+            if key_type == "string":
+                self.set(name, data)
+            elif key_type == "hash":
+                self.hset(name, mapping=data)
+            elif key_type == "set":
+                self.sadd(name, *data)
+            else:
+                self.zadd(name, dict(data))
+            if ttl:
+                self.expire(name, ttl / 1000)
+            return b"OK"
+
+    def flushdb(self) -> bool:
+        with self._transaction():
+            for table in ("keys", *TABLES.values()):
+                self._conn.execute(f"DELETE FROM {table}")
+            return True
+
+    def dbsize(self) -> int:
+        return sum(1 for _ in self.scan_iter())
+
+    def ping(self) -> bool:
+        return True
+
+    ######
+    # Server
+    ######
+
+    def info(self, section=None) -> dict:
+        return {"role": "master", "storage": "sqlite"}
+
+    def config_get(self, pattern="*") -> dict:
+        return {}
+
+    def config_set(self, name, value):
+        raise redis.exceptions.ResponseError(f"Unsupported CONFIG parameter: {name}")
+
+    def object(self, infotype, key):
+        return None
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return Pipeline(self)
+
+    def lock(
+        self,
+        name,
+        timeout=None,
+        sleep=0.1,
+        blocking=True,
+        blocking_timeout=None,
+        thread_local=True,
+    ):
+        return Lock(self, name, timeout, sleep, blocking, blocking_timeout)
+
+
+class _Transaction:
+    """Reentrant BEGIN/COMMIT around a group of statements."""
+
+    def __init__(self, storage: SQLiteStorage):
+        self.storage = storage
+
+    def __enter__(self):
+        self.storage._lock.acquire()  # pylint: disable=protected-access
+        if self.storage._depth == 0:  # pylint: disable=protected-access
+            # take the write lock up front, a deferred transaction that reads
+            # first fails right away if another process is writing
+            self.storage._conn.execute(  # pylint: disable=protected-access
+                "BEGIN IMMEDIATE"
+            )
+        self.storage._depth += 1  # pylint: disable=protected-access
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # pylint: disable=protected-access
+        self.storage._depth -= 1
+        try:
+            if self.storage._depth == 0:
+                if exc_type is None:
+                    self.storage._conn.execute("COMMIT")
+                else:
+                    self.storage._conn.execute("ROLLBACK")
+        finally:
+            self.storage._lock.release()
+        return False
+
+
+class Lock:
+    """A lock stored in a key, like redis-py's Lock.
+
+    Other processes using the same database file see the lock, since
+    every check and change happens in one transaction.
+    """
+
+    def __init__(
+        self,
+        storage: SQLiteStorage,
+        name,
+        timeout=None,
+        sleep=0.1,
+        blocking=True,
+        blocking_timeout=None,
+    ):
+        self.storage = storage
+        self.name = name
+        self.timeout = timeout
+        self.sleep = sleep
+        self.blocking = blocking
+        self.blocking_timeout = blocking_timeout
+        self.token: Optional[bytes] = None
+
+    def __enter__(self):
+        if self.acquire():
+            return self
+        raise redis.exceptions.LockError(
+            "Unable to acquire lock within the time specified"
+        )
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+    def acquire(self, blocking=None, blocking_timeout=None, token=None) -> bool:
+        blocking = self.blocking if blocking is None else blocking
+        if blocking_timeout is None:
+            blocking_timeout = self.blocking_timeout
+        token = _encode(token if token is not None else uuid.uuid4().hex)
+        stop_at = (
+            None if blocking_timeout is None else time.monotonic() + blocking_timeout
+        )
+        while True:
+            if self.storage.set(self.name, token, nx=True, ex=self.timeout):
+                self.token = token
+                return True
+            if not blocking or (stop_at is not None and time.monotonic() > stop_at):
+                return False
+            time.sleep(self.sleep)
+
+    def locked(self) -> bool:
+        return self.storage.get(self.name) is not None
+
+    def owned(self) -> bool:
+        return self.token is not None and self.storage.get(self.name) == self.token
+
+    def release(self):
+        with self.storage._transaction():  # pylint: disable=protected-access
+            if not self.owned():
+                raise redis.exceptions.LockNotOwnedError(
+                    "Cannot release a lock that's no longer owned"
+                )
+            self.storage.delete(self.name)
+        self.token = None
+
+    def reacquire(self) -> bool:
+        if self.timeout is None:
+            raise redis.exceptions.LockError("Cannot reacquire a lock with no timeout")
+        with self.storage._transaction():  # pylint: disable=protected-access
+            if not self.owned():
+                raise redis.exceptions.LockNotOwnedError(
+                    "Cannot reacquire a lock that's no longer owned"
+                )
+            return self.storage.expire(self.name, self.timeout)
+
+
+class Pipeline:
+    """Buffers commands and runs them in one SQLite transaction."""
+
+    def __init__(self, storage: SQLiteStorage):
+        self.storage = storage
+        self.commands = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.reset()
+
+    def __len__(self):
+        return len(self.commands)
+
+    def __getattr__(self, name):
+        if name not in STORAGE_COMMANDS and not hasattr(SQLiteStorage, name):
+            raise AttributeError(name)
+
+        def queue(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+
+        return queue
+
+    def reset(self):
+        self.commands = []
+
+    def execute(self, raise_on_error=True) -> list:
+        results = []
+        # pylint: disable=protected-access
+        with self.storage._transaction():
+            for name, args, kwargs in self.commands:
+                try:
+                    results.append(getattr(self.storage, name)(*args, **kwargs))
+                except redis.exceptions.ResponseError as e:
+                    results.append(e)
+        self.reset()
+        if raise_on_error:
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+        return results
+
+
+def bench(operations: int = 20000):
+    """Compares command throughput of SQLiteStorage and Redis."""
+    from bot.data import database  # pylint: disable=import-outside-toplevel
+
+    def run(db, label):
+        # use hash tagged names like the bot so the keys are easy to find
+        prefix = f"bench.{os.getpid()}"
+        tests = {
+            "zincrby": lambda i: db.zincrby(f"{prefix}.z", 1, f"member{i % 500}"),
+            "zscore": lambda i: db.zscore(f"{prefix}.z", f"member{i % 500}"),
+            "hset": lambda i: db.hset(f"{prefix}.h:{{{i % 100}}}", "bird", str(i)),
+            "hget": lambda i: db.hget(f"{prefix}.h:{{{i % 100}}}", "bird"),
+            "sadd": lambda i: db.sadd(f"{prefix}.s", str(i % 1000)),
+            "zrevrangebyscore": lambda i: db.zrevrangebyscore(
+                f"{prefix}.z", "+inf", "-inf", 0, 10, True
+            ),
+        }
+        try:
+            for name, test in tests.items():
+                start = time.perf_counter()
+                for i in range(operations):
+                    test(i)
+                elapsed = time.perf_counter() - start
+                print(f"{label:>7} {name:>17}: {operations / elapsed:>10,.0f} ops/s")
+        finally:
+            db.delete(f"{prefix}.z", f"{prefix}.s")
+            for i in range(100):
+                db.delete(f"{prefix}.h:{{{i}}}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = SQLiteStorage(os.path.join(tmp, "bench.sqlite3"))
+        run(storage, "sqlite")
+        storage.close()
+    if os.getenv("SCIOLY_ID_BOT_STORAGE") == "sqlite":
+        print("SCIOLY_ID_BOT_STORAGE is sqlite, skipping redis")
+        return
+    try:
+        database.ping()
+    except redis.exceptions.ConnectionError as e:
+        print(f"redis unavailable, skipping: {e}")
+        return
+    run(database, "redis")
+
+
+def main(args: List[str]):
+    if args and args[0] == "bench":
+        bench(*map(int, args[1:2]))
+        return 0
+    print("Usage: python3 -m bot.storage bench [operations]")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -15,12 +15,37 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import asyncio
-from typing import Optional
+import hashlib
+import mmap
+import os
+import struct
+import time
+from typing import Dict, Iterable, Optional
 
 import discord
 import discord.utils
 
+from bot.cache import Cache
 from bot.data import logger, database
+from bot.scheduler import run_blocking
+
+# Recordings are encoded to Opus once and the packets are kept in
+# PACKET_DIR, in a file named after a hash of the recording. Packet files
+# have the packets, then the offsets of each packet and the end of the
+# last one (PACKET_OFFSET), then the number of packets (PACKET_TRAILER).
+PACKET_DIR = "bot_files/voice/"
+PACKET_OFFSET = struct.Struct("<Q")
+PACKET_TRAILER = struct.Struct("<I4s")
+PACKET_MAGIC = b"OPK1"
+# packet files not played for this many seconds are deleted
+PACKET_MAX_AGE = 7 * 24 * 60 * 60
+# seconds of audio in each packet
+FRAME_LENGTH = 0.02
+
+# recording filename to ((size, modified time), hash of the file contents)
+_hashes = Cache("packet_hash", maxsize=4096)
+# packet files being written by this process
+_encoding: Dict[str, asyncio.Future] = {}
 
 
 async def _send(ctx, silent, message: str):
@@ -42,7 +67,7 @@ async def get_voice_client(
             )
             return None
 
-    current_voice = database.get(f"voice.server:{ctx.guild.id}")
+    current_voice = database.get(f"voice.server:{{{ctx.guild.id}}}")
     if current_voice is not None and current_voice.decode("utf-8") != str(
         ctx.channel.id
     ):
@@ -105,9 +130,7 @@ async def play(ctx, filename: Optional[str], silent: bool = False):
         )
         return True
     if filename:
-        # source = await discord.FFmpegOpusAudio.from_probe(filename)
-        # source = CustomAudio(filename)
-        source = await CustomFFmpegAudio.from_probe(filename)
+        source = PacketAudio(await packet_file(filename))
         if client.is_playing():
             client.stop()
         client.play(source)
@@ -203,7 +226,7 @@ async def cleanup(bot):
     for client in bot.voice_clients:
         if len(client.channel.voice_states) == 1:
             logger.info("found empty")
-            current_voice = database.get(f"voice.server:{client.guild.id}")
+            current_voice = database.get(f"voice.server:{{{client.guild.id}}}")
             if current_voice is not None:
                 logger.info("vc race")
                 bound_channel = client.guild.get_channel(int(current_voice))
@@ -211,38 +234,166 @@ async def cleanup(bot):
                 await race.stop_race_(FauxContext(bound_channel, bot))
             else:
                 await client.disconnect()
+    await run_blocking(evict_packets)
     logger.info("done cleaning!")
 
 
-class CustomFFmpegAudio(discord.FFmpegOpusAudio):
-    def __init__(self, filename, bitrate, codec):
-        super().__init__(filename, bitrate=bitrate, codec=codec)
-        self._data_list_ = list(self._packet_iter)
-        self._data_list_.append(b"")
+def _content_hash(filename: str) -> str:
+    digest = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_packets(path: str, packets: Iterable[bytes]) -> int:
+    """Writes a packet file, returning the number of packets.
+
+    The file is written to a temporary file first, so other processes
+    never see part of it. Raises ValueError if there are no packets,
+    since that means encoding failed, and no file is written.
+
+    `path` (str) - path of the packet file\n
+    `packets` (iterable of bytes) - the Opus packets
+    """
+    tmp = f"{path}.{os.getpid()}.tmp"
+    offsets = [0]
+    try:
+        with open(tmp, "wb") as f:
+            for packet in packets:
+                f.write(packet)
+                offsets.append(offsets[-1] + len(packet))
+            for offset in offsets:
+                f.write(PACKET_OFFSET.pack(offset))
+            f.write(PACKET_TRAILER.pack(len(offsets) - 1, PACKET_MAGIC))
+        if len(offsets) == 1:
+            raise ValueError(f"no packets for {path}")
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return len(offsets) - 1
+
+
+def encode(filename: str, path: str) -> int:
+    """Encodes a recording with ffmpeg and writes its packets to `path`."""
+    logger.info(f"encoding {filename}")
+    source = discord.FFmpegOpusAudio(filename)
+    try:
+        # pylint: disable=protected-access
+        return write_packets(path, source._packet_iter)
+    finally:
+        source.cleanup()
+
+
+async def packet_file(filename: str) -> str:
+    """Returns the packet file of a recording, encoding it if needed."""
+    loop = asyncio.get_running_loop()
+    stat = os.stat(filename)
+    version = (stat.st_size, stat.st_mtime_ns)
+    cached = _hashes.get(filename)
+    if cached is not None and cached[0] == version:
+        digest = cached[1]
+    else:
+        digest = await loop.run_in_executor(None, _content_hash, filename)
+        _hashes.set(filename, (version, digest))
+    path = os.path.join(PACKET_DIR, digest + ".opk")
+    if path not in _encoding:
+        if os.path.exists(path):
+            # keep files that are played from being evicted
+            os.utime(path)
+            return path
+        os.makedirs(PACKET_DIR, exist_ok=True)
+        # plays of the same recording while it's encoding wait for it
+        _encoding[path] = loop.run_in_executor(None, encode, filename, path)
+        _encoding[path].add_done_callback(lambda _: _encoding.pop(path, None))
+    await asyncio.shield(_encoding[path])
+    return path
+
+
+def evict_packets(max_age: float = PACKET_MAX_AGE):
+    """Deletes packet files that haven't been played recently."""
+    if not os.path.isdir(PACKET_DIR):
+        return
+    cutoff = time.time() - max_age
+    for entry in os.scandir(PACKET_DIR):
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                logger.info(f"removed packet file {entry.name}")
+        except OSError:
+            # played from a process while deleted, on Windows
+            pass
+
+
+class PacketAudio(discord.AudioSource):
+    """Plays a packet file, reading packets as needed.
+
+    The file is memory mapped, so seeking only moves the cursor. The map
+    is closed when playback stops and opened again if played again.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+        self._map: Optional[mmap.mmap] = None
         self._cursor = 0
+        self._open()
+        count, magic = PACKET_TRAILER.unpack_from(
+            self._map, len(self._map) - PACKET_TRAILER.size
+        )
+        if magic != PACKET_MAGIC:
+            self.cleanup()
+            raise ValueError(f"{path} isn't a packet file")
+        self.count = count
+        self._index = (
+            len(self._map) - PACKET_TRAILER.size - (count + 1) * PACKET_OFFSET.size
+        )
+
+    def _open(self):
+        self._file = open(self.path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _offset(self, packet: int) -> int:
+        return PACKET_OFFSET.unpack_from(
+            self._map, self._index + packet * PACKET_OFFSET.size
+        )[0]
 
     @property
     def length(self):
-        return round(len(self._data_list_) * 0.02)
+        return round(self.count * FRAME_LENGTH)
 
     @property
     def remaining(self):
-        return round((len(self._data_list_) - self._cursor) * 0.02)
+        return round((self.count - self._cursor) * FRAME_LENGTH)
 
     def jump(self, seconds: Optional[int]):
         if seconds is None:
             self._cursor = 0
             return self
 
-        seconds *= 50  # each cursor tick is 20ms, convert seconds to 20ms chunks
-        if self._cursor + seconds < 0:
-            self._cursor = 0
-        elif self._cursor + seconds > len(self._data_list_):
-            self._cursor = len(self._data_list_)
-        else:
-            self._cursor += seconds
+        # each packet is 20ms, convert seconds to packets
+        seconds = round(seconds / FRAME_LENGTH)
+        self._cursor = min(max(self._cursor + seconds, 0), self.count)
         return self
 
     def read(self):
+        if self._cursor >= self.count:
+            return b""
+        if self._map is None:
+            self._open()
+        start = self._offset(self._cursor)
+        end = self._offset(self._cursor + 1)
         self._cursor += 1
-        return self._data_list_[self._cursor - 1]
+        return self._map[start:end]
+
+    def is_opus(self):
+        return True
+
+    def cleanup(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -14,6 +14,9 @@ class Channel:
 class User:
     def __init__(self, user_id=None, username=None):
         self.id = user_id
+        self.name = username
+        self.discriminator = "0000"
+        self.avatar = None
         self.roles = []
 
 
@@ -28,6 +31,7 @@ class Guild:
     def __init__(self, guild_id=None):
         self.id = guild_id
         self.members = []
+        self.text_channels = []
 
     def add_member(self, nick):
         self.members.append(
@@ -58,6 +62,7 @@ class Message:
         self.files = files
         self.delete_after = delete_after
         self.nonce = nonce
+        self.attachments = []
 
     def __repr__(self):
         return str(
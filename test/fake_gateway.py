@@ -0,0 +1,520 @@
+# fake_gateway.py | a fake Discord API and gateway for running shard processes locally
+# Copyright (C) 2019-2021  EraserBird, person_v1.32, hmmm
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Usage: python3 test/fake_gateway.py [processes] [shards] [command] [expect]
+#
+# Starts the fake gateway and the bot's shard processes, sends `command`
+# (b!ping by default) in a guild of each shard, waits for replies with
+# `expect` (Pong by default), and prints the replies.
+# Uses the storage set in the environment, like a temporary SQLite file.
+#
+# `python3 test/fake_gateway.py shard` runs one bot process against the
+# fake gateway at FAKE_DISCORD_URL, and is what the processes run.
+
+import asyncio
+import datetime
+import json
+import os
+import runpy
+import sys
+import tempfile
+from typing import Dict, List, Optional, Tuple
+
+import aiohttp
+from aiohttp import web
+
+BOT_ID = 800000000000000001
+OWNER_ID = 800000000000000002
+USER_ID = 800000000000000003
+# short so the bot measures its latency soon after connecting
+HEARTBEAT_INTERVAL = 1000
+# permissions of @everyone, everything except administrator
+PERMISSIONS = str((1 << 41) - 1 - 8)
+
+
+def snowflake(counter: int) -> int:
+    """Returns a snowflake id with the timestamp part set to `counter`."""
+    return (counter << 22) + 1
+
+
+def guild_shard(guild_id: int, shard_count: int) -> int:
+    """Returns the shard of a guild, like Discord does."""
+    return (guild_id >> 22) % shard_count
+
+
+def _now() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+def _json(data, status: int = 200) -> web.Response:
+    # discord.py only parses responses with exactly this content type
+    return web.Response(
+        body=json.dumps(data).encode("utf-8"),
+        status=status,
+        content_type="application/json",
+    )
+
+
+def _user(user_id: int, name: str, bot: bool = False) -> dict:
+    return {
+        "id": str(user_id),
+        "username": name,
+        "discriminator": "0",
+        "global_name": name,
+        "avatar": None,
+        "bot": bot,
+    }
+
+
+class FakeDiscord:
+    """A fake of the parts of the Discord API and gateway the bot uses.
+
+    Guild ids are picked so each shard has `guilds_per_shard` guilds,
+    each with one text channel with the same id as the guild.
+
+    `shard_count` (int) - number of shards\n
+    `guilds_per_shard` (int) - guilds in each shard
+    """
+
+    def __init__(self, shard_count: int, guilds_per_shard: int = 1):
+        self.shard_count = shard_count
+        self.guilds: Dict[int, List[int]] = {shard: [] for shard in range(shard_count)}
+        counter = 1
+        while any(len(ids) < guilds_per_shard for ids in self.guilds.values()):
+            guild_id = snowflake(counter)
+            counter += 1
+            ids = self.guilds[guild_shard(guild_id, shard_count)]
+            if len(ids) < guilds_per_shard:
+                ids.append(guild_id)
+        # shard id to (websocket, process that identified)
+        self.shards: Dict[int, Tuple[web.WebSocketResponse, str]] = {}
+        self.identified: List[Tuple[int, str]] = []
+        self.heartbeats: Dict[int, int] = {}
+        # (channel id, content, process that sent it)
+        self.sent: List[Tuple[int, str, str]] = []
+        self.url = ""
+        self._runner: Optional[web.AppRunner] = None
+        self._sequence = 0
+        self._message = 0
+        self._changed = asyncio.Event()
+
+    async def start(self) -> str:
+        """Starts the server and returns its url."""
+        app = web.Application()
+        app.router.add_get("/gateway", self.gateway)
+        api = "/api/v10"
+        app.router.add_get(f"{api}/users/@me", self.me)
+        app.router.add_get(f"{api}/oauth2/applications/@me", self.application)
+        app.router.add_get(f"{api}/gateway/bot", self.gateway_bot)
+        app.router.add_get(f"{api}/gateway", self.gateway_bot)
+        app.router.add_post(f"{api}/channels/{{channel_id}}/typing", self.typing)
+        app.router.add_post(f"{api}/channels/{{channel_id}}/messages", self.message)
+        app.router.add_route("*", f"{api}/{{tail:.*}}", self.other)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[
+            1
+        ]  # pylint: disable=protected-access
+        self.url = f"http://127.0.0.1:{port}"
+        return self.url
+
+    async def stop(self):
+        for ws, _ in list(self.shards.values()):
+            await ws.close()
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    ######
+    # HTTP API
+    ######
+
+    @staticmethod
+    def _process(request: web.Request) -> str:
+        agent = request.headers.get("User-Agent", "")
+        return (
+            agent.rpartition("shard-process/")[2] if "shard-process/" in agent else ""
+        )
+
+    async def me(self, request: web.Request):
+        return _json(_user(BOT_ID, "BirdID", bot=True))
+
+    async def application(self, request: web.Request):
+        return _json(
+            {
+                "id": str(BOT_ID),
+                "name": "BirdID",
+                "description": "",
+                "icon": None,
+                "bot_public": True,
+                "bot_require_code_grant": False,
+                "owner": _user(OWNER_ID, "owner"),
+                "verify_key": "",
+                "flags": 0,
+            }
+        )
+
+    async def gateway_bot(self, request: web.Request):
+        return _json(
+            {
+                "url": self.url.replace("http", "ws", 1) + "/gateway",
+                "shards": self.shard_count,
+                "session_start_limit": {
+                    "total": 1000,
+                    "remaining": 1000,
+                    "reset_after": 0,
+                    "max_concurrency": self.shard_count,
+                },
+            }
+        )
+
+    async def typing(self, request: web.Request):
+        return web.Response(status=204)
+
+    async def message(self, request: web.Request):
+        channel_id = int(request.match_info["channel_id"])
+        if request.content_type == "application/json":
+            payload = await request.json()
+        else:
+            payload = {}
+            async for part in await request.multipart():
+                if part.name == "payload_json":
+                    payload = json.loads(await part.text())
+        content = payload.get("content") or ""
+        for embed in payload.get("embeds") or []:
+            content += "\n" + json.dumps(embed)
+        self.sent.append((channel_id, content, self._process(request)))
+        self._changed.set()
+        self._message += 1
+        return _json(
+            self._message_data(channel_id, _user(BOT_ID, "BirdID", bot=True), content)
+        )
+
+    async def other(self, request: web.Request):
+        return _json(
+            {"message": "Unknown", "code": 0},
+            status=404 if request.method == "GET" else 200,
+        )
+
+    ######
+    # Gateway
+    ######
+
+    async def _send(self, ws: web.WebSocketResponse, op: int, data, event=None):
+        payload = {"op": op, "d": data, "s": None, "t": event}
+        if op == 0:
+            self._sequence += 1
+            payload["s"] = self._sequence
+        await ws.send_str(json.dumps(payload))
+
+    def _guild_data(self, guild_id: int) -> dict:
+        return {
+            "id": str(guild_id),
+            "name": f"Guild {guild_id}",
+            "icon": None,
+            "owner_id": str(OWNER_ID),
+            "unavailable": False,
+            "large": False,
+            "member_count": 2,
+            "features": [],
+            "emojis": [],
+            "stickers": [],
+            "roles": [
+                {
+                    "id": str(guild_id),
+                    "name": "@everyone",
+                    "permissions": PERMISSIONS,
+                    "position": 0,
+                    "color": 0,
+                    "hoist": False,
+                    "managed": False,
+                    "mentionable": False,
+                }
+            ],
+            "channels": [
+                {
+                    "id": str(guild_id),
+                    "type": 0,
+                    "name": "general",
+                    "position": 0,
+                    "permission_overwrites": [],
+                    "nsfw": False,
+                }
+            ],
+            "members": [
+                {
+                    "user": _user(BOT_ID, "BirdID", bot=True),
+                    "roles": [],
+                    "joined_at": _now(),
+                    "deaf": False,
+                    "mute": False,
+                    "flags": 0,
+                }
+            ],
+            "voice_states": [],
+            "presences": [],
+            "threads": [],
+            "stage_instances": [],
+            "guild_scheduled_events": [],
+            "verification_level": 0,
+            "default_message_notifications": 0,
+            "explicit_content_filter": 0,
+            "mfa_level": 0,
+            "premium_tier": 0,
+            "preferred_locale": "en-US",
+            "nsfw_level": 0,
+        }
+
+    @staticmethod
+    def _message_data(channel_id: int, author: dict, content: str, guild_id=None):
+        data = {
+            "id": str(snowflake(10**6) + channel_id % 1000),
+            "channel_id": str(channel_id),
+            "author": author,
+            "content": content,
+            "timestamp": _now(),
+            "edited_timestamp": None,
+            "tts": False,
+            "mention_everyone": False,
+            "mentions": [],
+            "mention_roles": [],
+            "attachments": [],
+            "embeds": [],
+            "pinned": False,
+            "type": 0,
+        }
+        if guild_id is not None:
+            data["guild_id"] = str(guild_id)
+            data["member"] = {
+                "roles": [],
+                "joined_at": _now(),
+                "deaf": False,
+                "mute": False,
+                "flags": 0,
+            }
+        return data
+
+    async def gateway(self, request: web.Request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        process = self._process(request)
+        await self._send(ws, 10, {"heartbeat_interval": HEARTBEAT_INTERVAL})
+        async for msg in ws:
+            if msg.type != aiohttp.WSMsgType.TEXT:
+                continue
+            payload = json.loads(msg.data)
+            if payload["op"] == 1:  # heartbeat
+                for shard_id, (shard_ws, _) in self.shards.items():
+                    if shard_ws is ws:
+                        self.heartbeats[shard_id] = self.heartbeats.get(shard_id, 0) + 1
+                await self._send(ws, 11, None)
+                self._changed.set()
+            elif payload["op"] == 2:  # identify
+                shard_id, _ = payload["d"].get("shard", [0, 1])
+                self.shards[shard_id] = (ws, process)
+                self.identified.append((shard_id, process))
+                guild_ids = self.guilds[shard_id]
+                await self._send(
+                    ws,
+                    0,
+                    {
+                        "v": 10,
+                        "user": _user(BOT_ID, "BirdID", bot=True),
+                        "guilds": [
+                            {"id": str(guild_id), "unavailable": True}
+                            for guild_id in guild_ids
+                        ],
+                        "session_id": f"session-{shard_id}",
+                        "resume_gateway_url": self.url.replace("http", "ws", 1)
+                        + "/gateway",
+                        "shard": [shard_id, self.shard_count],
+                        "application": {"id": str(BOT_ID), "flags": 0},
+                    },
+                    "READY",
+                )
+                for guild_id in guild_ids:
+                    await self._send(ws, 0, self._guild_data(guild_id), "GUILD_CREATE")
+                self._changed.set()
+        for shard_id, (shard_ws, _) in list(self.shards.items()):
+            if shard_ws is ws:
+                del self.shards[shard_id]
+        return ws
+
+    ######
+    # Test helpers
+    ######
+
+    async def wait_for(self, check, timeout: float = 60):
+        """Waits until `check()` is true, raising TimeoutError after `timeout`."""
+
+        async def wait():
+            while not check():
+                self._changed.clear()
+                # check again now and then, for checks on things besides the fake
+                try:
+                    await asyncio.wait_for(self._changed.wait(), 0.5)
+                except asyncio.TimeoutError:
+                    pass
+
+        await asyncio.wait_for(wait(), timeout)
+
+    def ready(self) -> bool:
+        """Returns if every shard has connected and sent a heartbeat."""
+        return all(self.heartbeats.get(shard_id) for shard_id in self.guilds)
+
+    async def send_message(self, guild_id: int, content: str):
+        """Sends a message from a user in the channel of a guild."""
+        ws, _ = self.shards[guild_shard(guild_id, self.shard_count)]
+        self._message += 1
+        data = self._message_data(guild_id, _user(USER_ID, "user"), content, guild_id)
+        data["id"] = str(snowflake(2 * 10**6 + self._message))
+        await self._send(ws, 0, data, "MESSAGE_CREATE")
+
+    def replies(self, guild_id: int) -> List[Tuple[str, str]]:
+        """Returns (content, process) of messages the bot sent in a guild."""
+        return [
+            (content, process)
+            for channel_id, content, process in self.sent
+            if channel_id == guild_id
+        ]
+
+
+def shard_env(url: str, processes: int, shard_count: int, storage: str) -> dict:
+    """Returns the environment for shard processes that use the fake gateway."""
+    return {
+        **os.environ,
+        "FAKE_DISCORD_URL": url,
+        "SCIOLY_ID_BOT_TOKEN": "fake",
+        "SCIOLY_ID_BOT_USE_SENTRY": "false",
+        "SCIOLY_ID_BOT_ENABLE_BACKUPS": "false",
+        "SCIOLY_ID_BOT_STORAGE": os.getenv("SCIOLY_ID_BOT_STORAGE", "sqlite"),
+        "SCIOLY_ID_BOT_STORAGE_PATH": os.path.join(storage, "database.sqlite3"),
+        "SCIOLY_ID_BOT_CACHE_SNAPSHOT": os.path.join(storage, "cache.snapshot"),
+        "SCIOLY_ID_BOT_SHARD_COUNT": str(shard_count),
+        "SCIOLY_ID_BOT_SHARD_PROCESSES": str(processes),
+    }
+
+
+async def start_shards(env: dict, processes: int) -> List[asyncio.subprocess.Process]:
+    """Starts the shard processes with the same environment as bot.sharding."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return [
+        await asyncio.create_subprocess_exec(
+            sys.executable,
+            os.path.abspath(__file__),
+            "shard",
+            cwd=root,
+            env={**env, "SCIOLY_ID_BOT_SHARD_PROCESS": str(process)},
+        )
+        for process in range(processes)
+    ]
+
+
+def running(children: List[asyncio.subprocess.Process]) -> bool:
+    """Raises an error if a shard process exited, so tests don't wait for nothing."""
+    for child in children:
+        if child.returncode is not None:
+            raise RuntimeError(f"shard process exited with {child.returncode}")
+    return True
+
+
+async def stop_shards(children: List[asyncio.subprocess.Process]):
+    for child in children:
+        if child.returncode is None:
+            child.terminate()
+    for child in children:
+        try:
+            await asyncio.wait_for(child.wait(), 20)
+        except asyncio.TimeoutError:
+            child.kill()
+
+
+def run_shard():
+    """Runs the bot with the Discord API at FAKE_DISCORD_URL."""
+    # pylint: disable=import-outside-toplevel
+    import discord.gateway
+    import discord.http
+    import yarl
+
+    sys.path.insert(0, os.getcwd())
+    url = os.environ["FAKE_DISCORD_URL"]
+    discord.http.Route.BASE = url + "/api/v10"
+    # used instead of /gateway/bot when the shard count is set
+    discord.gateway.DiscordWebSocket.DEFAULT_GATEWAY = yarl.URL(
+        url.replace("http", "ws", 1) + "/gateway"
+    )
+    # tag requests so the fake knows which process sent them
+    process = os.getenv("SCIOLY_ID_BOT_SHARD_PROCESS", "0")
+    init = discord.http.HTTPClient.__init__
+
+    def tagged_init(self, *args, **kwargs):
+        init(self, *args, **kwargs)
+        self.user_agent += f" shard-process/{process}"
+
+    discord.http.HTTPClient.__init__ = tagged_init
+
+    async def no_identify_wait(self, shard_id, *, initial=False):
+        pass
+
+    # the fake gateway doesn't rate limit identifying
+    discord.Client.before_identify_hook = no_identify_wait
+    runpy.run_module("bot", run_name="__main__", alter_sys=True)
+
+
+async def main(processes: int, shard_count: int, command: str, expect: str):
+    fake = FakeDiscord(shard_count)
+    url = await fake.start()
+    with tempfile.TemporaryDirectory() as storage:
+        children = await start_shards(
+            shard_env(url, processes, shard_count, storage), processes
+        )
+        try:
+            await fake.wait_for(lambda: running(children) and fake.ready(), 120)
+            print(f"identified: {sorted(fake.identified)}")
+            for shard_id, guild_ids in fake.guilds.items():
+                for guild_id in guild_ids:
+                    await fake.send_message(guild_id, command)
+            guild_ids = [ids[0] for ids in fake.guilds.values()]
+            await fake.wait_for(
+                lambda: running(children)
+                and all(
+                    any(expect in content for content, _ in fake.replies(guild_id))
+                    for guild_id in guild_ids
+                ),
+                60,
+            )
+            for shard_id, ids in fake.guilds.items():
+                for guild_id in ids:
+                    for content, process in fake.replies(guild_id):
+                        print(f"shard {shard_id} process {process}: {content}")
+        finally:
+            await stop_shards(children)
+            await fake.stop()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["shard"]:
+        run_shard()
+    else:
+        asyncio.run(
+            main(
+                int(sys.argv[1]) if len(sys.argv) > 1 else 2,
+                int(sys.argv[2]) if len(sys.argv) > 2 else 4,
+                sys.argv[3] if len(sys.argv) > 3 else "b!ping",
+                sys.argv[4] if len(sys.argv) > 4 else "Pong",
+            )
+        )
@@ -0,0 +1,110 @@
+import asyncio
+import hashlib
+import pickle
+import time
+
+import pytest
+
+from bot.cache import CACHES, Cache, cache, dumps, load_caches, loads, save_caches
+from bot.data import database
+
+
+class TestCache:
+    @pytest.fixture(autouse=True)
+    def test_suite_cleanup_thing(self):
+        yield
+        for key in database.scan_iter(match="cache.*test_cache_l2*"):
+            database.delete(key)
+
+    def test_lru(self):
+        store = Cache("test_lru", maxsize=2)
+        store.set("a", 1)
+        store.set("b", 2)
+        assert store.get("a") == 1
+        store.set("c", 3)
+        assert store.get("b") is None
+        assert store.get("a") == 1
+        assert store.stats()["evictions"] == 1
+
+    def test_ttl(self):
+        store = Cache("test_ttl", ttl=0.01)
+        store.set("a", 1)
+        time.sleep(0.02)
+        assert store.get("a") is None
+
+    def test_shared_miss(self):
+        calls = []
+
+        @cache()
+        async def slow(a, b):
+            calls.append((a, b))
+            await asyncio.sleep(0.01)
+            return a + b
+
+        async def run():
+            return await asyncio.gather(*(slow(1, 2) for _ in range(5)))
+
+        assert asyncio.run(run()) == [3] * 5
+        assert calls == [(1, 2)]
+        assert asyncio.run(slow(2, 1)) == 3
+        assert len(calls) == 2
+
+    def test_recursive(self):
+        @cache(pre=str.lower)
+        async def retry(bird, retries=0):
+            if retries < 2:
+                return await retry(bird, retries + 1)
+            return bird
+
+        assert asyncio.run(retry("Robin")) == "Robin"
+        assert asyncio.run(retry("ROBIN")) == "Robin"
+
+    def test_l2(self):
+        calls = []
+
+        @cache(local=False)
+        async def test_cache_l2(bird):
+            calls.append(bird)
+            return (bird, "code")
+
+        assert asyncio.run(test_cache_l2("robin")) == ("robin", "code")
+        test_cache_l2.cache.clear()
+        assert asyncio.run(test_cache_l2("robin")) == ("robin", "code")
+        assert calls == ["robin"]
+        assert test_cache_l2.cache.l2_size() == 1
+
+    def test_l2_old_entries(self):
+        # written by the old cache decorator: sha1 of str(key), bare pickle
+        digest = hashlib.sha1(b"Northern Cardinal").hexdigest()
+        database.set(
+            f"cache.test_cache_l2_old:{digest}", pickle.dumps(("cardinal", "NOCA"))
+        )
+
+        @cache(local=False)
+        async def test_cache_l2_old(bird):
+            raise AssertionError("should use the old entry")
+
+        assert asyncio.run(test_cache_l2_old("Northern Cardinal")) == (
+            "cardinal",
+            "NOCA",
+        )
+
+    def test_serializer(self):
+        for value in ("bird", ("a", "b"), {"a": [1, 2.5, None]}, time.gmtime(0)):
+            assert loads(dumps(value)) == value
+
+    def test_persist(self, tmp_path):
+        store = Cache("test_persist", ttl=60, persist=True)
+        CACHES["test_persist"] = store
+        store.set("robin", ("American Robin", 1))
+        path = str(tmp_path / "cache.snapshot")
+        try:
+            assert save_caches(path) >= 1
+            store.clear()
+            assert load_caches(path) >= 1
+            assert store.get("robin") == ("American Robin", 1)
+            store.clear()
+            assert load_caches(path, max_age=-1) == 0
+            assert store.get("robin") is None
+        finally:
+            del CACHES["test_persist"]
@@ -0,0 +1,90 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+from discord.ext import commands
+
+import bot.cooldowns
+import discord_mock as mock
+from bot.cooldowns import _take_token as take_token_with_owner
+from bot.cooldowns import bucket_key, take_token
+from bot.data import database
+from bot.functions import CustomCooldown
+
+
+class TestCooldowns:
+    @pytest.fixture(autouse=True)
+    def test_suite_cleanup_thing(self, monkeypatch):
+        monkeypatch.setattr(bot.cooldowns, "SHARED_COOLDOWNS", True)
+        # pylint: disable=attribute-defined-outside-init
+        self.ctx = mock.Context(mock.Bot())
+        self.ctx.command = SimpleNamespace(name="info", qualified_name="info")
+        self.ctx.message = SimpleNamespace(
+            author=self.ctx.author, channel=self.ctx.channel, guild=None
+        )
+        self.key = bucket_key("info.dm", self.ctx.author.id)
+        yield
+        database.delete(self.key)
+
+    def test_take_token(self):
+        assert take_token(self.key, 2, 0.2) == 0
+        assert take_token(self.key, 2, 0.2) == 0
+        retry_after = take_token(self.key, 2, 0.2)
+        assert 0 < retry_after <= 0.1
+        time.sleep(retry_after + 0.01)
+        assert take_token(self.key, 2, 0.2) == 0
+        assert 0 < database.pttl(self.key) <= 200
+
+    def test_shared_between_processes(self):
+        # separate instances keep separate local buckets, like processes do
+        first = CustomCooldown(10.0, bucket=commands.BucketType.user)
+        second = CustomCooldown(10.0, bucket=commands.BucketType.user)
+        assert first(self.ctx)
+        with pytest.raises(commands.CommandOnCooldown) as error:
+            second(self.ctx)
+        assert 4 < error.value.retry_after <= 5
+        # the local bucket answers without the database
+        database.delete(self.key)
+        with pytest.raises(commands.CommandOnCooldown):
+            first(self.ctx)
+
+    def test_local_buckets(self):
+        cooldown = CustomCooldown(10.0, bucket=commands.BucketType.channel)
+        assert cooldown(self.ctx)
+        assert not database.exists(bucket_key("info.dm", self.ctx.channel.id))
+        with pytest.raises(commands.CommandOnCooldown):
+            cooldown(self.ctx)
+        assert CustomCooldown(10.0, bucket=commands.BucketType.channel)(self.ctx)
+
+    def test_leased_tokens(self, monkeypatch):
+        cooldown = CustomCooldown(1.0, bucket=commands.BucketType.user)
+        other = CustomCooldown(1.0, bucket=commands.BucketType.user)
+
+        def slow_take_token(*args):
+            time.sleep(0.1)
+            return take_token_with_owner(*args)
+
+        async def main():
+            assert cooldown(self.ctx)
+            await asyncio.sleep(0.51)
+            # the lease takes the token without waiting on the database
+            monkeypatch.setattr(bot.cooldowns, "_take_token", slow_take_token)
+            start = time.perf_counter()
+            assert cooldown(self.ctx)
+            assert time.perf_counter() - start < 0.05
+            await asyncio.sleep(0.15)
+            assert database.hget(self.key, "owner").decode() == cooldown.leases.owner
+            monkeypatch.setattr(bot.cooldowns, "_take_token", take_token_with_owner)
+
+            # another process takes a token, so the lease is dropped
+            await asyncio.sleep(0.5)
+            assert other(self.ctx)
+            # allowed once more, since it's checked in the background
+            assert cooldown(self.ctx)
+            await asyncio.sleep(0.05)
+            assert self.key not in cooldown.leases._expires
+            with pytest.raises(commands.CommandOnCooldown):
+                cooldown(self.ctx)
+
+        asyncio.run(main())
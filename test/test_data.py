@@ -0,0 +1,32 @@
+import asyncio
+import contextvars
+
+from bot import data
+from bot.bird_index import current_index
+
+
+class TestData:
+    def test_views(self):
+        assert len(data.birdList) == len(data.current_data()["birdList"])
+        assert data.birdList[0] in data.birdList
+        assert data.birdList + ["Bird"] == data.current_data()["birdList"] + ["Bird"]
+        assert set(data.states.keys()) == set(data.current_data()["states"])
+
+    def test_reload_pinned(self):
+        async def reload():
+            return await data.reload_data(force=True)
+
+        async def run():
+            pinned = data.pin_data()
+            index = current_index()
+            # reload from a task that hasn't pinned anything
+            task = contextvars.Context().run(asyncio.ensure_future, reload())
+            assert await task
+            assert data.current_data() is pinned
+            assert current_index() is index
+            data.pin_data()
+            assert data.current_data() is not pinned
+            assert current_index() is not index
+            assert data.birdList == pinned["birdList"]
+
+        asyncio.run(run())
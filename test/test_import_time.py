@@ -0,0 +1,66 @@
+import ast
+import os
+import subprocess
+import sys
+
+# seconds allowed to import the bot and all of its cogs
+IMPORT_BUDGET = float(os.getenv("SCIOLY_ID_BOT_IMPORT_BUDGET", "3.0"))
+
+COGS = (
+    "get_birds",
+    "check",
+    "skip",
+    "hint",
+    "score",
+    "stats",
+    "state",
+    "sessions",
+    "race",
+    "voice",
+    "meta",
+    "other",
+    "covid",
+)
+
+# only imported by the commands that use them
+LAZY_MODULES = (
+    "pandas",
+    "numpy",
+    "PIL.Image",
+    "eyed3",
+    "wikipedia",
+    "Crypto.Cipher.ChaCha20",
+    "requests",
+)
+
+SCRIPT = f"""
+import sys
+import time
+
+start = time.perf_counter()
+import bot.__main__
+{"".join(f"import bot.cogs.{cog}; " for cog in COGS)}
+elapsed = time.perf_counter() - start
+
+# type() doesn't load a lazy module, unlike attribute access
+loaded = [
+    name
+    for name in {LAZY_MODULES!r}
+    if name in sys.modules and type(sys.modules[name]).__name__ != "_LazyModule"
+]
+print(repr((elapsed, loaded)))
+"""
+
+
+class TestImportTime:
+    def test_import_budget(self):
+        result = subprocess.run(
+            [sys.executable, "-c", SCRIPT],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        )
+        elapsed, loaded = ast.literal_eval(result.stdout.strip().split("\n")[-1])
+        assert elapsed < IMPORT_BUDGET
+        assert loaded == []
@@ -0,0 +1,52 @@
+import asyncio
+
+import discord
+
+import discord_mock as mock
+from bot.outbox import MAX_MESSAGE, Outbox
+
+
+class TestOutbox:
+    def setup(self):
+        # pylint: disable=attribute-defined-outside-init
+        self.ctx = mock.Context(mock.Bot())
+
+    def test_combine(self):
+        self.setup()
+        outbox = Outbox(self.ctx)
+        outbox.add("Correct! Good job! The bird was **Canada Goose**.")
+        outbox.add("https://en.wikipedia.org/wiki/Canada_goose")
+        asyncio.run(outbox.flush())
+        assert len(self.ctx.messages) == 1
+        assert self.ctx.messages[0].content.split("\n") == [
+            "Correct! Good job! The bird was **Canada Goose**.",
+            "https://en.wikipedia.org/wiki/Canada_goose",
+        ]
+        asyncio.run(outbox.flush())
+        assert len(self.ctx.messages) == 1
+
+    def test_blocks(self):
+        self.setup()
+        birds = [f"Bird {i}" for i in range(600)]
+        outbox = Outbox(self.ctx)
+        outbox.add("**The NATS bird list:**")
+        outbox.add_block(birds)
+        asyncio.run(outbox.flush())
+        assert 1 < len(self.ctx.messages) < 5
+        found = []
+        for message in self.ctx.messages:
+            assert len(message.content) <= MAX_MESSAGE
+            assert message.content.count("```") % 2 == 0
+            found += [line.strip("`") for line in message.content.split("\n")]
+        assert [line for line in found if line.startswith("Bird")] == birds
+
+    def test_file(self):
+        self.setup()
+        outbox = Outbox(self.ctx, max_pages=1, filename="nats.txt", summary="list")
+        outbox.add("**The NATS bird list:**")
+        outbox.add_block([f"Bird {i}" for i in range(600)])
+        asyncio.run(outbox.flush())
+        assert len(self.ctx.messages) == 1
+        assert self.ctx.messages[0].content == "list"
+        assert isinstance(self.ctx.messages[0].file, discord.File)
+        assert self.ctx.messages[0].file.filename == "nats.txt"
@@ -0,0 +1,170 @@
+import asyncio
+import gc
+
+import bot.lookahead
+import bot.races
+from bot.data import database
+from bot.filters import Filter, MediaType
+from bot.races import RACES_KEY, Race, end_race, get_race, start_race
+
+CHANNEL = 1234
+
+RACE_DATA = {
+    "start": 0,
+    "stop": 0,
+    "limit": 3,
+    "filter": "0",
+    "state": "NATS",
+    "media": "images",
+    "taxon": "",
+    "strict": "strict",
+    "alpha": "",
+}
+
+
+class TestRaces:
+    def setup(self):
+        end_race(CHANNEL)
+        bot.races._races.clear()  # pylint: disable=protected-access
+        bot.races._loaded = False  # pylint: disable=protected-access
+
+    def test_write_through(self):
+        self.setup()
+        race = start_race(CHANNEL, RACE_DATA, "1")
+        race.add_score("2", 2)
+        race.add_score("1", 1)
+        assert race.leaderboard(1) == [("2", 2)]
+        assert race.rank("1") == 1
+        assert race.rank("3") is None
+
+        bot.races._races.clear()  # pylint: disable=protected-access
+        bot.races._loaded = False  # pylint: disable=protected-access
+        loaded = get_race(CHANNEL)
+        assert loaded is not race
+        assert loaded.scores == {"1": 1, "2": 2}
+        assert loaded.to_dict() == race.to_dict()
+        assert loaded.strict and not loaded.alpha
+
+        end_race(CHANNEL)
+        assert get_race(CHANNEL) is None
+        assert not database.exists(f"race.data:{{{CHANNEL}}}")
+        assert not database.sismember(RACES_KEY, CHANNEL)
+
+    def test_load_index(self):
+        self.setup()
+        start_race(CHANNEL, RACE_DATA, "1")
+        # ended without being removed from the index
+        database.sadd(RACES_KEY, CHANNEL + 1)
+        bot.races._races.clear()  # pylint: disable=protected-access
+        bot.races.load_races()
+        assert list(bot.races._races) == [CHANNEL]  # pylint: disable=protected-access
+        assert database.smembers(RACES_KEY) == {str(CHANNEL).encode()}
+        end_race(CHANNEL)
+
+    def test_race_channels_in_memory(self):
+        self.setup()
+        start_race(CHANNEL, RACE_DATA, "1")
+        bot.races._races.clear()  # pylint: disable=protected-access
+        bot.races._loaded = False  # pylint: disable=protected-access
+        # doesn't load races from the database
+        assert CHANNEL not in bot.races.race_channels()
+        bot.races.load_races()
+        assert CHANNEL in bot.races.race_channels()
+        end_race(CHANNEL)
+        assert CHANNEL not in bot.races.race_channels()
+
+    def test_leaderboard_ties(self):
+        race = Race(CHANNEL, RACE_DATA, {"1": 1, "3": 1, "2": 0})
+        assert race.leaderboard() == [("3", 1), ("1", 1), ("2", 0)]
+
+    def test_run_in_order(self):
+        race = Race(CHANNEL, RACE_DATA, {})
+        order = []
+
+        async def event(name, delay):
+            order.append(f"start {name}")
+            await asyncio.sleep(delay)
+            order.append(f"end {name}")
+            if name == "a":
+                # events can run other events of the same race
+                await race.run(event, "nested", 0)
+            return name
+
+        async def main():
+            results = await asyncio.gather(
+                race.run(event, "a", 0.05), race.run(event, "b", 0)
+            )
+            race.close()
+            await race.run(event, "closed", 0)
+            return results
+
+        assert asyncio.run(main()) == ["a", "b"]
+        assert order == [
+            "start a",
+            "end a",
+            "start nested",
+            "end nested",
+            "start b",
+            "end b",
+            "start closed",
+            "end closed",
+        ]
+
+    def test_run_cancelled(self):
+        race = Race(CHANNEL, RACE_DATA, {})
+
+        async def cancelled():
+            raise asyncio.CancelledError()
+
+        async def event(name):
+            return name
+
+        async def main():
+            first = asyncio.ensure_future(race.run(cancelled))
+            second = asyncio.ensure_future(race.run(event, "b"))
+            # a cancelled event doesn't stop the events after it
+            results = await asyncio.gather(first, second, return_exceptions=True)
+            assert isinstance(results[0], asyncio.CancelledError)
+            assert results[1] == "b"
+
+            slow = asyncio.ensure_future(race.run(asyncio.sleep, 1))
+            waiting = asyncio.ensure_future(race.run(event, "c"))
+            await asyncio.sleep(0)
+            # waiting events are cancelled when the worker is
+            race._worker.cancel()  # pylint: disable=protected-access
+            results = await asyncio.gather(slow, waiting, return_exceptions=True)
+            assert all(isinstance(r, asyncio.CancelledError) for r in results)
+            assert await race.run(event, "d") == "d"
+
+        asyncio.run(main())
+
+    def test_end_race_stops_prefetching(self, monkeypatch):
+        async def prefetch(bird, media_type, filters):
+            if bird == "failing":
+                raise ValueError("download failed")
+            await asyncio.sleep(10)
+
+        monkeypatch.setattr(bot.lookahead, "_prefetch", prefetch)
+        loop_errors = []
+
+        async def main():
+            asyncio.get_running_loop().set_exception_handler(
+                lambda loop, context: loop_errors.append(context)
+            )
+            lookahead = bot.lookahead.race_lookahead(CHANNEL, MediaType.IMAGE, Filter())
+            lookahead._fill(["failing"], "")  # pylint: disable=protected-access
+            await asyncio.sleep(0)
+            # failed downloads that are never awaited aren't reported as errors
+            lookahead.queue.clear()
+            gc.collect()
+
+            lookahead._fill(["cardinal"], "")  # pylint: disable=protected-access
+            tasks = [task for _, task in lookahead.queue]
+            end_race(CHANNEL)
+            await asyncio.gather(*tasks, return_exceptions=True)
+            assert all(task.cancelled() for task in tasks)
+            # pylint: disable=protected-access
+            assert CHANNEL not in bot.lookahead._races
+
+        asyncio.run(main())
+        assert not loop_errors
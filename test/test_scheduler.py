@@ -0,0 +1,145 @@
+import asyncio
+
+import redis
+
+import bot.scheduler
+from bot.data import database
+from bot.scheduler import LEADER_KEY, Job, Scheduler
+
+
+class TestScheduler:
+    def setup(self):
+        database.delete(
+            LEADER_KEY,
+            "scheduler.last:global",
+            "scheduler.duration:global",
+            "scheduler.job:{cluster}",
+        )
+
+    def test_skips_overlapping_runs(self):
+        self.setup()
+        scheduler = Scheduler()
+        release = asyncio.Event()
+
+        async def slow():
+            await release.wait()
+
+        job = Job("slow", slow, 60)
+
+        async def main():
+            first = asyncio.ensure_future(scheduler.run(job))
+            await asyncio.sleep(0)
+            assert job.running
+            assert not await scheduler.run(job)
+            release.set()
+            assert await first
+
+        asyncio.run(main())
+        assert job.runs == 1 and job.skipped == 1
+        assert not job.running
+
+    def test_metrics_and_failures(self):
+        self.setup()
+        scheduler = Scheduler()
+
+        async def fail():
+            raise ValueError("job failed")
+
+        scheduler.job(seconds=60, name="fail")(fail)
+        job = scheduler.jobs["fail"]
+        assert 54 <= job.next_interval <= 66
+        assert asyncio.run(scheduler.run(job))
+        stats = scheduler.stats()["fail"]
+        assert stats["runs"] == 1 and stats["failures"] == 1
+        assert stats["last_duration"] is not None
+        assert not stats["running"]
+
+    def test_cluster_job_runs_once(self):
+        self.setup()
+        schedulers = [Scheduler(), Scheduler()]
+        runs = []
+        for index, scheduler in enumerate(schedulers):
+            scheduler.identity += f":{index}"
+
+            async def cluster(index=index):
+                runs.append(index)
+
+            scheduler.job(hours=1, cluster=True, name="cluster")(cluster)
+
+            async def local(index=index):
+                runs.append(f"local {index}")
+
+            scheduler.job(hours=1, name="local")(local)
+
+        async def main():
+            for scheduler in schedulers:
+                scheduler.start()
+            await asyncio.sleep(0.1)
+            leader = schedulers[0].leader()
+            for scheduler in schedulers:
+                await scheduler.stop()
+            return leader
+
+        leader = asyncio.run(main())
+        assert leader == schedulers[0].identity
+        assert sorted(runs, key=str) == [0, "local 0", "local 1"]
+        assert not database.exists(LEADER_KEY)
+        durations = schedulers[0].cluster_durations()
+        assert [name for name, _, _ in durations] == ["cluster"]
+        assert durations[0][2] is not None
+
+    def test_new_leader_waits_until_due(self):
+        self.setup()
+        runs = []
+
+        async def cluster():
+            runs.append(1)
+
+        async def main():
+            for _ in range(2):
+                scheduler = Scheduler()
+                scheduler.job(hours=1, cluster=True, name="cluster")(cluster)
+                scheduler.start()
+                await asyncio.sleep(0.1)
+                assert scheduler.is_leader
+                await scheduler.stop()
+
+        asyncio.run(main())
+        # the second leader sees the job ran recently
+        assert runs == [1]
+
+    def test_database_errors(self, monkeypatch):
+        self.setup()
+        runs = []
+        scheduler = Scheduler()
+
+        async def cluster():
+            runs.append(1)
+
+        scheduler.job(seconds=0.05, jitter=0, cluster=True, name="cluster")(cluster)
+        elect = scheduler._elect  # pylint: disable=protected-access
+        errors = []
+
+        def fail(*args):
+            errors.append(1)
+            raise redis.exceptions.ConnectionError("down")
+
+        async def main():
+            monkeypatch.setattr(scheduler, "_elect", fail)
+            scheduler.start()
+            assert not scheduler.is_leader
+            monkeypatch.setattr(scheduler, "_elect", elect)
+            assert scheduler._elect()  # pylint: disable=protected-access
+
+            monkeypatch.setattr(scheduler, "_until_due", fail)
+            await asyncio.sleep(0.12)
+            monkeypatch.undo()
+            await asyncio.sleep(0.12)
+            await scheduler.stop()
+
+        asyncio.run(main())
+        # the job kept running after the database errors
+        assert len(errors) > 1 and runs
+
+    def test_run_blocking(self):
+        assert asyncio.run(bot.scheduler.run_blocking(sum, [1, 2])) == 3
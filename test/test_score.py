@@ -10,21 +10,21 @@ from bot.data_functions import channel_setup, user_setup
 
 
 class TestScore:
-    @pytest.yield_fixture(autouse=True)
+    @pytest.fixture(autouse=True)
     def test_suite_cleanup_thing(self):
         yield
-        database.delete(f"channel:{self.ctx.channel.id}")
+        database.delete(f"channel:{{{self.ctx.channel.id}}}")
         database.zrem("score:global", str(self.ctx.channel.id))
 
         database.zrem("users:global", str(self.ctx.author.id))
         database.zrem("streak:global", str(self.ctx.author.id))
         database.zrem("streak.max:global", str(self.ctx.author.id))
-        database.delete(f"incorrect.user:{self.ctx.author.id}")
-        database.delete(f"correct.user:{self.ctx.author.id}")
+        database.delete(f"incorrect.user:{{{self.ctx.author.id}}}")
+        database.delete(f"correct.user:{{{self.ctx.author.id}}}")
 
         if self.ctx.guild is not None:
-            database.delete(f"users.server:{self.ctx.guild.id}")
-            database.delete(f"incorrect.server:{self.ctx.guild.id}")
+            database.delete(f"users.server:{{{self.ctx.guild.id}}}")
+            database.delete(f"incorrect.server:{{{self.ctx.guild.id}}}")
 
     def setup(self, guild=False):
         # pylint: disable=attribute-defined-outside-init
@@ -35,7 +35,7 @@ class TestScore:
         if guild:
             self.ctx.set_guild()
 
-        database.delete(f"channel:{self.ctx.channel.id}")
+        database.delete(f"channel:{{{self.ctx.channel.id}}}")
         database.zrem("score:global", str(self.ctx.channel.id))
 
         database.zrem("users:global", str(self.ctx.author.id))
@@ -43,7 +43,7 @@ class TestScore:
         database.zrem("streak.max:global", str(self.ctx.author.id))
 
         if self.ctx.guild is not None:
-            database.delete(f"users.server:{self.ctx.guild.id}")
+            database.delete(f"users.server:{{{self.ctx.guild.id}}}")
 
         asyncio.run(channel_setup(self.ctx))
         asyncio.run(user_setup(self.ctx))
@@ -0,0 +1,63 @@
+import asyncio
+import tempfile
+
+from bot.sharding import process_shards
+from fake_gateway import (
+    FakeDiscord,
+    guild_shard,
+    running,
+    shard_env,
+    start_shards,
+    stop_shards,
+)
+
+
+class TestSharding:
+    def test_process_shards(self):
+        shards = [process_shards(10, 3, process) for process in range(3)]
+        assert shards == [[0, 3, 6, 9], [1, 4, 7], [2, 5, 8]]
+        assert process_shards(2, 3, 2) == []
+
+    def test_fake_gateway(self):
+        processes, shard_count = 2, 4
+
+        async def run():
+            fake = FakeDiscord(shard_count)
+            url = await fake.start()
+            with tempfile.TemporaryDirectory() as storage:
+                children = await start_shards(
+                    shard_env(url, processes, shard_count, storage), processes
+                )
+                try:
+                    await fake.wait_for(lambda: running(children) and fake.ready(), 120)
+                    guild_ids = [ids[0] for ids in fake.guilds.values()]
+                    for guild_id in guild_ids:
+                        await fake.send_message(guild_id, "b!ping")
+                    await fake.wait_for(
+                        lambda: running(children)
+                        and all(
+                            any("Pong" in content for content, _ in fake.replies(g))
+                            for g in guild_ids
+                        ),
+                        60,
+                    )
+                finally:
+                    await stop_shards(children)
+                    await fake.stop()
+            return fake
+
+        fake = asyncio.run(run())
+        # each shard connected once, from the process it belongs to
+        assert sorted(fake.identified) == [
+            (shard_id, str(shard_id % processes)) for shard_id in range(shard_count)
+        ]
+        for ids in fake.guilds.values():
+            replies = fake.replies(ids[0])
+            pongs = [content for content, _ in replies if "Pong" in content]
+            assert len(pongs) == 1
+            # only the process with the guild's shard answers
+            owner = str(guild_shard(ids[0], shard_count) % processes)
+            assert {process for _, process in replies} == {owner}
+        # the user is set up in the shared database by at most one process
+        welcomes = [content for _, content, _ in fake.sent if "Welcome" in content]
+        assert len(welcomes) <= 1
@@ -9,21 +9,21 @@ from bot.data_functions import channel_setup, user_setup
 
 
 class TestSkip:
-    @pytest.yield_fixture(autouse=True)
+    @pytest.fixture(autouse=True)
     def test_suite_cleanup_thing(self):
         yield
-        database.delete(f"channel:{self.ctx.channel.id}")
+        database.delete(f"channel:{{{self.ctx.channel.id}}}")
         database.zrem("score:global", str(self.ctx.channel.id))
 
         database.zrem("users:global", str(self.ctx.author.id))
         database.zrem("streak:global", str(self.ctx.author.id))
         database.zrem("streak.max:global", str(self.ctx.author.id))
-        database.delete(f"incorrect.user:{self.ctx.author.id}")
-        database.delete(f"correct.user:{self.ctx.author.id}")
+        database.delete(f"incorrect.user:{{{self.ctx.author.id}}}")
+        database.delete(f"correct.user:{{{self.ctx.author.id}}}")
 
         if self.ctx.guild is not None:
-            database.delete(f"users.server:{self.ctx.guild.id}")
-            database.delete(f"incorrect.server:{self.ctx.guild.id}")
+            database.delete(f"users.server:{{{self.ctx.guild.id}}}")
+            database.delete(f"incorrect.server:{{{self.ctx.guild.id}}}")
 
     def setup(self, guild=False):
         # pylint: disable=attribute-defined-outside-init
@@ -34,7 +34,7 @@ class TestSkip:
         if guild:
             self.ctx.set_guild()
 
-        database.delete(f"channel:{self.ctx.channel.id}")
+        database.delete(f"channel:{{{self.ctx.channel.id}}}")
         database.zrem("score:global", str(self.ctx.channel.id))
 
         database.zrem("users:global", str(self.ctx.author.id))
@@ -42,7 +42,7 @@ class TestSkip:
         database.zrem("streak.max:global", str(self.ctx.author.id))
 
         if self.ctx.guild is not None:
-            database.delete(f"users.server:{self.ctx.guild.id}")
+            database.delete(f"users.server:{{{self.ctx.guild.id}}}")
 
         asyncio.run(channel_setup(self.ctx))
         asyncio.run(user_setup(self.ctx))
@@ -59,7 +59,7 @@ class TestSkip:
     def test_skip_bird_dm(self):
         self.setup(guild=True)
         test_word = "Canada Goose"
-        database.hset(f"channel:{self.ctx.channel.id}", "bird", test_word)
+        database.hset(f"channel:{{{self.ctx.channel.id}}}", "bird", test_word)
 
         coroutine = self.cog.skip.callback(  # pylint: disable=no-member
             self.cog, self.ctx
@@ -0,0 +1,135 @@
+import pickle
+import time
+
+import pytest
+import redis
+
+from bot.storage import SQLiteStorage
+
+
+class TestStorage:
+    @pytest.fixture(autouse=True)
+    def test_suite_cleanup_thing(self, tmp_path):
+        # pylint: disable=attribute-defined-outside-init
+        self.database = SQLiteStorage(str(tmp_path / "database.sqlite3"))
+        yield
+        self.database.close()
+
+    def test_strings(self):
+        assert self.database.get("frequency.command:global") is None
+        self.database.set("frequency.command:global", "bird")
+        assert self.database.get("frequency.command:global") == b"bird"
+        assert self.database.incrby("counter", 5) == 5
+        assert self.database.incrby("counter", -2) == 3
+        assert self.database.get("counter") == b"3"
+
+    def test_expire(self):
+        self.database.set("cache.test:item", "value", ex=60)
+        assert 0 < self.database.pttl("cache.test:item") <= 60000
+        assert self.database.persist("cache.test:item")
+        assert self.database.pttl("cache.test:item") == -1
+        self.database.expire("cache.test:item", 0.01)
+        time.sleep(0.02)
+        assert self.database.get("cache.test:item") is None
+        assert self.database.pttl("cache.test:item") == -2
+        assert not self.database.exists("cache.test:item")
+
+    def test_hashes(self):
+        self.database.hset(
+            "channel:{1}", mapping={"bird": "", "answered": 1, "prevJ": 20}
+        )
+        self.database.hset("channel:{1}", "bird", "Northern Cardinal")
+        assert self.database.hget("channel:{1}", "bird") == b"Northern Cardinal"
+        assert self.database.hmget("channel:{1}", ["answered", "missing"]) == [
+            b"1",
+            None,
+        ]
+
+    def test_wrong_type(self):
+        self.database.hset("channel:{1}", "bird", "")
+        with pytest.raises(redis.exceptions.ResponseError):
+            self.database.zincrby("channel:{1}", 1, "bird")
+
+    def test_sets(self):
+        assert self.database.sadd("channels:{1}", "1", "2", "2") == 2
+        assert self.database.sismember("channels:{1}", "1")
+        assert self.database.scard("channels:{1}") == 2
+        self.database.sadd("channels:{2}", "3")
+        assert self.database.sunionstore("all", ["channels:{1}", "channels:{2}"]) == 3
+        assert self.database.smembers("all") == {b"1", b"2", b"3"}
+        assert self.database.srem("channels:{2}", "3") == 1
+        assert not self.database.exists("channels:{2}")
+
+    def test_sorted_sets(self):
+        self.database.zadd("users:global", {"a": 1, "b": 3, "c": 3})
+        self.database.zincrby("users:global", 2, "a")
+        assert self.database.zscore("users:global", "a") == 3.0
+        assert self.database.zrevrangebyscore(
+            "users:global", "+inf", "-inf", 0, 2, True
+        ) == [(b"c", 3.0), (b"b", 3.0)]
+        assert self.database.zrange("users:global", 0, -1) == [b"a", b"b", b"c"]
+        assert self.database.zrevrange("users:global", -1, -1) == [b"a"]
+        assert self.database.zrevrank("users:global", "b") == 1
+        assert self.database.zrangebyscore("users:global", "(1", 3) == [
+            b"a",
+            b"b",
+            b"c",
+        ]
+        assert self.database.zremrangebyscore("users:global", 0, 3) == 3
+        assert self.database.zcard("users:global") == 0
+
+    def test_rename_and_scan(self):
+        self.database.zadd("incorrect.user:1", {"bird": 1})
+        self.database.zadd("incorrect.user:{2}", {"bird": 1})
+        assert self.database.renamenx("incorrect.user:1", "incorrect.user:{1}")
+        assert not self.database.renamenx("incorrect.user:{1}", "incorrect.user:{2}")
+        keys = set(self.database.scan_iter(match="incorrect.user:*"))
+        assert keys == {b"incorrect.user:{1}", b"incorrect.user:{2}"}
+
+    def test_pipeline(self):
+        pipe = self.database.pipeline(transaction=False)
+        pipe.zincrby("daily.score:2021-01-01", 1, "user")
+        pipe.sadd("daily.dates:score", "2021-01-01")
+        pipe.hset("channel:{1}", "bird", "")
+        pipe.zincrby("channel:{1}", 1, "user")
+        results = pipe.execute(raise_on_error=False)
+        assert results[:3] == [1.0, 1, 1]
+        assert isinstance(results[3], redis.exceptions.ResponseError)
+        assert self.database.smembers("daily.dates:score") == {b"2021-01-01"}
+
+    def test_dump_restore(self):
+        self.database.zadd("streak:global", {"user": 4})
+        dumped = self.database.dump("streak:global")
+        assert pickle.loads(dumped)[0] == "zset"
+        with pytest.raises(redis.exceptions.ResponseError):
+            self.database.restore("streak:global", 0, dumped)
+        self.database.restore("streak.copy:global", 0, dumped)
+        assert self.database.zscore("streak.copy:global", "user") == 4.0
+
+    def test_lock(self):
+        lock = self.database.lock("scheduler.leader:global", timeout=60)
+        assert lock.acquire(blocking=False, token="first")
+        assert lock.owned() and lock.locked()
+        other = self.database.lock("scheduler.leader:global", timeout=60)
+        assert not other.acquire(blocking=False)
+        assert not other.acquire(blocking_timeout=0.05)
+        with pytest.raises(redis.exceptions.LockNotOwnedError):
+            other.release()
+        assert lock.reacquire()
+        lock.release()
+        assert not lock.locked()
+        with pytest.raises(redis.exceptions.LockNotOwnedError):
+            lock.reacquire()
+        with other:
+            assert other.owned() and not lock.owned()
+        assert not other.locked()
+
+    def test_lock_expires(self):
+        lock = self.database.lock("scheduler.job:{backup}", timeout=0.01)
+        assert lock.acquire(blocking=False)
+        time.sleep(0.02)
+        other = self.database.lock("scheduler.job:{backup}", timeout=60)
+        assert other.acquire(blocking=False)
+        with pytest.raises(redis.exceptions.LockNotOwnedError):
+            lock.release()
+        assert other.owned()
@@ -0,0 +1,70 @@
+import asyncio
+from types import SimpleNamespace
+
+import discord
+
+from bot.data import database
+from bot.functions import (
+    UserResolver,
+    _fetch_cached_user,
+    fetch_leaderboard_names,
+    fetch_user_names,
+)
+
+DELETED = 999999999999980001
+FAILING = 999999999999980002
+
+
+class Bot:
+    intents = SimpleNamespace(members=False)
+
+    async def fetch_user(self, user_id):
+        if user_id == DELETED:
+            raise discord.NotFound(SimpleNamespace(status=404, reason="Not Found"), "")
+        raise discord.HTTPException(
+            SimpleNamespace(status=503, reason="Service Unavailable"), ""
+        )
+
+
+class TestUsers:
+    def setup(self):
+        _fetch_cached_user.cache.clear()
+        for user_id in (DELETED, FAILING):
+            database.delete(f"user.display:{{{user_id}}}")
+
+    def test_resolve(self):
+        self.setup()
+        users = asyncio.run(UserResolver(Bot()).resolve([DELETED, FAILING]))
+        # errors other than NotFound don't mean the user was deleted
+        assert users == {DELETED: None}
+
+    def test_fetch_user_names(self):
+        self.setup()
+        names = asyncio.run(fetch_user_names([DELETED, FAILING], Bot()))
+        assert names == {DELETED: None}
+        # a recorded name is still used while Discord is failing
+        database.hset(
+            f"user.display:{{{FAILING}}}",
+            mapping={"name": "cardinal", "discriminator": "0"},
+        )
+        names = asyncio.run(fetch_user_names([FAILING], Bot()))
+        assert names == {FAILING: "cardinal#0"}
+        database.delete(f"user.display:{{{FAILING}}}")
+
+    def test_fetch_leaderboard_names(self):
+        self.setup()
+        guild_id = 999999999999980003
+        database.hset(
+            f"user.display:{{{FAILING}}}",
+            mapping={"name": "cardinal", "discriminator": "0"},
+        )
+        database.sadd(f"users.server.id:{{{guild_id}}}", str(FAILING))
+        names, members = asyncio.run(
+            fetch_leaderboard_names([DELETED, FAILING], Bot(), guild_id)
+        )
+        assert names == {DELETED: None, FAILING: "cardinal#0"}
+        assert members == {FAILING}
+        names, members = asyncio.run(fetch_leaderboard_names([FAILING], Bot(), None))
+        assert names == {FAILING: "cardinal#0"} and members == set()
+        database.delete(f"user.display:{{{FAILING}}}")
+        database.delete(f"users.server.id:{{{guild_id}}}")
@@ -0,0 +1,93 @@
+import asyncio
+import os
+import threading
+
+import pytest
+
+import bot.voice
+from bot.voice import PacketAudio, evict_packets, packet_file, write_packets
+
+PACKETS = [bytes([i]) * (i % 7 + 1) for i in range(200)]
+
+
+class TestVoice:
+    @pytest.fixture(autouse=True)
+    def test_suite_cleanup_thing(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(bot.voice, "PACKET_DIR", str(tmp_path / "voice"))
+        # pylint: disable=attribute-defined-outside-init
+        self.tmp_path = tmp_path
+        self.encoded = []
+        release = threading.Event()
+        self.release = release
+
+        def encode(filename, path):
+            release.wait(5)
+            self.encoded.append(filename)
+            return write_packets(path, PACKETS)
+
+        monkeypatch.setattr(bot.voice, "encode", encode)
+
+    def test_packet_file(self):
+        path = str(self.tmp_path / "packets.opk")
+        assert write_packets(path, PACKETS) == len(PACKETS)
+        source = PacketAudio(path)
+        assert source.is_opus()
+        assert source.count == len(PACKETS)
+        assert source.length == 4 and source.remaining == 4
+        assert [source.read() for _ in PACKETS] == PACKETS
+        assert source.read() == b""
+        assert source.remaining == 0
+
+        source.jump(-1)
+        assert source.read() == PACKETS[-50]
+        source.jump(None)
+        source.cleanup()
+        # played again after playback stopped
+        assert source.read() == PACKETS[0]
+        source.jump(-10).jump(100)
+        assert source.remaining == 0
+        source.cleanup()
+
+    def test_empty_packet_file(self, monkeypatch):
+        path = str(self.tmp_path / "empty.opk")
+        with pytest.raises(ValueError):
+            write_packets(path, [])
+        assert os.listdir(self.tmp_path) == []
+
+        # failed encodes aren't played or kept
+        monkeypatch.setattr(
+            bot.voice, "encode", lambda filename, path: write_packets(path, [])
+        )
+        recording = self.tmp_path / "broken.mp3"
+        recording.write_bytes(b"broken")
+        with pytest.raises(ValueError):
+            asyncio.run(packet_file(str(recording)))
+        assert not os.listdir(self.tmp_path / "voice")
+
+    def test_encodes_once(self):
+        recording = self.tmp_path / "song.mp3"
+        recording.write_bytes(b"recording")
+        copy = self.tmp_path / "copy.mp3"
+        copy.write_bytes(b"recording")
+
+        async def main():
+            plays = [
+                asyncio.ensure_future(packet_file(str(recording))) for _ in range(3)
+            ]
+            await asyncio.sleep(0.1)
+            self.release.set()
+            paths = await asyncio.gather(*plays)
+            paths.append(await packet_file(str(copy)))
+            return paths
+
+        paths = asyncio.run(main())
+        assert len(set(paths)) == 1
+        assert self.encoded == [str(recording)]
+        source = PacketAudio(paths[0])
+        assert source.read() == PACKETS[0]
+        source.cleanup()
+
+        evict_packets(max_age=60)
+        assert os.path.exists(paths[0])
+        evict_packets(max_age=-1)
+        assert not os.path.exists(paths[0])
@@ -14,14 +14,18 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import datetime
 import random
 from typing import Union
 
 from fastapi import Request
 
 from bot.data import database, logger
-from bot.data_functions import user_setup, score_increment
+from bot.data_functions import (
+    daily_increment,
+    mark_dirty,
+    score_increment,
+    user_setup,
+)
 from web.config import DATABASE_SESSION_EXPIRE, DATABASE_SESSION_USER_EXPIRE
 
 # Web Database Keys
@@ -35,7 +39,7 @@ from web.config import DATABASE_SESSION_EXPIRE, DATABASE_SESSION_USER_EXPIRE
 #   user_id: 0
 # }
 
-# web.user:user_id : {
+# web.user:{user_id} : {
 #   avatar_hash: ""
 #   avatar_url: "https://cdn.discordapp.com/avatars/{user_id}/{avatar_hash}.png"
 #   username: ""
@@ -70,8 +74,9 @@ async def update_web_user(request: Request, user_data: dict):
     user_id = str(user_data["id"])
     database.hset(f"web.session:{session_id}", "user_id", user_id)
     database.expire(f"web.session:{session_id}", DATABASE_SESSION_USER_EXPIRE)
-    database.hset(
-        f"web.user:{user_id}",
+    pipe = database.pipeline(transaction=False)
+    pipe.hset(
+        f"web.user:{{{user_id}}}",
         mapping={
             "avatar_hash": str(user_data["avatar"]),
             "avatar_url": f"https://cdn.discordapp.com/avatars/{user_id}/{user_data['avatar']}.png",
@@ -79,15 +84,13 @@ async def update_web_user(request: Request, user_data: dict):
             "discriminator": str(user_data["discriminator"]),
         },
     )
+    mark_dirty(f"web.user:{{{user_id}}}", pipe=pipe)
+    pipe.execute()
     await user_setup(user_id)
     tempScore = int(database.hget(f"web.session:{session_id}", "tempScore"))
     if tempScore not in (0, -1):
         score_increment(user_id, tempScore)
-        database.zincrby(
-            f"daily.webscore:{str(datetime.datetime.now(datetime.timezone.utc).date())}",
-            1,
-            user_id,
-        )
+        daily_increment("webscore", user_id)
         database.hset(f"web.session:{session_id}", "tempScore", -1)
     logger.info("updated user data")
 
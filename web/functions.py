@@ -20,7 +20,6 @@ import io
 from functools import partial
 from typing import Union
 
-import eyed3
 from fastapi import HTTPException, Request
 from fastapi.responses import FileResponse, StreamingResponse
 from sentry_sdk import capture_exception
@@ -28,8 +27,11 @@ from sentry_sdk import capture_exception
 from bot.core import _black_and_white, get_files, get_sciname
 from bot.data import GenericError, birdList, database, logger, screech_owls
 from bot.filters import Filter, MediaType
+from bot.lazy import lazy_import
 from web.data import get_session_id
 
+eyed3 = lazy_import("eyed3")
+
 
 def send_file(
     fp: Union[str, io.BufferedIOBase], **kwargs
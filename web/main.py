@@ -14,13 +14,15 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import asyncio
+import os
 import random
 import urllib.parse
 
 from fastapi import Request
 from fastapi.responses import HTMLResponse
 
-from bot.data import birdList
+from bot.data import birdList, pin_data, watch_data
 from bot.filters import Filter, MediaType
 from web import practice, user
 from web.config import app
@@ -31,6 +33,19 @@ app.include_router(practice.router)
 app.include_router(user.router)
 
 
+@app.middleware("http")
+async def pin_bird_data(request: Request, call_next):
+    # keep the same bird lists for the whole request, even if they're reloaded
+    pin_data()
+    return await call_next(request)
+
+
+@app.on_event("startup")
+async def start_data_watcher():
+    if os.getenv("SCIOLY_ID_BOT_WATCH_DATA") == "true":
+        app.state.data_watcher = asyncio.create_task(watch_data())
+
+
 @app.get("/", response_class=HTMLResponse)
 def api_index():
     logger.info("index page accessed")
@@ -14,7 +14,6 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import datetime
 import random
 import string
 
@@ -32,8 +31,9 @@ from bot.data import (
     songBirds,
 )
 from bot.data_functions import (
-    bird_setup,
+    daily_increment,
     incorrect_increment,
+    mark_dirty,
     score_increment,
     streak_increment,
 )
@@ -42,12 +42,13 @@ from web.data import database, get_session_id, logger
 from web.functions import get_sciname, send_bird, send_file
 
 router = APIRouter(prefix="/practice", tags=["practice"])
-date = lambda: str(datetime.datetime.now(datetime.timezone.utc).date())
 
 
-def increment_bird_frequency(bird, user_id):
-    bird_setup(user_id, bird)
-    database.zincrby("frequency.bird:global", 1, string.capwords(bird))
+def increment_bird_frequency(bird):
+    pipe = database.pipeline(transaction=False)
+    pipe.zincrby("frequency.bird:global", 1, string.capwords(bird))
+    mark_dirty("frequency.bird:global", pipe=pipe)
+    pipe.execute()
 
 
 @router.get("/get")
@@ -90,7 +91,7 @@ async def get_bird(
         currentBird = random.choice(id_list)
         user_id = int(database.hget(f"web.session:{session_id}", "user_id"))
         if user_id != 0:
-            increment_bird_frequency(currentBird, user_id)
+            increment_bird_frequency(currentBird)
         prevB = database.hget(f"web.session:{session_id}", "prevB").decode("utf-8")
         while currentBird == prevB and len(id_list) > 1:
             currentBird = random.choice(id_list)
@@ -137,10 +138,7 @@ async def check_bird(request: Request, guess: str):
     logger.info("currentBird: " + currentBird)
     logger.info("args: " + guess)
 
-    database.zincrby(f"daily.web:{date()}", 1, "check")
-    if user_id != 0:
-        bird_setup(user_id, currentBird)
-
+    daily_increment("web", "check")
     accepted_answers = [currentBird, sciBird]
     if currentBird == "screech owl":
         accepted_answers += screech_owls
@@ -157,7 +155,7 @@ async def check_bird(request: Request, guess: str):
 
         tempScore = int(database.hget(f"web.session:{session_id}", "tempScore"))
         if user_id != 0:
-            database.zincrby(f"daily.webscore:{date()}", 1, user_id)
+            daily_increment("webscore", user_id)
             score_increment(user_id, 1)
             streak_increment(user_id, 1)
         # elif tempScore >= 10:
@@ -178,7 +176,10 @@ async def check_bird(request: Request, guess: str):
     logger.info("incorrect")
     database.hset(f"web.session:{session_id}", "bird", "")
     database.hset(f"web.session:{session_id}", "answered", "1")
-    database.zincrby("incorrect:global", 1, currentBird)
+    pipe = database.pipeline(transaction=False)
+    pipe.zincrby("incorrect:global", 1, currentBird)
+    mark_dirty("incorrect:global", pipe=pipe)
+    pipe.execute()
 
     if user_id != 0:
         incorrect_increment(user_id, currentBird, 1)
@@ -200,7 +201,7 @@ async def skip_bird(request: Request):
 
     session_id = get_session_id(request)
     user_id = int(database.hget(f"web.session:{session_id}", "user_id"))
-    database.zincrby(f"daily.web:{date()}", 1, "skip")
+    daily_increment("web", "skip")
 
     currentBird = database.hget(f"web.session:{session_id}", "bird").decode("utf-8")
     if currentBird != "":  # check if there is bird
@@ -221,7 +222,7 @@ async def hint_bird(request: Request):
     logger.info("endpoint: hint bird")
 
     session_id = get_session_id(request)
-    database.zincrby(f"daily.web:{date()}", 1, "hint")
+    daily_increment("web", "hint")
 
     currentBird = database.hget(f"web.session:{session_id}", "bird").decode("utf-8")
     if currentBird != "":  # check if there is bird
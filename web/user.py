@@ -23,6 +23,8 @@ from fastapi import APIRouter, Request, HTTPException
 from fastapi.responses import RedirectResponse, JSONResponse
 from sentry_sdk import capture_exception
 
+from bot.data import read_database
+from bot.data_functions import mark_dirty
 from web.config import FRONTEND_URL, app
 from web.data import database, get_session_id, logger, update_web_user, verify_session
 
@@ -74,7 +76,11 @@ async def logout(request: Request, redirect: str = "/"):
 
     if isinstance(user_id, int):
         logger.info("deleting user data, session data")
-        database.delete(f"web.user:{user_id}", f"web.session:{session_id}")
+        pipe = database.pipeline(transaction=False)
+        pipe.delete(f"web.user:{{{user_id}}}")
+        pipe.delete(f"web.session:{session_id}")
+        mark_dirty(f"web.user:{{{user_id}}}", pipe=pipe)
+        pipe.execute()
     else:
         logger.info("deleting session data")
         database.delete(f"web.session:{session_id}")
@@ -116,19 +122,20 @@ def profile(request: Request):
     avatar_hash, avatar_url, username, discriminator = (
         stat.decode("utf-8")
         for stat in database.hmget(
-            f"web.user:{user_id}",
+            f"web.user:{{{user_id}}}",
             "avatar_hash",
             "avatar_url",
             "username",
             "discriminator",
         )
     )
-    score = int(database.zscore("users:global", str(user_id)))
-    max_streak = int(database.zscore("streak.max:global", str(user_id)))
+    reader = read_database()
+    score = int(reader.zscore("users:global", str(user_id)) or 0)
+    max_streak = int(reader.zscore("streak.max:global", str(user_id)) or 0)
     missed_birds = [
         [stats[0].decode("utf-8"), int(stats[1])]
-        for stats in database.zrevrangebyscore(
-            f"incorrect.user:{user_id}", "+inf", "-inf", 0, 10, True
+        for stats in reader.zrevrangebyscore(
+            f"incorrect.user:{{{user_id}}}", "+inf", "-inf", 0, 10, True
         )
     ]
     return {